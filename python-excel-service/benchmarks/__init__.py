@@ -0,0 +1,6 @@
+"""
+Benchmarks del servicio: libros sintéticos parametrizados y tiempos por etapa
+de la extracción, con comparación contra una línea base guardada.
+
+Uso: python -m benchmarks --help (desde python-excel-service/)
+"""
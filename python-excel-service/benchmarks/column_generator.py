@@ -0,0 +1,53 @@
+#!/usr/bin/env python3
+"""
+Columnas sintéticas para el benchmark de la validación por lotes
+
+Imitan lo que /import-columns entrega a import_validation.validate_columns:
+un arreglo por campo normalizado, las máscaras de error de la conversión
+numérica y los números de fila de la hoja. Cada regla predeterminada tiene
+alrededor de un 2% de valores inválidos (códigos repetidos, anchos fuera de
+rango, altos vacíos, materiales y vidrios que no están en la lista).
+"""
+
+from typing import Dict, Tuple
+
+import numpy as np
+
+from import_validation import ALLOWED_GLASS_TYPES, ALLOWED_MATERIALS
+from sheet_rows import HEADER_ROW
+
+
+def synthetic_columns(rows: int, seed: int = 0) -> Tuple[Dict[str, np.ndarray], Dict[str, np.ndarray], np.ndarray]:
+    """Columnas, máscaras de error y números de fila para rows filas de datos"""
+    rng = np.random.default_rng(seed)
+
+    def with_blanks(values: np.ndarray, rate: float = 0.01) -> np.ndarray:
+        values = values.astype(object)
+        values[rng.random(rows) < rate] = None
+        return values
+
+    codes = np.array([f"W-{index:06d}" for index in range(rows)], dtype=object)
+    duplicated = rng.random(rows) < 0.02
+    codes[duplicated] = "W-000000"
+
+    widths = rng.uniform(0.3, 3.0, rows)
+    widths[rng.random(rows) < 0.02] = 25.0
+    heights = rng.uniform(0.3, 3.0, rows)
+    heights[rng.random(rows) < 0.01] = np.nan
+    quantities = rng.integers(0, 10, rows).astype(np.float64)
+
+    materials = np.array(ALLOWED_MATERIALS + ["Oro"], dtype=object)[rng.integers(0, len(ALLOWED_MATERIALS) + 1, rows)]
+    glass = np.array(ALLOWED_GLASS_TYPES + ["DVH"], dtype=object)[rng.integers(0, len(ALLOWED_GLASS_TYPES) + 1, rows)]
+
+    columns = {
+        "codigo": with_blanks(codes),
+        "ancho_m": widths,
+        "alto_m": heights,
+        "cantidad_por_unidad": quantities,
+        "precio_unitario_usd": rng.uniform(50, 500, rows),
+        "material": with_blanks(materials),
+        "tipo_vidrio": with_blanks(glass),
+    }
+    errors = {"alto_m": np.isnan(heights)}
+    row_numbers = np.arange(HEADER_ROW + 1, HEADER_ROW + 1 + rows, dtype=np.int64)
+    return columns, errors, row_numbers
@@ -0,0 +1,337 @@
+#!/usr/bin/env python3
+"""
+Benchmark por etapas de la extracción de imágenes y de la validación
+
+Mide cada etapa de ExcelImageExtractor y del armado de la respuesta de
+/extract-images sobre libros sintéticos (workbook_generator):
+- anchor_parse: posiciones de los anclajes (_extract_position_info)
+- media_read: lectura y deduplicación de xl/media (_extract_images_from_zip)
+- merge: unión de anclajes con medios por r:embed
+- encode: manifiesto y base64 (build_images_manifest + encode_images_response)
+- serialize: cuerpo JSON de la respuesta
+
+Los casos con kind 'validation' miden en cambio una sola etapa, validate
+(import_validation.validate_columns con las reglas predeterminadas), sobre
+columnas sintéticas de column_generator; además de la línea base tienen un
+presupuesto fijo de ms por cada 1000 filas que, superado, también termina con
+código 1.
+
+Cada caso de la matriz cambia un parámetro respecto del caso base. El
+resultado (mejor tiempo de varias corridas por etapa) se guarda como JSON para
+comparar entre commits; contra una línea base guardada, una etapa más lenta
+que la tolerancia hace terminar con código 1.
+
+Uso (desde python-excel-service/):
+  python -m benchmarks --matrix quick --output resultados.json
+  python -m benchmarks --save-baseline benchmarks/baseline.json
+  python -m benchmarks --baseline benchmarks/baseline.json
+  python -m benchmarks --cases validation_10k validation_100k --validation-budget-ms 2.0
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Any, Dict, List, Optional
+
+from benchmarks.column_generator import synthetic_columns
+from benchmarks.workbook_generator import generate_workbook, spec_key, workbook_spec
+
+STAGES = ("anchor_parse", "media_read", "merge", "encode", "serialize")
+VALIDATION_STAGES = ("validate",)
+MATRICES: Dict[str, List[Dict[str, Any]]] = {
+    "quick": [
+        {"name": "base"},
+        {"name": "rows_10k", "rows": 10000},
+        {"name": "images_1k", "rows": 2000, "images": 1000},
+        {"name": "jpeg_800px", "images": 100, "image_size": 800, "image_format": "jpeg"},
+        {"name": "no_duplicates", "duplicate_ratio": 0.0},
+        {"name": "mostly_duplicates", "duplicate_ratio": 0.95},
+        {"name": "sheets_5", "sheets": 5},
+        {"name": "strings_50k", "shared_strings": 50000},
+        {"name": "validation_10k", "kind": "validation", "rows": 10000},
+        {"name": "validation_100k", "kind": "validation", "rows": 100000},
+    ],
+    "full": [
+        {"name": "base"},
+        {"name": "rows_10k", "rows": 10000},
+        {"name": "rows_100k", "rows": 100000},
+        {"name": "images_1k", "rows": 2000, "images": 1000},
+        {"name": "images_5k", "rows": 5000, "images": 5000},
+        {"name": "png_800px", "images": 100, "image_size": 800},
+        {"name": "jpeg_800px", "images": 100, "image_size": 800, "image_format": "jpeg"},
+        {"name": "jpeg_2000px", "images": 20, "image_size": 2000, "image_format": "jpeg"},
+        {"name": "no_duplicates", "duplicate_ratio": 0.0},
+        {"name": "mostly_duplicates", "duplicate_ratio": 0.95},
+        {"name": "sheets_5", "sheets": 5},
+        {"name": "sheets_20", "sheets": 20},
+        {"name": "strings_50k", "shared_strings": 50000},
+        {"name": "strings_500k", "rows": 20000, "shared_strings": 500000},
+        {"name": "validation_1k", "kind": "validation", "rows": 1000},
+        {"name": "validation_10k", "kind": "validation", "rows": 10000},
+        {"name": "validation_50k", "kind": "validation", "rows": 50000},
+        {"name": "validation_100k", "kind": "validation", "rows": 100000},
+    ],
+}
+DEFAULT_REPEAT = 3
+# Una etapa es regresión si supera la línea base en más de la tolerancia
+# relativa y además en más de MIN_DELTA_MS (ruido en etapas de pocos ms)
+DEFAULT_TOLERANCE = 0.25
+MIN_DELTA_MS = 5.0
+VALIDATION_BUDGET_MS_PER_1K_ROWS = 2.0
+RESULTS_VERSION = 1
+
+
+def workbook_for(spec: Dict[str, Any], workdir: str) -> Dict[str, Any]:
+    """Genera el libro del caso o reutiliza el de una corrida anterior con los mismos parámetros"""
+    path = os.path.join(workdir, f"bench_{spec_key(spec)}.xlsx")
+    expected_path = path + ".json"
+    if os.path.exists(path) and os.path.exists(expected_path):
+        with open(expected_path) as handle:
+            expected = json.load(handle)
+    else:
+        expected = generate_workbook(path, spec)
+        with open(expected_path, "w") as handle:
+            json.dump(expected, handle)
+    return {"path": path, "expected": expected}
+
+
+def time_stages(path: str, anchor_mode: str, dedupe: bool) -> Dict[str, Any]:
+    """Una corrida completa; devuelve ms por etapa y lo extraído para validar"""
+    # main se importa aquí para no cargar FastAPI al solo generar libros
+    from fastapi.responses import JSONResponse
+    from main import ExcelImageExtractor, build_images_manifest, encode_images_response
+
+    with open(path, "rb") as handle:
+        source = io.BytesIO(handle.read())
+    extractor = ExcelImageExtractor(anchor_mode)
+    timings = {}
+
+    # El extractor imprime una línea por imagen: se descarta para no medir la consola
+    with contextlib.redirect_stdout(io.StringIO()):
+        started = time.perf_counter()
+        position_info = extractor._extract_position_info(source)
+        timings["anchor_parse"] = time.perf_counter()
+
+        zip_images = extractor._extract_images_from_zip(source, None)
+        timings["media_read"] = time.perf_counter()
+
+        images_info, unanchored = extractor._merge_position_and_images(position_info, zip_images)
+        timings["merge"] = time.perf_counter()
+
+        manifest, blobs = build_images_manifest(images_info, unanchored)
+        response = encode_images_response(manifest, blobs, dedupe)
+        timings["encode"] = time.perf_counter()
+
+        body = JSONResponse(response).body
+        timings["serialize"] = time.perf_counter()
+
+    stages_ms = {}
+    previous = started
+    for stage in STAGES:
+        stages_ms[stage] = (timings[stage] - previous) * 1000
+        previous = timings[stage]
+    return {
+        "stages_ms": stages_ms,
+        "images": manifest["count"],
+        "unique_images": len(blobs),
+        "response_bytes": len(body),
+    }
+
+
+def run_validation_case(case: Dict[str, Any], repeat: int) -> Dict[str, Any]:
+    """Mejor tiempo de validate_columns sobre las columnas sintéticas del caso"""
+    from column_import import normalize_header
+    from import_validation import validate_columns
+
+    spec = {"rows": int(case["rows"]), "seed": int(case.get("seed", 0))}
+    if spec["rows"] < 1:
+        raise ValueError(f"Caso {case['name']}: rows debe ser mayor que 0")
+    columns, errors, row_numbers = synthetic_columns(spec["rows"], spec["seed"])
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        summary = validate_columns(columns, errors, row_numbers, normalize=normalize_header)
+        timings.append((time.perf_counter() - started) * 1000)
+
+    best = round(min(timings), 3)
+    return {
+        "name": case["name"],
+        "kind": "validation",
+        "spec": spec,
+        "issues": summary["issueCount"],
+        "stagesMs": {"validate": best},
+        "totalMs": best,
+        "msPer1kRows": round(best / (spec["rows"] / 1000), 4),
+    }
+
+
+def run_case(case: Dict[str, Any], workdir: str, anchor_mode: str, dedupe: bool, repeat: int) -> Dict[str, Any]:
+    """Mejor tiempo por etapa de varias corridas; lanza RuntimeError si la extracción no calza"""
+    if case.get("kind") == "validation":
+        return run_validation_case(case, repeat)
+    spec = workbook_spec(**{key: value for key, value in case.items() if key not in ("name", "kind")})
+    workbook = workbook_for(spec, workdir)
+    runs = [time_stages(workbook["path"], anchor_mode, dedupe) for _ in range(repeat)]
+
+    expected = workbook["expected"]
+    last = runs[-1]
+    if last["images"] != expected["images"] or last["unique_images"] != expected["unique_images"]:
+        raise RuntimeError(
+            f"Caso {case['name']}: se extrajeron {last['images']} imágenes ({last['unique_images']} únicas), "
+            f"se esperaban {expected['images']} ({expected['unique_images']} únicas)"
+        )
+
+    stages_ms = {stage: round(min(run["stages_ms"][stage] for run in runs), 3) for stage in STAGES}
+    return {
+        "name": case["name"],
+        "kind": "extraction",
+        "spec": spec,
+        "workbookBytes": expected["bytes"],
+        "images": last["images"],
+        "uniqueImages": last["unique_images"],
+        "responseBytes": last["response_bytes"],
+        "stagesMs": stages_ms,
+        "totalMs": round(sum(stages_ms.values()), 3),
+    }
+
+
+def current_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_matrix(matrix: str, workdir: str, anchor_mode: str = "xml", dedupe: bool = True,
+               repeat: int = DEFAULT_REPEAT, cases: Optional[List[str]] = None) -> Dict[str, Any]:
+    selected = [case for case in MATRICES[matrix] if not cases or case["name"] in cases]
+    if not selected:
+        raise ValueError(f"Ningún caso de la matriz {matrix} coincide con {', '.join(cases or [])}")
+    columns = STAGES + VALIDATION_STAGES
+    results = []
+    print(f"{'caso':<20} " + " ".join(f"{stage:>12}" for stage in columns) + f" {'total ms':>10}")
+    for case in selected:
+        result = run_case(case, workdir, anchor_mode, dedupe, repeat)
+        results.append(result)
+        stages_ms = result["stagesMs"]
+        print(f"{case['name']:<20} "
+              + " ".join(f"{stages_ms[stage]:>12.2f}" if stage in stages_ms else f"{'-':>12}" for stage in columns)
+              + f" {result['totalMs']:>10.2f}")
+    return {
+        "version": RESULTS_VERSION,
+        "createdAt": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "commit": current_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "matrix": matrix,
+        "anchorMode": anchor_mode,
+        "dedupe": dedupe,
+        "repeat": repeat,
+        "cases": results,
+    }
+
+
+def compare_results(current: Dict[str, Any], baseline: Dict[str, Any], tolerance: float = DEFAULT_TOLERANCE,
+                    min_delta_ms: float = MIN_DELTA_MS) -> List[str]:
+    """Regresiones (texto) de current respecto de baseline; solo compara casos con los mismos parámetros"""
+    baseline_cases = {case["name"]: case for case in baseline.get("cases", [])}
+    regressions = []
+    for case in current["cases"]:
+        reference = baseline_cases.get(case["name"])
+        if reference is None:
+            print(f"  {case['name']}: sin línea base")
+            continue
+        if reference["spec"] != case["spec"]:
+            print(f"  {case['name']}: parámetros distintos a la línea base, no se compara")
+            continue
+        for stage, after in case["stagesMs"].items():
+            before = reference["stagesMs"][stage]
+            if after > before * (1 + tolerance) and after - before > min_delta_ms:
+                regressions.append(
+                    f"{case['name']}/{stage}: {before:.2f} ms -> {after:.2f} ms (+{(after / before - 1) * 100:.0f}%)"
+                    if before else f"{case['name']}/{stage}: {before:.2f} ms -> {after:.2f} ms"
+                )
+    return regressions
+
+
+def over_budget(current: Dict[str, Any], budget_ms: float = VALIDATION_BUDGET_MS_PER_1K_ROWS) -> List[str]:
+    """Casos de validación (texto) que superan el presupuesto de ms por cada 1000 filas"""
+    return [
+        f"{case['name']}: {case['msPer1kRows']:.3f} ms por 1000 filas (presupuesto {budget_ms} ms)"
+        for case in current["cases"]
+        if case.get("kind") == "validation" and case["msPer1kRows"] > budget_ms
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--matrix", choices=sorted(MATRICES), default="quick")
+    parser.add_argument("--cases", nargs="+", help="Solo estos casos de la matriz")
+    parser.add_argument("--repeat", type=int, default=DEFAULT_REPEAT)
+    parser.add_argument("--anchor-mode", choices=("xml", "openpyxl"), default="xml")
+    parser.add_argument("--no-dedupe", action="store_true", help="Respuesta con base64 por imagen")
+    parser.add_argument("--workdir", default=os.path.join(tempfile.gettempdir(), "excel-bench"),
+                        help="Carpeta de los libros generados (se reutilizan entre corridas)")
+    parser.add_argument("--output", help="Guardar los resultados en este JSON")
+    parser.add_argument("--baseline", help="Comparar contra esta línea base y fallar si hay regresiones")
+    parser.add_argument("--save-baseline", help="Guardar los resultados como línea base en este JSON")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE)
+    parser.add_argument("--min-delta-ms", type=float, default=MIN_DELTA_MS)
+    parser.add_argument("--validation-budget-ms", type=float, default=VALIDATION_BUDGET_MS_PER_1K_ROWS,
+                        help="Presupuesto de los casos de validación en ms por cada 1000 filas")
+    args = parser.parse_args()
+
+    os.makedirs(args.workdir, exist_ok=True)
+    try:
+        results = run_matrix(args.matrix, args.workdir, args.anchor_mode, not args.no_dedupe,
+                             max(1, args.repeat), args.cases)
+    except (RuntimeError, ValueError) as e:
+        print(f"ERROR: {str(e)}")
+        sys.exit(2)
+
+    for path in filter(None, (args.output, args.save_baseline)):
+        with open(path, "w") as handle:
+            json.dump(results, handle, indent=2, ensure_ascii=False)
+        print(f"Resultados guardados en {path}")
+
+    failed = False
+    budget_failures = over_budget(results, args.validation_budget_ms)
+    if budget_failures:
+        print("=" * 60)
+        print(f"PRESUPUESTO SUPERADO en {len(budget_failures)} casos de validación:")
+        for failure in budget_failures:
+            print(f"  {failure}")
+        print("=" * 60)
+        failed = True
+
+    if args.baseline:
+        with open(args.baseline) as handle:
+            baseline = json.load(handle)
+        print(f"Comparando con {args.baseline} (commit {baseline.get('commit')}, tolerancia "
+              f"{args.tolerance:.0%} y {args.min_delta_ms} ms)")
+        regressions = compare_results(results, baseline, args.tolerance, args.min_delta_ms)
+        if regressions:
+            print("=" * 60)
+            print(f"REGRESIÓN DE RENDIMIENTO en {len(regressions)} etapas:")
+            for regression in regressions:
+                print(f"  {regression}")
+            print("=" * 60)
+            failed = True
+        else:
+            print("Sin regresiones respecto de la línea base")
+
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
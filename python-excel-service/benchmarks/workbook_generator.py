@@ -0,0 +1,231 @@
+#!/usr/bin/env python3
+"""
+Generador de libros sintéticos para los benchmarks
+
+Los create_* y test-*.py del proyecto producen libros de 3 a 5 filas, que no
+dicen nada del costo de la extracción con planillas reales. Aquí el libro se
+escribe directo como ZIP (sin openpyxl, que tardaría más que lo que se quiere
+medir) con el formato de la hoja DETALLE: encabezados en la fila 5, imágenes
+ancladas en la columna de diseño y texto en la tabla de cadenas compartidas.
+
+Parámetros (WORKBOOK_DEFAULTS):
+- rows: filas de datos de DETALLE (y de cada hoja adicional)
+- images: imágenes ancladas, una por fila desde la fila 6
+- image_size / image_format: lado mayor en píxeles y 'png' o 'jpeg'
+- duplicate_ratio: fracción de anclas cuya parte xl/media repite los bytes de
+  otra (como cuando se copia una imagen en Excel)
+- sheets: hojas en total (DETALLE más hojas de relleno)
+- shared_strings: cadenas distintas en xl/sharedStrings.xml
+"""
+
+import hashlib
+import io
+import json
+import os
+import zipfile
+from typing import Any, Dict, List
+from xml.sax.saxutils import escape
+
+import numpy as np
+from openpyxl.utils import get_column_letter
+
+from drawing_anchors import NS_A, NS_MAIN, NS_REL, NS_XDR, REL_TYPE_DRAWING, REL_TYPE_IMAGE
+from sheet_rows import HEADER_ROW
+from xlsx_export import (
+    CT_DRAWING, CT_STYLES, CT_WORKBOOK, CT_WORKSHEET, DEFAULT_EXPORT_COLUMNS, DESIGN_FIELD, EXPORT_SHEET,
+    FIRST_DATA_ROW, IMAGE_ROW_HEIGHT, REL_TYPE_OFFICE_DOCUMENT, REL_TYPE_STYLES, STYLES_XML, XML_HEADER,
+    anchor_xml, column_pixels, fit_image, relationships_xml
+)
+
+try:
+    from PIL import Image as PILImage
+    PIL_AVAILABLE = True
+except ImportError:  # Pillow no instalado: no se pueden generar las imágenes
+    PILImage = None
+    PIL_AVAILABLE = False
+
+WORKBOOK_DEFAULTS: Dict[str, Any] = {
+    "rows": 1000,
+    "images": 200,
+    "image_size": 160,
+    "image_format": "png",
+    "duplicate_ratio": 0.5,
+    "sheets": 1,
+    "shared_strings": 500,
+    "seed": 0,
+}
+IMAGE_FORMATS = {"png": ("PNG", "image/png"), "jpeg": ("JPEG", "image/jpeg")}
+CT_SHARED_STRINGS = "application/vnd.openxmlformats-officedocument.spreadsheetml.sharedStrings+xml"
+REL_TYPE_SHARED_STRINGS = NS_REL + "/sharedStrings"
+TEXT_FIELDS = {"ubicacion", "codigo", "material", "tipo_vidrio"}
+# Filas escritas por bloque en las hojas
+WRITE_ROWS = 1000
+
+
+def workbook_spec(**overrides) -> Dict[str, Any]:
+    """Parámetros completos del libro; lanza ValueError si alguno no es válido"""
+    unknown = set(overrides) - set(WORKBOOK_DEFAULTS)
+    if unknown:
+        raise ValueError(f"Parámetros desconocidos: {', '.join(sorted(unknown))}")
+    spec = dict(WORKBOOK_DEFAULTS, **overrides)
+    if spec["image_format"] not in IMAGE_FORMATS:
+        raise ValueError(f"image_format debe ser uno de {', '.join(IMAGE_FORMATS)}")
+    if not 0 <= spec["duplicate_ratio"] <= 1:
+        raise ValueError("duplicate_ratio debe estar entre 0 y 1")
+    if spec["images"] > spec["rows"]:
+        raise ValueError("images no puede superar rows (una imagen por fila)")
+    if spec["sheets"] < 1 or spec["shared_strings"] < 1 or spec["image_size"] < 8:
+        raise ValueError("sheets y shared_strings deben ser >= 1 e image_size >= 8")
+    return spec
+
+
+def spec_key(spec: Dict[str, Any]) -> str:
+    """Huella estable de los parámetros (nombre del archivo en la caché)"""
+    return hashlib.sha256(json.dumps(spec, sort_keys=True).encode()).hexdigest()[:16]
+
+
+def synthetic_image(rng: np.random.Generator, spec: Dict[str, Any]) -> bytes:
+    """Imagen de bloques de color (se comprime como un plano de diseño, no como ruido)"""
+    if not PIL_AVAILABLE:
+        raise RuntimeError("Pillow no está instalado: no se pueden generar imágenes")
+    width = spec["image_size"]
+    height = max(1, width * 3 // 4)
+    blocks = rng.integers(0, 256, (max(1, height // 8), max(1, width // 8), 3), dtype=np.uint8)
+    image = PILImage.fromarray(blocks, "RGB").resize((width, height), PILImage.NEAREST)
+    buffer = io.BytesIO()
+    image.save(buffer, IMAGE_FORMATS[spec["image_format"]][0])
+    return buffer.getvalue()
+
+
+def _shared_strings(spec: Dict[str, Any]) -> List[str]:
+    headers = [column["header"] for column in DEFAULT_EXPORT_COLUMNS]
+    return headers + [f"Texto {index:06d} ventana línea {index % 97}" for index in range(spec["shared_strings"])]
+
+
+def _sheet_rows(spec: Dict[str, Any], rng: np.random.Generator, string_count: int, header_count: int):
+    """Filas de datos como XML: texto por índice de cadena compartida y números"""
+    columns = DEFAULT_EXPORT_COLUMNS
+    letters = [get_column_letter(index) for index in range(1, len(columns) + 1)]
+    header = "".join(f'<c r="{letter}{HEADER_ROW}" t="s"><v>{index}</v></c>' for index, letter in enumerate(letters))
+    yield f'<row r="{HEADER_ROW}">{header}</row>'
+
+    pool = string_count - header_count
+    for start in range(0, spec["rows"], WRITE_ROWS):
+        count = min(WRITE_ROWS, spec["rows"] - start)
+        numbers = rng.uniform(0.3, 500, (count, len(columns)))
+        strings = header_count + rng.integers(0, pool, (count, len(columns)))
+        chunk = []
+        for offset in range(count):
+            row_number = FIRST_DATA_ROW + start + offset
+            cells = []
+            for position, (letter, column) in enumerate(zip(letters, columns)):
+                if column["field"] == DESIGN_FIELD:
+                    continue
+                if column["field"] in TEXT_FIELDS:
+                    cells.append(f'<c r="{letter}{row_number}" t="s"><v>{strings[offset, position]}</v></c>')
+                else:
+                    cells.append(f'<c r="{letter}{row_number}"><v>{numbers[offset, position]:.4f}</v></c>')
+            height = f' ht="{IMAGE_ROW_HEIGHT}" customHeight="1"' if start + offset < spec["images"] else ""
+            chunk.append(f'<row r="{row_number}"{height}>{"".join(cells)}</row>')
+        yield "".join(chunk)
+
+
+def generate_workbook(path: str, spec: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Escribe el libro en path y devuelve lo que la extracción debería
+    encontrar: imágenes ancladas, partes xl/media, contenidos únicos y bytes
+    """
+    rng = np.random.default_rng(spec["seed"])
+    extension = spec["image_format"]
+    design_column = next(index for index, column in enumerate(DEFAULT_EXPORT_COLUMNS, 1)
+                         if column["field"] == DESIGN_FIELD)
+    box = (column_pixels(DEFAULT_EXPORT_COLUMNS[design_column - 1]["width"]), int(IMAGE_ROW_HEIGHT * 4 / 3))
+
+    # Cada ancla tiene su propia parte xl/media; las duplicadas repiten bytes de una anterior
+    unique_count = max(1, round(spec["images"] * (1 - spec["duplicate_ratio"]))) if spec["images"] else 0
+    contents = [synthetic_image(rng, spec) for _ in range(unique_count)]
+    media = [contents[index] if index < unique_count else contents[int(rng.integers(0, unique_count))]
+             for index in range(spec["images"])]
+    media = [media[index] for index in rng.permutation(len(media))]
+    strings = _shared_strings(spec)
+    sheet_names = [EXPORT_SHEET] + [f"DATOS{index}" for index in range(1, spec["sheets"])]
+
+    with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as package:
+        package.writestr("_rels/.rels", relationships_xml([("rId1", REL_TYPE_OFFICE_DOCUMENT, "xl/workbook.xml")]))
+        sheets_xml = "".join(f'<sheet name="{name}" sheetId="{index}" r:id="rId{index}"/>'
+                             for index, name in enumerate(sheet_names, 1))
+        package.writestr("xl/workbook.xml", (
+            f'{XML_HEADER}<workbook xmlns="{NS_MAIN}" xmlns:r="{NS_REL}"><sheets>{sheets_xml}</sheets></workbook>'
+        ))
+        package.writestr("xl/_rels/workbook.xml.rels", relationships_xml(
+            [(f"rId{index}", NS_REL + "/worksheet", f"worksheets/sheet{index}.xml")
+             for index in range(1, len(sheet_names) + 1)]
+            + [("rIdStyles", REL_TYPE_STYLES, "styles.xml"),
+               ("rIdStrings", REL_TYPE_SHARED_STRINGS, "sharedStrings.xml")]
+        ))
+        package.writestr("xl/styles.xml", STYLES_XML)
+
+        with package.open("xl/sharedStrings.xml", "w") as stream:
+            stream.write(f'{XML_HEADER}<sst xmlns="{NS_MAIN}" count="{len(strings)}" '
+                         f'uniqueCount="{len(strings)}">'.encode())
+            for start in range(0, len(strings), WRITE_ROWS):
+                stream.write("".join(f"<si><t>{escape(text)}</t></si>"
+                                     for text in strings[start:start + WRITE_ROWS]).encode())
+            stream.write(b"</sst>")
+
+        for index in range(1, len(sheet_names) + 1):
+            with package.open(f"xl/worksheets/sheet{index}.xml", "w") as stream:
+                cols = "".join(f'<col min="{position}" max="{position}" width="{column["width"]}" customWidth="1"/>'
+                               for position, column in enumerate(DEFAULT_EXPORT_COLUMNS, 1))
+                stream.write(f'{XML_HEADER}<worksheet xmlns="{NS_MAIN}" xmlns:r="{NS_REL}">'
+                             f'<cols>{cols}</cols><sheetData>'.encode())
+                for chunk in _sheet_rows(spec, rng, len(strings), len(DEFAULT_EXPORT_COLUMNS)):
+                    stream.write(chunk.encode())
+                has_drawing = index == 1 and media
+                stream.write(b"</sheetData>" + (b'<drawing r:id="rId1"/>' if has_drawing else b"")
+                             + b"</worksheet>")
+
+        if media:
+            package.writestr("xl/worksheets/_rels/sheet1.xml.rels", relationships_xml([
+                ("rId1", REL_TYPE_DRAWING, "../drawings/drawing1.xml")
+            ]))
+            with package.open("xl/drawings/drawing1.xml", "w") as stream:
+                stream.write(f'{XML_HEADER}<xdr:wsDr xmlns:xdr="{NS_XDR}" xmlns:a="{NS_A}" '
+                             f'xmlns:r="{NS_REL}">'.encode())
+                width = spec["image_size"]
+                width_px, height_px = fit_image(width, max(1, width * 3 // 4), *box)
+                for index in range(len(media)):
+                    stream.write(anchor_xml(index + 1, design_column, FIRST_DATA_ROW + index, f"rId{index + 1}",
+                                            width_px, height_px).encode())
+                stream.write(b"</xdr:wsDr>")
+            package.writestr("xl/drawings/_rels/drawing1.xml.rels", relationships_xml([
+                (f"rId{index + 1}", REL_TYPE_IMAGE, f"../media/image{index + 1}.{extension}")
+                for index in range(len(media))
+            ]))
+            for index, data in enumerate(media, 1):
+                package.writestr(f"xl/media/image{index}.{extension}", data, compress_type=zipfile.ZIP_STORED)
+
+        overrides = "".join(
+            f'<Override PartName="/xl/worksheets/sheet{index}.xml" ContentType="{CT_WORKSHEET}"/>'
+            for index in range(1, len(sheet_names) + 1)
+        )
+        drawing_override = (
+            f'<Override PartName="/xl/drawings/drawing1.xml" ContentType="{CT_DRAWING}"/>' if media else ""
+        )
+        package.writestr("[Content_Types].xml", (
+            f'{XML_HEADER}<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+            '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+            '<Default Extension="xml" ContentType="application/xml"/>'
+            f'<Default Extension="{extension}" ContentType="{IMAGE_FORMATS[extension][1]}"/>'
+            f'<Override PartName="/xl/workbook.xml" ContentType="{CT_WORKBOOK}"/>{overrides}'
+            f'<Override PartName="/xl/styles.xml" ContentType="{CT_STYLES}"/>'
+            f'<Override PartName="/xl/sharedStrings.xml" ContentType="{CT_SHARED_STRINGS}"/>{drawing_override}'
+            '</Types>'
+        ))
+
+    return {
+        "images": len(media),
+        "media_parts": len(media),
+        "unique_images": len(set(media)),
+        "bytes": os.path.getsize(path),
+    }
@@ -0,0 +1,358 @@
+#!/usr/bin/env python3
+"""
+Importación de columnas mapeadas con conversión de tipos por columna
+
+importExcel aplicaba el columnMapping fila por fila en TypeScript y convertía
+cada celda de 'Width (m)', 'Height (m)' o 'Quantity' por separado. Aquí el
+XML de la hoja se recorre una sola vez guardando solo las columnas mapeadas
+en búferes compactos (números nativos aparte de textos), y la conversión se
+hace por columna con NumPy: los textos numéricos ("1,25", "1.200 mm",
+"3 uds", "1,5 m2") se interpretan una vez por valor distinto y se reparten con el
+índice inverso de np.unique. El resultado es columnar: un arreglo de valores
+por campo y un bitmap de errores por celda.
+"""
+
+import base64
+import re
+import unicodedata
+import zipfile
+from array import array
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+from openpyxl.utils import get_column_letter
+
+from computed_columns import evaluate_computed_columns, DEFAULT_RELATIVE_TOLERANCE
+from import_validation import validate_columns
+from sheet_rows import SheetRowParser, HEADER_ROW
+
+TYPE_NUMBER = "number"
+TYPE_INTEGER = "integer"
+TYPE_TEXT = "text"
+COLUMN_TYPES = (TYPE_NUMBER, TYPE_INTEGER, TYPE_TEXT)
+
+# Tipos de los campos numéricos del sistema; el resto se importa como texto
+DEFAULT_FIELD_TYPES = {
+    "ancho_m": TYPE_NUMBER,
+    "alto_m": TYPE_NUMBER,
+    "superficie": TYPE_NUMBER,
+    "cantidad_por_unidad": TYPE_INTEGER,
+    "superficie_total": TYPE_NUMBER,
+    "ancho_fabricacion_m": TYPE_NUMBER,
+    "alto_fabricacion_m": TYPE_NUMBER,
+    "perfil_mm": TYPE_NUMBER,
+    "espesor_vidrio_mm": TYPE_NUMBER,
+    "precio_unitario_usd": TYPE_NUMBER,
+    "precio_unitario_sqm_usd": TYPE_NUMBER,
+    "precio_pieza_base_usd": TYPE_NUMBER,
+    "precio_total_pieza_usd": TYPE_NUMBER,
+}
+
+# Unidades de longitud que se convierten a la unidad del encabezado, p. ej.
+# "1200 mm" en 'Width (m)' -> 1.2
+LENGTH_UNITS = {"mm": 0.001, "cm": 0.01, "m": 1.0}
+# Sufijos/prefijos que solo se descartan
+IGNORED_UNITS = {
+    "", "m2", "m²", "mt", "mts", "u", "un", "und", "ud", "uds", "unid", "unidades",
+    "pcs", "pc", "pza", "pzas", "usd", "us$", "$", "€", "%",
+}
+# Separador decimal de las planillas (es-CL); el otro separador solo marca miles
+DECIMAL_SEPARATORS = (",", ".")
+DEFAULT_DECIMAL_SEPARATOR = ","
+
+# Textos que en las planillas marcan una celda sin dato
+BLANK_TEXTS = {"", "-", "--", "—", "n/a", "na", "s/d"}
+
+_NUMBER_WITH_UNIT = re.compile(
+    r"^(?P<prefix>us\$|usd|\$|€)?\s*(?P<number>[-+]?\d[\d.,'\s]*)\s*(?P<unit>(?:[^\d\s]+[2²]?)?)$"
+)
+_HEADER_UNIT = re.compile(r"\(([^)]*)\)\s*$")
+
+# Bitmaps: bit i (orden little-endian dentro de cada byte) = fila i de la importación
+BITMAP_ENCODING = "base64-packbits-little"
+
+
+def normalize_header(text: Any) -> str:
+    """Encabezado sin acentos, en minúsculas y con espacios/guiones unificados"""
+    text = unicodedata.normalize("NFKD", str(text or ""))
+    text = "".join(char for char in text if not unicodedata.combining(char))
+    return " ".join(text.casefold().replace("_", " ").replace("-", " ").split())
+
+
+def header_length_unit(header: str) -> Optional[float]:
+    """Factor de la unidad de longitud declarada en el encabezado, p. ej. 'Width (m)'"""
+    match = _HEADER_UNIT.search(header or "")
+    return LENGTH_UNITS.get(match.group(1).strip().lower()) if match else None
+
+
+def parse_decimal(text: str, decimal_separator: str = DEFAULT_DECIMAL_SEPARATOR) -> float:
+    """
+    Número escrito con coma o punto decimal y separadores de miles opcionales:
+    con ambos separadores el último es el decimal; uno repetido ("1.234.567")
+    es de miles. Un separador único es ambiguo: si no es el decimal de la
+    planilla y le siguen exactamente 3 dígitos ("1.200" con coma decimal) se
+    lee como miles; en otro caso como decimal ("1,5", "0.125", "1.5").
+    """
+    text = text.replace(" ", "").replace("'", "")
+    last_comma, last_dot = text.rfind(","), text.rfind(".")
+    if last_comma >= 0 and last_dot >= 0:
+        thousands = "." if last_comma > last_dot else ","
+        return float(text.replace(thousands, "").replace(",", "."))
+
+    separator = "," if last_comma >= 0 else "." if last_dot >= 0 else None
+    if separator is None:
+        return float(text)
+    if text.count(separator) > 1:
+        return float(text.replace(separator, ""))
+    integer, fraction = text.split(separator)
+    digits = integer.lstrip("+-")
+    if (separator != decimal_separator and len(fraction) == 3 and fraction.isdigit()
+            and 1 <= len(digits) <= 3 and digits.isdigit() and int(digits) > 0):
+        return float(integer + fraction)
+    return float(integer + "." + fraction)
+
+
+def parse_number_text(text: str, target_unit: Optional[float],
+                      decimal_separator: str = DEFAULT_DECIMAL_SEPARATOR) -> Optional[float]:
+    """Texto (ya en minúsculas) con número y unidad opcional -> float; None si no es válido"""
+    match = _NUMBER_WITH_UNIT.match(text)
+    if not match:
+        return None
+    unit = match.group("unit")
+    if unit not in LENGTH_UNITS and unit not in IGNORED_UNITS:
+        return None
+    try:
+        number = parse_decimal(match.group("number"), decimal_separator)
+    except ValueError:
+        return None
+    if unit in LENGTH_UNITS and target_unit:
+        number = number * LENGTH_UNITS[unit] / target_unit
+    return number
+
+
+class ColumnBuffer:
+    """Celdas de una columna mapeada: números nativos y textos por separado"""
+
+    def __init__(self):
+        self.number_rows = array("q")
+        self.numbers = array("d")
+        self.text_rows = array("q")
+        self.texts: List[str] = []
+        # Booleanos u otros valores que ningún tipo numérico acepta
+        self.other_rows = array("q")
+        self.others: List[Any] = []
+
+    def append(self, row_index: int, value: Any):
+        if isinstance(value, bool):
+            self.other_rows.append(row_index)
+            self.others.append(value)
+        elif isinstance(value, (int, float)):
+            self.number_rows.append(row_index)
+            self.numbers.append(value)
+        else:
+            self.text_rows.append(row_index)
+            self.texts.append(str(value))
+
+
+def _as_ndarray(values: array, dtype) -> np.ndarray:
+    # Vista sin copia del búfer (np.frombuffer no admite búferes vacíos en todas las versiones)
+    return np.frombuffer(values, dtype=dtype) if len(values) else np.empty(0, dtype=dtype)
+
+
+def coerce_numeric(buffer: ColumnBuffer, size: int, target_unit: Optional[float],
+                   integer: bool, decimal_separator: str = DEFAULT_DECIMAL_SEPARATOR
+                   ) -> Tuple[np.ndarray, np.ndarray]:
+    """(valores float64 con NaN en blancos y errores, máscara de errores)"""
+    values = np.full(size, np.nan)
+    errors = np.zeros(size, dtype=bool)
+    values[_as_ndarray(buffer.number_rows, np.int64)] = _as_ndarray(buffer.numbers, np.float64)
+
+    if buffer.texts:
+        rows = _as_ndarray(buffer.text_rows, np.int64)
+        stripped = np.char.lower(np.char.strip(np.array(buffer.texts, dtype=str)))
+        distinct, inverse = np.unique(stripped, return_inverse=True)
+        blank = np.array([text in BLANK_TEXTS for text in distinct.tolist()], dtype=bool)
+        parsed = np.array(
+            [np.nan if is_blank else parse_number_text(text, target_unit, decimal_separator)
+             for text, is_blank in zip(distinct.tolist(), blank.tolist())],
+            dtype=np.float64
+        )
+        invalid = ~blank & np.isnan(parsed)
+        inverse = inverse.reshape(-1)
+        values[rows] = parsed[inverse]
+        errors[rows] = invalid[inverse]
+
+    errors[_as_ndarray(buffer.other_rows, np.int64)] = True
+
+    if integer:
+        present = ~np.isnan(values)
+        fractional = present & (np.abs(values - np.round(values)) > 1e-9)
+        errors |= fractional
+        values[fractional] = np.nan
+    return values, errors
+
+
+def coerce_text(buffer: ColumnBuffer, size: int) -> List[Optional[str]]:
+    """Valores como texto; los enteros sin '.0' y los blancos como None"""
+    values: List[Optional[str]] = [None] * size
+    if buffer.numbers:
+        numbers = _as_ndarray(buffer.numbers, np.float64)
+        whole = numbers == np.floor(numbers)
+        as_text = np.where(whole, numbers.astype(np.int64).astype(str), numbers.astype(str))
+        for row_index, text in zip(buffer.number_rows, as_text.tolist()):
+            values[row_index] = text
+    for row_index, text in zip(buffer.text_rows, buffer.texts):
+        text = text.strip()
+        values[row_index] = text or None
+    for row_index, value in zip(buffer.other_rows, buffer.others):
+        values[row_index] = "true" if value else "false"
+    return values
+
+
+def numbers_to_list(numbers: np.ndarray, integer: bool = False) -> List[Optional[float]]:
+    """Arreglo con NaN -> lista para JSON con None en los blancos"""
+    nulls = np.isnan(numbers)
+    if integer:
+        values = np.where(nulls, 0, numbers).astype(np.int64).tolist()
+    else:
+        values = numbers.tolist()
+    for row_index in np.flatnonzero(nulls).tolist():
+        values[row_index] = None
+    return values
+
+
+def encode_bitmap(mask: np.ndarray) -> str:
+    return base64.b64encode(np.packbits(mask, bitorder="little").tobytes()).decode("ascii")
+
+
+def resolve_mapping(mapping: Dict[str, str], header_values: Dict[int, Any]) -> Tuple[Dict[str, int], List[str]]:
+    """
+    Columna de cada campo según su encabezado: coincidencia exacta y, si no,
+    normalizada (sin acentos ni mayúsculas). Devuelve ({campo: columna}, campos sin columna).
+    """
+    exact = {}
+    normalized = {}
+    for column in sorted(header_values):
+        header = str(header_values[column]).strip()
+        exact.setdefault(header, column)
+        normalized.setdefault(normalize_header(header), column)
+
+    columns = {}
+    missing = []
+    for field, header in mapping.items():
+        column = exact.get(str(header).strip())
+        if column is None:
+            column = normalized.get(normalize_header(header))
+        if column is None:
+            missing.append(field)
+        else:
+            columns[field] = column
+    return columns, missing
+
+
+def import_columns(zip_file: zipfile.ZipFile, mapping: Dict[str, str], header_row: int = HEADER_ROW,
+                   field_types: Optional[Dict[str, str]] = None, skip_empty: bool = True,
+                   computed: bool = True, tolerance: float = DEFAULT_RELATIVE_TOLERANCE,
+                   validate: bool = True, rules: Optional[List[Dict[str, Any]]] = None,
+                   decimal_separator: str = DEFAULT_DECIMAL_SEPARATOR) -> Dict[str, Any]:
+    """
+    Lee las columnas mapeadas de la hoja DETALLE en una pasada y las convierte
+    al tipo de cada campo. field_types completa/reemplaza DEFAULT_FIELD_TYPES.
+    Con computed agrega las columnas calculadas (superficies, precio base) y
+    las filas cuyo valor guardado difiere del calculado. Con validate aplica
+    las reglas (DEFAULT_RULES si rules es None) y agrega el resumen.
+    decimal_separator decide los textos ambiguos como "1.200" (ver parse_decimal).
+    """
+    types = dict(DEFAULT_FIELD_TYPES, **(field_types or {}))
+    parser = SheetRowParser(zip_file, header_row)
+    header_values = parser.reader.read_row_values(parser.sheet["part"], header_row)
+    field_columns, missing = resolve_mapping(mapping, header_values)
+
+    buffers = {column: ColumnBuffer() for column in set(field_columns.values())}
+    row_numbers = array("q")
+    for row_number, values, _ in parser.iter_raw_rows(header_row + 1, columns=buffers):
+        if skip_empty and not values:
+            continue
+        row_index = len(row_numbers)
+        row_numbers.append(row_number)
+        for column, value in values.items():
+            buffers[column].append(row_index, value)
+
+    size = len(row_numbers)
+    columns = {}
+    numeric = {}
+    # Arreglos por campo para la validación: float64 con NaN o object con None
+    typed = {}
+    error_masks = {}
+    for field, column in field_columns.items():
+        header = str(header_values[column]).strip()
+        field_type = types.get(field, TYPE_TEXT)
+        if field_type == TYPE_TEXT:
+            values = coerce_text(buffers[column], size)
+            errors = np.zeros(size, dtype=bool)
+            null_count = values.count(None)
+            typed[field] = np.array(values, dtype=object)
+        else:
+            numbers, errors = coerce_numeric(
+                buffers[column], size, header_length_unit(header), field_type == TYPE_INTEGER,
+                decimal_separator
+            )
+            numeric[field] = numbers
+            typed[field] = numbers
+            if errors.any():
+                error_masks[field] = errors
+            null_count = int(np.isnan(numbers).sum())
+            values = numbers_to_list(numbers, field_type == TYPE_INTEGER)
+
+        columns[field] = {
+            "header": header,
+            "column": column,
+            "columnLetter": get_column_letter(column),
+            "type": field_type,
+            "values": values,
+            "nullCount": null_count,
+            "errorCount": int(errors.sum()),
+            "errors": encode_bitmap(errors)
+        }
+
+    result = {
+        "success": True,
+        "sheet": parser.sheet["name"],
+        "headerRow": header_row,
+        "rowCount": size,
+        "rows": row_numbers.tolist(),
+        "errorEncoding": BITMAP_ENCODING,
+        "columns": columns,
+        "missingFields": missing
+    }
+    if computed:
+        result.update(computed_columns_entry(numeric, size, tolerance, row_numbers))
+    if validate:
+        result["validation"] = validate_columns(
+            typed, error_masks, _as_ndarray(row_numbers, np.int64), rules, normalize_header
+        )
+    return result
+
+
+def computed_columns_entry(numeric: Dict[str, np.ndarray], size: int, tolerance: float,
+                           row_numbers: array) -> Dict[str, Any]:
+    """Columnas calculadas en formato de respuesta, con bitmap de discrepancias"""
+    evaluated = evaluate_computed_columns(numeric, size, tolerance)
+    any_mismatch = np.zeros(size, dtype=bool)
+    computed = {}
+    for field, column in evaluated.items():
+        any_mismatch |= column["mismatches"]
+        computed[field] = {
+            "inputs": list(column["inputs"]),
+            "values": numbers_to_list(column["values"]),
+            "computedCount": int(column["computed"].sum()),
+            "filledCount": int(column["filled"].sum()),
+            "mismatchCount": int(column["mismatches"].sum()),
+            "mismatches": encode_bitmap(column["mismatches"])
+        }
+    rows = _as_ndarray(row_numbers, np.int64)
+    return {
+        "computed": computed,
+        "tolerance": tolerance,
+        "mismatchRows": rows[any_mismatch].tolist()
+    }
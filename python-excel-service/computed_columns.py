@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+"""
+Columnas calculadas de la cubicación sobre arreglos NumPy completos
+
+Superficie = ancho × alto, superficie total = superficie × cantidad y el
+precio base de la pieza = precio por m² × superficie se recalculaban producto
+por producto en el cliente y en los scripts create_*. Aquí cada derivación se
+evalúa una vez sobre la columna entera del libro importado y se marca cada
+fila cuyo valor guardado en el Excel no coincide con el calculado más allá de
+la tolerancia.
+"""
+
+from typing import Any, Callable, Dict, List, Tuple
+
+import numpy as np
+
+# (campo calculado, campos de entrada, fórmula sobre los arreglos de entrada).
+# El orden importa: una columna puede usar otra calculada antes.
+COMPUTED_COLUMNS: List[Tuple[str, Tuple[str, ...], Callable[..., np.ndarray]]] = [
+    ("superficie", ("ancho_m", "alto_m"), lambda ancho, alto: ancho * alto),
+    ("superficie_total", ("superficie", "cantidad_por_unidad"), lambda superficie, cantidad: superficie * cantidad),
+    ("precio_pieza_base_usd", ("precio_unitario_sqm_usd", "superficie"), lambda precio_m2, superficie: precio_m2 * superficie),
+]
+
+# Valor de una entrada cuando la celda está vacía (igual que en el cliente: cantidad || 1)
+INPUT_DEFAULTS = {"cantidad_por_unidad": 1.0}
+
+# Diferencia admitida: relativa al valor calculado, con un mínimo absoluto
+# para los valores que el Excel guarda redondeados a 2 decimales
+DEFAULT_RELATIVE_TOLERANCE = 0.01
+ABSOLUTE_TOLERANCE = 0.005
+# Los calculados se redondean para no arrastrar ruido de coma flotante (1.7999999999999998)
+COMPUTED_DECIMALS = 6
+
+
+def evaluate_computed_columns(numeric: Dict[str, np.ndarray], size: int,
+                              tolerance: float = DEFAULT_RELATIVE_TOLERANCE) -> Dict[str, Dict[str, Any]]:
+    """
+    numeric: {campo: float64 con NaN en blancos} de las columnas importadas.
+    Devuelve por campo calculado {'inputs', 'values' (calculado donde hay
+    entradas, si no el guardado), 'computed', 'filled', 'mismatches'} con
+    máscaras booleanas por fila.
+    """
+    resolved = dict(numeric)
+    results = {}
+    for field, inputs, formula in COMPUTED_COLUMNS:
+        arrays = []
+        for name in inputs:
+            values = resolved.get(name)
+            default = INPUT_DEFAULTS.get(name)
+            if values is None:
+                values = np.full(size, np.nan if default is None else default)
+            elif default is not None:
+                values = np.where(np.isnan(values), default, values)
+            arrays.append(values)
+
+        computed = np.round(formula(*arrays), COMPUTED_DECIMALS)
+        has_computed = ~np.isnan(computed)
+        if not has_computed.any():
+            continue
+
+        stored = numeric.get(field)
+        if stored is None:
+            stored = np.full(size, np.nan)
+        has_stored = ~np.isnan(stored)
+        both = has_computed & has_stored
+        difference = np.abs(np.where(both, stored - computed, 0.0))
+        allowed = np.maximum(ABSOLUTE_TOLERANCE, tolerance * np.abs(np.where(both, computed, 0.0)))
+
+        values = np.where(has_computed, computed, stored)
+        resolved[field] = values
+        results[field] = {
+            "inputs": inputs,
+            "values": values,
+            "computed": has_computed,
+            "filled": has_computed & ~has_stored,
+            "mismatches": both & (difference > allowed),
+        }
+    return results
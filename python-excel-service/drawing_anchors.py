@@ -0,0 +1,352 @@
+#!/usr/bin/env python3
+"""
+Lectura directa de anclajes de imágenes desde el XML de dibujos de un .xlsx
+
+En lugar de cargar el libro completo con openpyxl (celdas, estilos y cadenas
+compartidas), solo se leen las partes necesarias del paquete ZIP:
+xl/workbook.xml, las relaciones de la hoja, xl/drawings/drawingN.xml y sus
+_rels. Todo el XML se recorre con iterparse para no construir el árbol completo.
+"""
+
+import posixpath
+import zipfile
+from typing import Dict, List, Optional, Tuple, Any
+from xml.etree.ElementTree import iterparse
+
+from openpyxl.utils import get_column_letter, column_index_from_string
+
+# Espacios de nombres usados por SpreadsheetML / DrawingML
+NS_MAIN = "http://schemas.openxmlformats.org/spreadsheetml/2006/main"
+NS_REL = "http://schemas.openxmlformats.org/officeDocument/2006/relationships"
+NS_PKG_REL = "http://schemas.openxmlformats.org/package/2006/relationships"
+NS_XDR = "http://schemas.openxmlformats.org/drawingml/2006/spreadsheetDrawing"
+NS_A = "http://schemas.openxmlformats.org/drawingml/2006/main"
+
+REL_TYPE_WORKSHEET = NS_REL + "/worksheet"
+REL_TYPE_DRAWING = NS_REL + "/drawing"
+REL_TYPE_IMAGE = NS_REL + "/image"
+
+ANCHOR_TAGS = {
+    f"{{{NS_XDR}}}twoCellAnchor": "TwoCellAnchor",
+    f"{{{NS_XDR}}}oneCellAnchor": "OneCellAnchor",
+    f"{{{NS_XDR}}}absoluteAnchor": "AbsoluteAnchor",
+}
+
+
+def _tag(ns: str, name: str) -> str:
+    return f"{{{ns}}}{name}"
+
+
+def rels_part_for(part_name: str) -> str:
+    """Devuelve la ruta del archivo _rels asociado a una parte del paquete"""
+    directory, filename = posixpath.split(part_name)
+    return posixpath.join(directory, "_rels", f"{filename}.rels")
+
+
+def resolve_target(source_part: str, target: str) -> str:
+    """
+    Resuelve el Target de una relación a una ruta dentro del ZIP.
+    openpyxl escribe rutas absolutas (/xl/media/image1.png) y Excel rutas
+    relativas a la parte de origen (../media/image1.png).
+    """
+    if target.startswith("/"):
+        return target.lstrip("/")
+    base_dir = posixpath.dirname(source_part)
+    return posixpath.normpath(posixpath.join(base_dir, target))
+
+
+def split_cell_reference(cell_ref: str) -> Tuple[str, int]:
+    """Separa una referencia tipo 'E12' en letra de columna y número de fila"""
+    letters = "".join(ch for ch in cell_ref if ch.isalpha())
+    digits = "".join(ch for ch in cell_ref if ch.isdigit())
+    return letters, int(digits) if digits else 0
+
+
+class DrawingAnchorReader:
+    """Lee hojas, relaciones y anclajes de dibujos de un .xlsx abierto como ZIP"""
+
+    def __init__(self, zip_file: zipfile.ZipFile):
+        self.zip_file = zip_file
+        self._names = set(zip_file.namelist())
+        self._rels_cache: Dict[str, Dict[str, Dict[str, str]]] = {}
+
+    def read_relationships(self, part_name: str) -> Dict[str, Dict[str, str]]:
+        """Lee el _rels de una parte y devuelve {rId: {'type', 'target'}} con rutas resueltas"""
+        if part_name in self._rels_cache:
+            return self._rels_cache[part_name]
+
+        relationships = {}
+        rels_name = rels_part_for(part_name)
+        if rels_name in self._names:
+            with self.zip_file.open(rels_name) as stream:
+                for _, element in iterparse(stream, events=("end",)):
+                    if element.tag == _tag(NS_PKG_REL, "Relationship"):
+                        target = element.get("Target", "")
+                        if element.get("TargetMode") != "External":
+                            target = resolve_target(part_name, target)
+                        relationships[element.get("Id")] = {
+                            "type": element.get("Type", ""),
+                            "target": target,
+                        }
+                    element.clear()
+
+        self._rels_cache[part_name] = relationships
+        return relationships
+
+    def list_sheets(self) -> List[Dict[str, str]]:
+        """Devuelve las hojas del libro en orden: nombre, rId y parte XML"""
+        workbook_part = "xl/workbook.xml"
+        relationships = self.read_relationships(workbook_part)
+        sheets = []
+
+        with self.zip_file.open(workbook_part) as stream:
+            for _, element in iterparse(stream, events=("end",)):
+                if element.tag == _tag(NS_MAIN, "sheet"):
+                    r_id = element.get(_tag(NS_REL, "id"))
+                    rel = relationships.get(r_id, {})
+                    sheets.append({
+                        "name": element.get("name"),
+                        "r_id": r_id,
+                        "part": rel.get("target"),
+                    })
+                elif element.tag == _tag(NS_MAIN, "sheets"):
+                    # No hace falta leer definedNames ni calcPr
+                    break
+
+        return [sheet for sheet in sheets if sheet["part"]]
+
+    def select_target_sheet(self, preferred: str = "DETALLE") -> Optional[Dict[str, str]]:
+        """
+        Prioriza la hoja 'DETALLE' (nombre exacto y luego sin distinguir
+        mayúsculas) o devuelve la primera hoja disponible
+        """
+        sheets = self.list_sheets()
+        for sheet in sheets:
+            if sheet["name"] == preferred:
+                return sheet
+        for sheet in sheets:
+            if (sheet["name"] or "").casefold() == preferred.casefold():
+                return sheet
+        return sheets[0] if sheets else None
+
+    def sheet_drawing_parts(self, sheet_part: str) -> List[str]:
+        """Partes xl/drawings/drawingN.xml referenciadas por una hoja"""
+        relationships = self.read_relationships(sheet_part)
+        return [
+            rel["target"] for rel in relationships.values()
+            if rel["type"] == REL_TYPE_DRAWING and rel["target"] in self._names
+        ]
+
+    def embed_index(self, drawing_part: str) -> Dict[str, str]:
+        """
+        Índice {rId de r:embed: parte xl/media} de un dibujo. Se resuelve una
+        sola vez por dibujo gracias a la caché de relaciones.
+        """
+        return {
+            r_id: rel["target"]
+            for r_id, rel in self.read_relationships(drawing_part).items()
+            if rel["type"] == REL_TYPE_IMAGE
+        }
+
+    def read_shared_strings(self, indexes) -> Dict[int, str]:
+        """
+        Lee solo las cadenas compartidas pedidas. El recorrido se detiene al
+        alcanzar el mayor índice solicitado.
+        """
+        wanted = set(indexes)
+        strings = {}
+        part = "xl/sharedStrings.xml"
+        if not wanted or part not in self._names:
+            return strings
+
+        last_index = max(wanted)
+        current = 0
+        with self.zip_file.open(part) as stream:
+            for _, element in iterparse(stream, events=("end",)):
+                if element.tag == _tag(NS_MAIN, "si"):
+                    if current in wanted:
+                        strings[current] = "".join(
+                            node.text or "" for node in element.iter(_tag(NS_MAIN, "t"))
+                        )
+                    element.clear()
+                    if current >= last_index:
+                        break
+                    current += 1
+        return strings
+
+    def read_all_shared_strings(self) -> List[str]:
+        """Todas las cadenas compartidas en orden (para recorrer filas completas)"""
+        strings = []
+        part = "xl/sharedStrings.xml"
+        if part not in self._names:
+            return strings
+
+        with self.zip_file.open(part) as stream:
+            for _, element in iterparse(stream, events=("end",)):
+                if element.tag == _tag(NS_MAIN, "si"):
+                    strings.append("".join(node.text or "" for node in element.iter(_tag(NS_MAIN, "t"))))
+                    element.clear()
+        return strings
+
+    def read_row_values(self, sheet_part: str, row_number: int) -> Dict[int, Any]:
+        """
+        Devuelve {columna: valor} de una única fila de la hoja, dejando de leer
+        el XML en cuanto se pasa de esa fila.
+        """
+        raw_cells = {}
+        with self.zip_file.open(sheet_part) as stream:
+            for _, element in iterparse(stream, events=("end",)):
+                if element.tag != _tag(NS_MAIN, "row"):
+                    continue
+
+                current_row = int(element.get("r", "0") or 0)
+                if current_row == row_number:
+                    for cell in element.iter(_tag(NS_MAIN, "c")):
+                        letters, _ = split_cell_reference(cell.get("r", ""))
+                        if not letters:
+                            continue
+                        cell_type = cell.get("t", "n")
+                        if cell_type == "inlineStr":
+                            value = "".join(
+                                node.text or "" for node in cell.iter(_tag(NS_MAIN, "t"))
+                            )
+                        else:
+                            value_node = cell.find(_tag(NS_MAIN, "v"))
+                            value = value_node.text if value_node is not None else None
+                        raw_cells[column_index_from_string(letters)] = (cell_type, value)
+                    break
+                if current_row > row_number:
+                    break
+                element.clear()
+
+        shared_indexes = [
+            int(value) for cell_type, value in raw_cells.values()
+            if cell_type == "s" and value is not None
+        ]
+        shared = self.read_shared_strings(shared_indexes)
+
+        values = {}
+        for column, (cell_type, value) in raw_cells.items():
+            if cell_type == "s" and value is not None:
+                values[column] = shared.get(int(value))
+            else:
+                values[column] = value
+        return values
+
+    def read_drawing_anchors(self, drawing_part: str) -> List[Dict[str, Any]]:
+        """
+        Recorre un drawingN.xml y devuelve un registro por imagen con celdas
+        desde/hasta (base 1), offsets y extensión en EMU, rId y parte xl/media.
+        """
+        media_by_rid = self.embed_index(drawing_part)
+        anchors = []
+        current = None
+        marker = None
+        marker_field = None
+
+        with self.zip_file.open(drawing_part) as stream:
+            for event, element in iterparse(stream, events=("start", "end")):
+                tag = element.tag
+
+                if event == "start":
+                    if tag in ANCHOR_TAGS:
+                        current = {
+                            "anchor_type": ANCHOR_TAGS[tag],
+                            "from": None,
+                            "to": None,
+                            "extent_cx": None,
+                            "extent_cy": None,
+                            "embed_rid": None,
+                            "name": None,
+                        }
+                    elif current is not None and tag in (_tag(NS_XDR, "from"), _tag(NS_XDR, "to")):
+                        marker = {"col": 0, "col_off": 0, "row": 0, "row_off": 0}
+                        marker_field = "from" if tag.endswith("}from") else "to"
+                    continue
+
+                # Eventos "end"
+                if current is None:
+                    continue
+
+                if marker is not None and tag in (
+                    _tag(NS_XDR, "col"), _tag(NS_XDR, "colOff"),
+                    _tag(NS_XDR, "row"), _tag(NS_XDR, "rowOff"),
+                ):
+                    key = {"col": "col", "colOff": "col_off", "row": "row", "rowOff": "row_off"}[
+                        tag.split("}", 1)[1]
+                    ]
+                    marker[key] = int(element.text or 0)
+                elif tag in (_tag(NS_XDR, "from"), _tag(NS_XDR, "to")) and marker is not None:
+                    current[marker_field] = marker
+                    marker = None
+                elif (tag in (_tag(NS_XDR, "ext"), _tag(NS_A, "ext"))
+                      and element.get("cx") is not None and current["extent_cx"] is None):
+                    current["extent_cx"] = int(element.get("cx", 0))
+                    current["extent_cy"] = int(element.get("cy", 0))
+                elif tag == _tag(NS_A, "blip") and current["embed_rid"] is None:
+                    current["embed_rid"] = element.get(_tag(NS_REL, "embed"))
+                elif tag == _tag(NS_XDR, "cNvPr") and current["name"] is None:
+                    current["name"] = element.get("name")
+                elif tag in ANCHOR_TAGS:
+                    # Solo interesan los anclajes que contienen una imagen
+                    if current["embed_rid"]:
+                        anchors.append(self._build_anchor_record(current, media_by_rid, drawing_part))
+                    current = None
+                    element.clear()
+
+        return anchors
+
+    def _build_anchor_record(self, raw: Dict[str, Any], media_by_rid: Dict[str, str], drawing_part: str) -> Dict[str, Any]:
+        """Convierte los datos crudos de un anclaje al formato usado por el extractor"""
+        record = {
+            "anchor_type": raw["anchor_type"],
+            "drawing": drawing_part,
+            "embed_rid": raw["embed_rid"],
+            "media_target": media_by_rid.get(raw["embed_rid"]),
+            "name": raw["name"],
+            "extent_cx": raw["extent_cx"],
+            "extent_cy": raw["extent_cy"],
+            "cell_address": None,
+            "row": None,
+            "column": None,
+            "column_letter": None,
+            "col_offset": None,
+            "row_offset": None,
+            "to_cell_address": None,
+            "to_row": None,
+            "to_column": None,
+            "to_col_offset": None,
+            "to_row_offset": None,
+        }
+
+        start = raw["from"]
+        if start is not None:
+            # El XML usa índices base 0; las referencias de celda son base 1
+            column_letter = get_column_letter(start["col"] + 1)
+            record.update({
+                "cell_address": f"{column_letter}{start['row'] + 1}",
+                "row": start["row"] + 1,
+                "column": start["col"] + 1,
+                "column_letter": column_letter,
+                "col_offset": start["col_off"],
+                "row_offset": start["row_off"],
+            })
+
+        end = raw["to"]
+        if end is not None:
+            record.update({
+                "to_cell_address": f"{get_column_letter(end['col'] + 1)}{end['row'] + 1}",
+                "to_row": end["row"] + 1,
+                "to_column": end["col"] + 1,
+                "to_col_offset": end["col_off"],
+                "to_row_offset": end["row_off"],
+            })
+
+        return record
+
+    def read_sheet_anchors(self, sheet_part: str) -> List[Dict[str, Any]]:
+        """Todos los anclajes de imagen de una hoja, en orden de documento"""
+        anchors = []
+        for drawing_part in self.sheet_drawing_parts(sheet_part):
+            anchors.extend(self.read_drawing_anchors(drawing_part))
+        return anchors
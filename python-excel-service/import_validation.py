@@ -0,0 +1,224 @@
+#!/usr/bin/env python3
+"""
+Validación por lotes de las columnas importadas
+
+El modal de Angular validaba fila por fila y campo por campo, mostrando los
+errores de a uno y recorriendo todo de nuevo en cada revalidación. Aquí las
+reglas son declarativas (obligatorio, rango numérico, código único, valor
+permitido) y cada una se evalúa como una máscara NumPy sobre la columna
+entera. El resultado es un resumen agrupado por regla con rangos de filas de
+Excel, no una lista de errores por celda.
+"""
+
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+RULE_REQUIRED = "required"
+RULE_RANGE = "range"
+RULE_UNIQUE = "unique"
+RULE_ALLOWED = "allowed"
+# Celdas que no se pudieron convertir al tipo del campo (bitmap de errores de la importación)
+RULE_TYPE = "type"
+RULE_TYPES = (RULE_REQUIRED, RULE_RANGE, RULE_UNIQUE, RULE_ALLOWED)
+
+# Máximo de rangos de filas por regla en la respuesta
+MAX_RANGES_PER_RULE = 200
+
+# Opciones de material y tipo de vidrio del catálogo (product.service.ts), en
+# español y en inglés; se comparan sin acentos ni mayúsculas
+ALLOWED_MATERIALS = ["Aluminio", "PVC", "Madera", "Acero", "Fibra de Vidrio",
+                     "aluminum", "wood", "steel", "fiberglass"]
+ALLOWED_GLASS_TYPES = ["Simple", "Doble", "Triple", "Laminado", "Templado",
+                       "single", "double", "laminated", "tempered"]
+
+DEFAULT_RULES: List[Dict[str, Any]] = [
+    {"id": "codigo_obligatorio", "type": RULE_REQUIRED, "field": "codigo"},
+    {"id": "codigo_unico", "type": RULE_UNIQUE, "field": "codigo"},
+    {"id": "ancho_rango", "type": RULE_RANGE, "field": "ancho_m", "min": 0.01, "max": 20},
+    {"id": "alto_rango", "type": RULE_RANGE, "field": "alto_m", "min": 0.01, "max": 20},
+    {"id": "cantidad_rango", "type": RULE_RANGE, "field": "cantidad_por_unidad", "min": 1, "max": 100000},
+    {"id": "precio_no_negativo", "type": RULE_RANGE, "field": "precio_unitario_usd", "min": 0},
+    {"id": "precio_m2_no_negativo", "type": RULE_RANGE, "field": "precio_unitario_sqm_usd", "min": 0},
+    {"id": "material_permitido", "type": RULE_ALLOWED, "field": "material", "values": ALLOWED_MATERIALS},
+    {"id": "tipo_vidrio_permitido", "type": RULE_ALLOWED, "field": "tipo_vidrio", "values": ALLOWED_GLASS_TYPES},
+]
+
+DEFAULT_MESSAGES = {
+    RULE_REQUIRED: "Campo obligatorio vacío",
+    RULE_RANGE: "Valor fuera de rango",
+    RULE_UNIQUE: "Valor repetido",
+    RULE_ALLOWED: "Valor no permitido",
+    RULE_TYPE: "Valor con formato no válido",
+}
+
+
+class InvalidRule(ValueError):
+    """Regla mal formada o que no aplica al tipo de su campo"""
+
+
+def parse_rules(rules: Any) -> List[Dict[str, Any]]:
+    """Valida la forma de una lista de reglas recibida como JSON; lanza InvalidRule"""
+    if not isinstance(rules, list):
+        raise InvalidRule("Las reglas deben ser una lista")
+    parsed = []
+    for index, rule in enumerate(rules):
+        if not isinstance(rule, dict) or not isinstance(rule.get("field"), str):
+            raise InvalidRule(f"Regla {index}: se requiere un objeto con 'field'")
+        rule_type = rule.get("type")
+        if rule_type not in RULE_TYPES:
+            raise InvalidRule(f"Regla {index}: tipo no válido '{rule_type}'. Use uno de {', '.join(RULE_TYPES)}")
+        if rule_type == RULE_RANGE and not any(
+            isinstance(rule.get(bound), (int, float)) for bound in ("min", "max")
+        ):
+            raise InvalidRule(f"Regla {index}: un rango requiere 'min' o 'max' numéricos")
+        if rule_type == RULE_ALLOWED and not isinstance(rule.get("values"), list):
+            raise InvalidRule(f"Regla {index}: 'allowed' requiere una lista 'values'")
+        parsed.append(dict(rule, id=str(rule.get("id") or f"{rule_type}_{rule['field']}")))
+    return parsed
+
+
+class FieldColumn:
+    """
+    Columna de un campo con los derivados que comparten sus reglas (blancos y
+    factorización en valores distintos), calculados una sola vez
+    """
+
+    def __init__(self, values: np.ndarray):
+        self.values = values
+        self.is_text = values.dtype == object
+        self._nulls: Optional[np.ndarray] = None
+        self._factorized = None
+
+    @property
+    def nulls(self) -> np.ndarray:
+        if self._nulls is None:
+            if self.is_text:
+                self._nulls = self.values == None  # noqa: E711 (comparación elemento a elemento)
+            else:
+                self._nulls = np.isnan(self.values)
+        return self._nulls
+
+    def factorized(self):
+        """
+        (valores distintos como texto, índice de cada celda no vacía en ellos).
+        Se factoriza con un diccionario: evita ordenar y copiar a un arreglo de
+        texto de ancho fijo, que es lo más caro con columnas de códigos.
+        """
+        if self._factorized is None:
+            present = self.values[~self.nulls]
+            table: Dict[str, int] = {}
+            inverse = np.fromiter(
+                (table.setdefault(str(value), len(table)) for value in present.tolist()),
+                dtype=np.int64, count=len(present)
+            )
+            self._factorized = (list(table), inverse)
+        return self._factorized
+
+    def case_insensitive_groups(self) -> np.ndarray:
+        """Índice de grupo de cada celda no vacía, sin distinguir mayúsculas ni espacios"""
+        distinct, inverse = self.factorized()
+        groups: Dict[str, int] = {}
+        group_of = np.fromiter(
+            (groups.setdefault(value.strip().upper(), len(groups)) for value in distinct),
+            dtype=np.int64, count=len(distinct)
+        )
+        return group_of[inverse]
+
+
+def rule_mask(rule: Dict[str, Any], column: FieldColumn, normalize) -> np.ndarray:
+    """Máscara booleana de las filas que no cumplen la regla"""
+    rule_type = rule["type"]
+    nulls = column.nulls
+    if rule_type == RULE_REQUIRED:
+        return nulls
+
+    present = ~nulls
+    mask = np.zeros(len(nulls), dtype=bool)
+    if rule_type == RULE_RANGE:
+        if column.is_text:
+            raise InvalidRule(f"Regla {rule['id']}: el campo '{rule['field']}' no es numérico")
+        values = column.values
+        if rule.get("min") is not None:
+            mask |= present & (values < rule["min"])
+        if rule.get("max") is not None:
+            mask |= present & (values > rule["max"])
+        return mask
+
+    if not present.any():
+        return mask
+    # Las comparaciones de texto se hacen sobre los valores distintos, no por celda
+    if rule_type == RULE_UNIQUE:
+        groups = column.case_insensitive_groups()
+        mask[present] = np.bincount(groups)[groups] > 1
+    elif rule_type == RULE_ALLOWED:
+        distinct, inverse = column.factorized()
+        allowed = {normalize(value) for value in rule["values"]}
+        accepted = np.array([normalize(value) in allowed for value in distinct], dtype=bool)
+        mask[present] = ~accepted[inverse]
+    return mask
+
+
+def row_ranges(mask: np.ndarray, row_numbers: np.ndarray, max_ranges: int = MAX_RANGES_PER_RULE):
+    """Filas de Excel marcadas agrupadas en tramos consecutivos [[desde, hasta], ...]"""
+    rows = row_numbers[mask]
+    if not len(rows):
+        return [], False
+    breaks = np.flatnonzero(np.diff(rows) != 1)
+    starts = np.concatenate(([rows[0]], rows[breaks + 1]))
+    ends = np.concatenate((rows[breaks], [rows[-1]]))
+    ranges = np.stack((starts, ends), axis=1)
+    return ranges[:max_ranges].tolist(), len(ranges) > max_ranges
+
+
+def validate_columns(columns: Dict[str, np.ndarray], errors: Dict[str, np.ndarray], row_numbers: np.ndarray,
+                     rules: Optional[List[Dict[str, Any]]] = None, normalize=str.casefold) -> Dict[str, Any]:
+    """
+    columns: {campo: arreglo} (float64 con NaN o object con None) alineados
+    con row_numbers; errors: {campo: máscara de celdas no convertibles}.
+    Devuelve el resumen agrupado por regla (solo las reglas con fallas).
+    """
+    rules = DEFAULT_RULES if rules is None else rules
+    size = len(row_numbers)
+    fields = {field: FieldColumn(values) for field, values in columns.items()}
+    invalid_rows = np.zeros(size, dtype=bool)
+    summary = []
+
+    def add(rule: Dict[str, Any], mask: np.ndarray, **extra):
+        nonlocal invalid_rows
+        count = int(mask.sum())
+        if not count:
+            return
+        invalid_rows |= mask
+        ranges, truncated = row_ranges(mask, row_numbers)
+        entry = {
+            "id": rule["id"],
+            "type": rule["type"],
+            "field": rule["field"],
+            "message": rule.get("message") or DEFAULT_MESSAGES[rule["type"]],
+            "count": count,
+            "rows": ranges,
+            "truncated": truncated
+        }
+        entry.update(extra)
+        summary.append(entry)
+
+    for field, mask in errors.items():
+        add({"id": f"{RULE_TYPE}_{field}", "type": RULE_TYPE, "field": field}, mask)
+
+    for rule in rules:
+        column = fields.get(rule["field"])
+        if column is None:
+            # Sin columna mapeada solo falla 'obligatorio', y en todas las filas
+            if rule["type"] == RULE_REQUIRED:
+                add(rule, np.ones(size, dtype=bool), missingColumn=True)
+            continue
+        add(rule, rule_mask(rule, column, normalize))
+
+    return {
+        "valid": not summary,
+        "rulesEvaluated": len(rules),
+        "issueCount": sum(entry["count"] for entry in summary),
+        "invalidRowCount": int(invalid_rows.sum()),
+        "rules": summary
+    }
@@ -0,0 +1,171 @@
+#!/usr/bin/env python3
+"""
+Cola local de trabajos asíncronos (sin broker externo)
+
+Los libros de más de ~100 MB superan el timeout del proxy si toda la
+extracción ocurre dentro de una sola petición. Con esta cola el cliente envía
+el archivo, recibe un id y consulta el estado (etapa y porcentaje) hasta que
+el resultado está listo. Los trabajos corren como tareas del event loop con
+concurrencia limitada y los terminados se liberan tras un TTL.
+"""
+
+import asyncio
+import time
+import uuid
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+# Cancelación pedida mientras corre: el trabajo del pool no se puede
+# interrumpir, así que se corta al pasar a la etapa siguiente
+JOB_CANCELLING = "cancelling"
+JOB_DONE = "done"
+JOB_FAILED = "failed"
+JOB_CANCELLED = "cancelled"
+FINAL_STATES = (JOB_DONE, JOB_FAILED, JOB_CANCELLED)
+
+
+class JobQueue:
+    """Trabajos en memoria con concurrencia configurable, TTL y cancelación"""
+
+    def __init__(self, concurrency: int, ttl_seconds: int):
+        self.concurrency = max(1, concurrency)
+        self.ttl_seconds = ttl_seconds
+        self._semaphore = asyncio.Semaphore(self.concurrency)
+        self._jobs: Dict[str, Dict[str, Any]] = {}
+        self._tasks: Dict[str, asyncio.Task] = {}
+        self._counts = {state: 0 for state in FINAL_STATES}
+        self.expired = 0
+
+    def submit(self, runner: Callable[[Dict[str, Any]], Awaitable[Any]],
+               cleanup: Optional[Callable[[], None]] = None, **metadata) -> Dict[str, Any]:
+        """
+        Encola runner(job) y devuelve el registro del trabajo. runner informa
+        su avance con progress(); cleanup se llama siempre al terminar.
+        """
+        job = {
+            "id": uuid.uuid4().hex,
+            "status": JOB_QUEUED,
+            "stage": JOB_QUEUED,
+            "progress": 0,
+            "created_at": time.time(),
+            "started_at": None,
+            "finished_at": None,
+            "expires_at": None,
+            "result": None,
+            "error": None,
+        }
+        job.update(metadata)
+        self._jobs[job["id"]] = job
+        self._tasks[job["id"]] = asyncio.create_task(self._run(job, runner, cleanup))
+        return job
+
+    async def _run(self, job: Dict[str, Any], runner, cleanup):
+        try:
+            async with self._semaphore:
+                job["status"] = JOB_RUNNING
+                job["started_at"] = time.time()
+                job["result"] = await runner(job)
+                self.check_cancelled(job)
+                self.progress(job, JOB_DONE, 100)
+                self._finish(job, JOB_DONE)
+        except asyncio.CancelledError:
+            job["result"] = None
+            self._finish(job, JOB_CANCELLED)
+        except Exception as e:
+            print(f"Trabajo {job['id']} falló: {str(e)}")
+            job["error"] = str(e)
+            self._finish(job, JOB_FAILED)
+        finally:
+            self._tasks.pop(job["id"], None)
+            if cleanup is not None:
+                cleanup()
+
+    def _finish(self, job: Dict[str, Any], status: str):
+        now = time.time()
+        job["status"] = status
+        job["finished_at"] = now
+        job["expires_at"] = now + self.ttl_seconds
+        self._counts[status] += 1
+
+    @staticmethod
+    def check_cancelled(job: Dict[str, Any]):
+        """Lanza CancelledError si se pidió cancelar el trabajo en curso"""
+        if job["status"] == JOB_CANCELLING:
+            raise asyncio.CancelledError()
+
+    @classmethod
+    def progress(cls, job: Dict[str, Any], stage: str, percent: int):
+        """
+        Actualiza la etapa y el porcentaje visibles en el estado del trabajo.
+        Es también el punto de corte de una cancelación pedida en curso.
+        """
+        cls.check_cancelled(job)
+        job["stage"] = stage
+        job["progress"] = max(job["progress"], min(100, percent))
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        job = self._jobs.get(job_id)
+        if job is not None and job["expires_at"] is not None and job["expires_at"] <= time.time():
+            self._discard(job_id)
+            self.expired += 1
+            return None
+        return job
+
+    def cancel(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """
+        Cancela un trabajo pendiente o en curso. Uno pendiente se cancela de
+        inmediato; uno en curso queda en 'cancelling' hasta que termine el
+        trabajo del pool de su etapa actual (que sigue ocupando un trabajador)
+        y se corta antes de la siguiente. Si ya había terminado se descarta
+        para liberar su resultado. Devuelve el registro o None.
+        """
+        job = self.get(job_id)
+        if job is None:
+            return None
+        task = self._tasks.get(job_id)
+        if task is None:
+            self._discard(job_id)
+        elif job["status"] == JOB_QUEUED:
+            task.cancel()
+        elif job["status"] == JOB_RUNNING:
+            job["status"] = JOB_CANCELLING
+        return job
+
+    def _discard(self, job_id: str):
+        job = self._jobs.pop(job_id, None)
+        if job is not None:
+            job["result"] = None
+
+    def purge_expired(self) -> int:
+        now = time.time()
+        expired_ids = [
+            job_id for job_id, job in self._jobs.items()
+            if job["expires_at"] is not None and job["expires_at"] <= now
+        ]
+        for job_id in expired_ids:
+            self._discard(job_id)
+        self.expired += len(expired_ids)
+        return len(expired_ids)
+
+    async def shutdown(self):
+        """Cancela los trabajos pendientes y espera a que liberen sus recursos"""
+        tasks = list(self._tasks.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def stats(self) -> Dict[str, Any]:
+        states = [job["status"] for job in self._jobs.values()]
+        return {
+            "concurrency": self.concurrency,
+            "ttl_seconds": self.ttl_seconds,
+            "queued": states.count(JOB_QUEUED),
+            "running": states.count(JOB_RUNNING),
+            "cancelling": states.count(JOB_CANCELLING),
+            "retained": sum(1 for state in states if state in FINAL_STATES),
+            "completed": self._counts[JOB_DONE],
+            "failed": self._counts[JOB_FAILED],
+            "cancelled": self._counts[JOB_CANCELLED],
+            "expired": self.expired,
+        }
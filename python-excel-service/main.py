@@ -4,21 +4,168 @@ Servicio Python para extraer imágenes de archivos Excel (.xlsx)
 """
 
 import os
+import io
+import time
+import asyncio
 import base64
+import hashlib
+import json
 import zipfile
 import tempfile
 import shutil
 import traceback
-from typing import List, Dict, Any
-from fastapi import FastAPI, File, UploadFile, HTTPException
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import List, Dict, Any, Optional, Union, BinaryIO, Callable
+from fastapi import FastAPI, Body, File, Form, UploadFile, HTTPException, Query, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, Response, StreamingResponse
 import openpyxl
 from openpyxl.drawing.image import Image
 from openpyxl.utils import get_column_letter
 
-app = FastAPI(title="Excel Image Extractor", version="1.0.0")
+from column_import import import_columns, COLUMN_TYPES, DECIMAL_SEPARATORS, DEFAULT_DECIMAL_SEPARATOR
+from computed_columns import DEFAULT_RELATIVE_TOLERANCE
+from import_validation import InvalidRule, parse_rules
+from offer_pdf import parse_offer, render_offer_pdf
+from pdf_writer import PdfStreamWriter
+from drawing_anchors import DrawingAnchorReader
+from job_queue import JobQueue, JOB_DONE, JOB_FAILED, FINAL_STATES
+from media_store import MediaStore, image_dimensions
+from response_formats import (
+    FORMAT_JSON, FORMAT_ZIP, FORMAT_NDJSON, MEDIA_TYPE_MULTIPART, MEDIA_TYPE_ZIP, MEDIA_TYPE_NDJSON,
+    negotiate_format, new_boundary, multipart_stream, zip_stream, ndjson_line
+)
+from row_images import iter_rows_with_images
+from sheet_rows import SheetRowParser, HEADER_ROW, find_design_column
+from sheet_pdf import iter_sheet_pages, render_sheet_pages, write_page_total
+from template_fill import TemplateFill
+from result_cache import ResultCache, CACHE_BYPASS
+from renditions import (
+    PIL_AVAILABLE, RENDITION_FORMATS, DEFAULT_RENDITION_FORMAT, parse_rendition_sizes, render_renditions
+)
+from upload_sessions import UploadSessionStore, UploadSessionError
+from upload_limits import RequestSizeLimitMiddleware, UploadTooLarge, iter_upload_chunks, spool_upload_chunks
+from workbook_store import WorkbookStore, WorkbookTooLarge
+from xlsx_export import iter_xlsx_export, parse_export
+from worker_pool import WorkerPool, POOL_KIND_PROCESS, POOL_KINDS
+
+# Motor de lectura de anclajes: "xml" lee directamente xl/drawings (rápido),
+# "openpyxl" carga el libro completo (modo de respaldo)
+ANCHOR_MODE_XML = "xml"
+ANCHOR_MODE_OPENPYXL = "openpyxl"
+ANCHOR_MODES = (ANCHOR_MODE_XML, ANCHOR_MODE_OPENPYXL)
+DEFAULT_ANCHOR_MODE = os.getenv("EXCEL_ANCHOR_MODE", ANCHOR_MODE_XML)
+
+# Subidas hasta este tamaño se procesan completamente en memoria; por encima
+# se vuelcan a un archivo temporal (SpooledTemporaryFile)
+SPOOL_MAX_BYTES = int(os.getenv("EXCEL_SPOOL_MAX_BYTES", str(32 * 1024 * 1024)))
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+
+# Límites de subida (413): por archivo y por petición completa de un lote
+MAX_UPLOAD_BYTES = int(os.getenv("EXCEL_MAX_UPLOAD_BYTES", str(256 * 1024 * 1024)))
+MAX_BATCH_BYTES = int(os.getenv("EXCEL_MAX_BATCH_BYTES", str(1024 * 1024 * 1024)))
+# Memoria total para las copias de un lote; los archivos que no caben van a disco
+BATCH_SPOOL_MAX_BYTES = int(os.getenv("EXCEL_BATCH_SPOOL_MAX_BYTES", str(128 * 1024 * 1024)))
+# Margen para las cabeceras multipart y los campos del formulario
+MULTIPART_OVERHEAD_BYTES = 64 * 1024
+
+# Paginación de /parse-rows
+PARSE_ROWS_DEFAULT_LIMIT = 500
+PARSE_ROWS_MAX_LIMIT = 5000
+
+# Subidas reanudables por partes (POST /uploads), guardadas en disco local
+UPLOAD_SESSION_DIR = os.getenv("EXCEL_UPLOAD_SESSION_DIR") or os.path.join(tempfile.gettempdir(), "excel-upload-sessions")
+UPLOAD_SESSION_TTL_SECONDS = int(os.getenv("EXCEL_UPLOAD_SESSION_TTL_SECONDS", str(24 * 3600)))
+
+# Pico de memoria de las subidas, informado en /health
+upload_stats = {"uploads": 0, "bytes": 0, "spilled_to_disk": 0, "max_spooled_bytes": 0}
+
+# Ruta en disco o archivo binario abierto y posicionable (BytesIO, SpooledTemporaryFile)
+ExcelSource = Union[str, BinaryIO]
+
+MIME_TYPES = {
+    '.png': 'image/png',
+    '.jpg': 'image/jpeg',
+    '.jpeg': 'image/jpeg',
+    '.gif': 'image/gif',
+    '.bmp': 'image/bmp',
+    '.tiff': 'image/tiff',
+    '.svg': 'image/svg+xml'
+}
+
+# Pool de trabajadores para la extracción (CPU): "process" reparte entre
+# núcleos, "thread" evita serializar los datos entre procesos
+POOL_KIND = os.getenv("EXCEL_POOL_KIND", POOL_KIND_PROCESS)
+POOL_WORKERS = int(os.getenv("EXCEL_POOL_WORKERS", "0")) or None
+
+extraction_pool = WorkerPool(POOL_KIND if POOL_KIND in POOL_KINDS else POOL_KIND_PROCESS, POOL_WORKERS)
+
+# Caché de resultados por SHA-256 de la subida (0 deshabilita el nivel en memoria;
+# el nivel en disco solo se activa si se define EXCEL_CACHE_DIR)
+CACHE_MAX_BYTES = int(os.getenv("EXCEL_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+CACHE_DIR = os.getenv("EXCEL_CACHE_DIR") or None
+CACHE_DISK_MAX_BYTES = int(os.getenv("EXCEL_CACHE_DISK_MAX_BYTES", str(2 * 1024 * 1024 * 1024)))
+
+result_cache = ResultCache(CACHE_MAX_BYTES, CACHE_DIR, CACHE_DISK_MAX_BYTES)
+
+# Libros ingeridos con POST /workbooks: expiran tras WORKBOOK_TTL_SECONDS sin uso
+WORKBOOK_TTL_SECONDS = int(os.getenv("EXCEL_WORKBOOK_TTL_SECONDS", "1800"))
+WORKBOOK_STORE_MAX_BYTES = int(os.getenv("EXCEL_WORKBOOK_STORE_MAX_BYTES", str(512 * 1024 * 1024)))
+WORKBOOK_SWEEP_SECONDS = 60
+
+# Un proyecto llega como 10-30 libros (uno por edificio o piso)
+BATCH_MAX_FILES = int(os.getenv("EXCEL_BATCH_MAX_FILES", "50"))
+
+# Trabajos asíncronos (POST /jobs) para libros que superan el timeout del proxy
+JOB_CONCURRENCY = int(os.getenv("EXCEL_JOB_CONCURRENCY", "2"))
+JOB_TTL_SECONDS = int(os.getenv("EXCEL_JOB_TTL_SECONDS", "3600"))
+
+# Porcentaje informado al entrar en cada etapa de un trabajo
+JOB_STAGE_PROGRESS = {"extracting": 10, "renditions": 60, "storing": 90}
+
+job_queue = JobQueue(JOB_CONCURRENCY, JOB_TTL_SECONDS)
+
+upload_sessions = UploadSessionStore(UPLOAD_SESSION_DIR, UPLOAD_SESSION_TTL_SECONDS, MAX_UPLOAD_BYTES)
+
+workbook_store = WorkbookStore(WORKBOOK_TTL_SECONDS, WORKBOOK_STORE_MAX_BYTES)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """El pool de trabajadores, la cola de trabajos y la limpieza viven lo mismo que la aplicación"""
+    extraction_pool.start()
+    sweeper = asyncio.create_task(_sweep_expired())
+    yield
+    sweeper.cancel()
+    await job_queue.shutdown()
+    extraction_pool.shutdown()
+
+
+async def _sweep_expired():
+    """Libera periódicamente libros, trabajos y subidas cuyo TTL venció aunque nadie los consulte"""
+    while True:
+        await asyncio.sleep(WORKBOOK_SWEEP_SECONDS)
+        expired = workbook_store.purge_expired()
+        if expired:
+            print(f"{expired} libros expirados liberados")
+        expired = job_queue.purge_expired()
+        if expired:
+            print(f"{expired} trabajos expirados liberados")
+        expired = await asyncio.to_thread(upload_sessions.purge_expired)
+        if expired:
+            print(f"{expired} sesiones de subida expiradas borradas")
+
+
+app = FastAPI(title="Excel Image Extractor", version="1.0.0", lifespan=lifespan)
 
 # Configurar CORS para permitir conexiones desde Angular
+app.add_middleware(
+    RequestSizeLimitMiddleware,
+    max_bytes=MAX_UPLOAD_BYTES + MULTIPART_OVERHEAD_BYTES if MAX_UPLOAD_BYTES else 0,
+    path_limits={"/extract-images/batch": MAX_BATCH_BYTES}
+)
+
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["http://localhost:4200", "http://127.0.0.1:4200"],
@@ -30,8 +177,13 @@ app.add_middleware(
 class ExcelImageExtractor:
     """Clase para extraer imágenes de archivos Excel usando tanto openpyxl como ZIP"""
     
-    def __init__(self):
+    def __init__(self, anchor_mode: str = DEFAULT_ANCHOR_MODE):
         self.temp_dirs = []
+        self.unanchored_media: List[Dict[str, Any]] = []
+        # Hoja y columna de diseño detectadas en la última lectura de posiciones
+        self.target_sheet: Optional[str] = None
+        self.design_column: Optional[int] = None
+        self.anchor_mode = anchor_mode if anchor_mode in ANCHOR_MODES else ANCHOR_MODE_XML
     
     def extract_images_from_excel(self, excel_path: str, output_dir: str) -> List[Dict[str, Any]]:
         """
@@ -41,17 +193,31 @@ class ExcelImageExtractor:
             raise FileNotFoundError(f"Archivo Excel no encontrado: {excel_path}")
         
         os.makedirs(output_dir, exist_ok=True)
+        return self._extract(excel_path, output_dir)
+
+    def extract_images_in_memory(self, excel_source: Union[bytes, BinaryIO]) -> List[Dict[str, Any]]:
+        """
+        Extrae imágenes sin pasar por disco. Acepta los bytes de la subida o un
+        archivo abierto; cada imagen se devuelve con sus bytes en 'data' en
+        lugar de una ruta 'path'.
+        """
+        if isinstance(excel_source, (bytes, bytearray, memoryview)):
+            excel_source = io.BytesIO(excel_source)
+        return self._extract(excel_source, None)
+
+    def _extract(self, excel_source: ExcelSource, output_dir: Optional[str]) -> List[Dict[str, Any]]:
+        """Flujo común: posiciones, medios del ZIP y unión por r:embed"""
         images_info = []
         
         try:
-            # Método 1: Usar openpyxl para obtener información de posición
-            position_info = self._extract_position_info_with_openpyxl(excel_path)
+            # Método 1: Obtener información de posición (XML de dibujos u openpyxl)
+            position_info = self._extract_position_info(excel_source)
             
             # Método 2: Extraer imágenes del ZIP
-            zip_images = self._extract_images_from_zip(excel_path, output_dir)
+            zip_images = self._extract_images_from_zip(excel_source, output_dir)
             
-            # Combinar información de posición con imágenes extraídas
-            images_info = self._merge_position_and_images(position_info, zip_images)
+            # Combinar información de posición con imágenes extraídas (unión por r:embed)
+            images_info, self.unanchored_media = self._merge_position_and_images(position_info, zip_images)
             
         except Exception as e:
             print(f"Error durante la extracción: {str(e)}")
@@ -59,13 +225,100 @@ class ExcelImageExtractor:
             
             # Fallback: solo extraer del ZIP sin información de posición
             try:
-                images_info = self._extract_images_from_zip(excel_path, output_dir)
+                images_info = self._extract_images_from_zip(excel_source, output_dir)
             except Exception as fallback_error:
                 print(f"Error en fallback: {str(fallback_error)}")
                 raise
         
         return images_info
     
+    def iter_images(self, excel_source: ExcelSource):
+        """
+        Versión incremental de la extracción para respuestas en streaming.
+        Primero produce ('header', {...}), luego ('image', img_info) por cada
+        anclaje apenas se leen sus bytes y al final ('trailer', {...}).
+        Solo se mantiene en memoria la imagen en curso: de los contenidos ya
+        emitidos se guarda únicamente su hash.
+        """
+        started = time.perf_counter()
+        position_info = self._extract_position_info(excel_source)
+        anchors_done = time.perf_counter()
+
+        yield 'header', {
+            'sheet': self.target_sheet,
+            'design_column': self.design_column,
+            'design_column_letter': get_column_letter(self.design_column) if self.design_column else None,
+            'anchor_mode': self.anchor_mode,
+            'anchors': len(position_info)
+        }
+
+        count = 0
+        skipped = 0
+        sent_blobs = set()
+        used_media = set()
+        blob_by_part: Dict[str, str] = {}
+
+        with zipfile.ZipFile(excel_source, 'r') as zip_file:
+            media_infos = {
+                info.filename: info for info in zip_file.infolist()
+                if info.filename.startswith('xl/media/') and not info.is_dir()
+            }
+
+            for position in position_info:
+                media_target = position.get('media_target')
+                media_info = media_infos.get(media_target)
+                if media_info is None:
+                    skipped += 1
+                    continue
+
+                data = None
+                blob_id = blob_by_part.get(media_target)
+                if blob_id is None:
+                    data = zip_file.read(media_info)
+                    blob_id = hashlib.sha256(data).hexdigest()
+                    blob_by_part[media_target] = blob_id
+
+                original_name = os.path.basename(media_target)
+                img_info = dict(position)
+                img_info.update({
+                    'media_target': media_target,
+                    'blob_id': blob_id,
+                    'filename': original_name,
+                    'size': media_info.file_size,
+                    'extension': os.path.splitext(original_name)[1].lower(),
+                    # Los bytes solo viajan la primera vez que aparece un contenido
+                    'data': data if blob_id not in sent_blobs else None
+                })
+                sent_blobs.add(blob_id)
+                used_media.add(media_target)
+                count += 1
+                yield 'image', img_info
+
+            # Con su blob_id, igual que en la extracción en memoria (el resultado va a la misma caché)
+            self.unanchored_media = [
+                {
+                    'media_target': name,
+                    'blob_id': blob_by_part.get(name) or hashlib.sha256(zip_file.read(info)).hexdigest(),
+                    'filename': os.path.basename(name),
+                    'size': info.file_size,
+                    'extension': os.path.splitext(name)[1].lower()
+                }
+                for name, info in sorted(media_infos.items()) if name not in used_media
+            ]
+        finished = time.perf_counter()
+
+        yield 'trailer', {
+            'count': count,
+            'unique_blobs': len(sent_blobs),
+            'skipped_anchors': skipped,
+            'unanchored_media': self.unanchored_media,
+            'timings_ms': {
+                'anchors': round((anchors_done - started) * 1000, 2),
+                'images': round((finished - anchors_done) * 1000, 2),
+                'total': round((finished - started) * 1000, 2)
+            }
+        }
+
     def _find_design_column(self, worksheet) -> int:
         """
         Encuentra el índice de la columna de diseño (columna E = 5)
@@ -80,12 +333,60 @@ class ExcelImageExtractor:
         # Si no se encuentra, asumir columna E (5) según el layout conocido
         return 5  # Columna E
 
-    def _extract_position_info_with_openpyxl(self, excel_path: str) -> List[Dict[str, Any]]:
+    def _find_design_column_in_row(self, header_values: Dict[int, Any]) -> int:
+        """Igual que _find_design_column pero sobre los valores ya leídos de la fila 5"""
+        return find_design_column(header_values)
+
+    def _extract_position_info(self, excel_source: ExcelSource) -> List[Dict[str, Any]]:
+        """Obtiene la posición de las imágenes según el modo de anclaje configurado"""
+        if self.anchor_mode == ANCHOR_MODE_OPENPYXL:
+            return self._extract_position_info_with_openpyxl(excel_source)
+
+        try:
+            return self._extract_position_info_from_drawing_xml(excel_source)
+        except Exception as e:
+            print(f"Error leyendo XML de dibujos, usando openpyxl: {str(e)}")
+            return self._extract_position_info_with_openpyxl(excel_source)
+
+    def _extract_position_info_from_drawing_xml(self, excel_source: ExcelSource) -> List[Dict[str, Any]]:
+        """
+        Extrae la posición de las imágenes leyendo solo workbook.xml, las
+        relaciones de la hoja y xl/drawings, sin cargar celdas ni estilos
+        """
+        position_info = []
+
+        with zipfile.ZipFile(excel_source, 'r') as zip_file:
+            reader = DrawingAnchorReader(zip_file)
+            sheet = reader.select_target_sheet("DETALLE")
+            if not sheet:
+                print("No se encontraron hojas en el archivo Excel")
+                return position_info
+
+            target_sheet = sheet["name"]
+            design_col = self._find_design_column_in_row(reader.read_row_values(sheet["part"], 5))
+            self.target_sheet, self.design_column = target_sheet, design_col
+            print(f"Columna de diseño encontrada: {design_col} (columna {get_column_letter(design_col)})")
+
+            for idx, anchor in enumerate(reader.read_sheet_anchors(sheet["part"])):
+                # Solo las imágenes ancladas a una celda de la columna de diseño; las que
+                # no tienen celda (absoluteAnchor) quedan en unanchoredMedia
+                if anchor["column"] == design_col and anchor["row"]:
+                    info = dict(anchor)
+                    info.update({
+                        'sheet': target_sheet,
+                        'image_index': idx
+                    })
+                    position_info.append(info)
+                    print(f"Imagen {idx}: {info['cell_address']} en hoja {target_sheet} -> {anchor['media_target']}")
+
+        return position_info
+
+    def _extract_position_info_with_openpyxl(self, excel_source: ExcelSource) -> List[Dict[str, Any]]:
         """Extrae información de posición de imágenes usando openpyxl"""
         position_info = []
         
         try:
-            workbook = openpyxl.load_workbook(excel_path, data_only=False)
+            workbook = openpyxl.load_workbook(excel_source, data_only=False)
             
             # Priorizar la hoja "DETALLE" o usar la primera hoja disponible
             target_sheet = None
@@ -100,11 +401,15 @@ class ExcelImageExtractor:
             
             # Solo procesar la hoja objetivo
             worksheet = workbook[target_sheet]
+
+            # openpyxl no conserva la ruta xl/media de cada imagen: se resuelve por r:embed
+            media_by_rid = self._sheet_embed_index(excel_source, target_sheet)
             
             # Buscar imágenes en la hoja
             if hasattr(worksheet, '_images'):
                 # Encontrar la columna de diseño (columna E = 5)
                 design_col = self._find_design_column(worksheet)
+                self.target_sheet, self.design_column = target_sheet, design_col
                 print(f"Columna de diseño encontrada: {design_col} (columna {get_column_letter(design_col)})")
                 
                 # Procesar todas las imágenes en la columna de diseño
@@ -117,6 +422,11 @@ class ExcelImageExtractor:
                         column = None
                         column_letter = None
                         
+                        embed_rid = None
+                        pic = getattr(anchor, 'pic', None)
+                        if pic is not None and pic.blipFill is not None and pic.blipFill.blip is not None:
+                            embed_rid = pic.blipFill.blip.embed
+
                         if hasattr(anchor, '_from') and anchor._from:
                             # openpyxl usa índices base 0, pero para referencias de celda usamos base 1
                             cell_ref = f"{get_column_letter(anchor._from.col + 1)}{anchor._from.row + 1}"
@@ -124,31 +434,25 @@ class ExcelImageExtractor:
                             column = anchor._from.col + 1  # Convertir a base 1 para consistencia
                             column_letter = get_column_letter(anchor._from.col + 1)
                         
-                        # Incluir la imagen si está en la columna de diseño o si no pudimos determinar la posición
-                        if column == design_col or column is None:
+                        # Solo las imágenes ancladas a una celda de la columna de diseño; sin
+                        # posición conocida no se inventa una celda y quedan en unanchoredMedia
+                        if column == design_col:
                             position_info.append({
                                 'sheet': target_sheet,  # Usar "DETALLE" en lugar de "unknown"
-                                'cell_address': cell_ref or f"E{6 + idx}",  # Fallback: E6, E7, etc.
-                                'row': row or (6 + idx),  # Fallback: fila 6, 7, etc.
-                                'column': column or design_col,
-                                'column_letter': column_letter or 'E',
+                                'cell_address': cell_ref,
+                                'row': row,
+                                'column': column,
+                                'column_letter': column_letter,
                                 'anchor_type': type(anchor).__name__,
-                                'image_index': idx
+                                'image_index': idx,
+                                'embed_rid': embed_rid,
+                                'media_target': media_by_rid.get(embed_rid)
                             })
-                            print(f"Imagen {idx}: {cell_ref or f'E{6 + idx}'} en hoja {target_sheet}")
+                            print(f"Imagen {idx}: {cell_ref} en hoja {target_sheet}")
                         
                     except Exception as e:
+                        # Sin posición la imagen queda en unanchoredMedia
                         print(f"Error procesando imagen {idx} en hoja {target_sheet}: {str(e)}")
-                        # Agregar información básica incluso si hay error
-                        position_info.append({
-                            'sheet': target_sheet,
-                            'cell_address': f"E{6 + idx}",
-                            'row': 6 + idx,
-                            'column': design_col,
-                            'column_letter': 'E',
-                            'anchor_type': 'unknown',
-                            'image_index': idx
-                        })
                         continue
             
             workbook.close()
@@ -157,40 +461,78 @@ class ExcelImageExtractor:
             print(f"Error con openpyxl: {str(e)}")
         
         return position_info
+
+    def _sheet_embed_index(self, excel_source: ExcelSource, sheet_name: str) -> Dict[str, str]:
+        """Índice {rId: parte xl/media} de los dibujos de una hoja"""
+        media_by_rid = {}
+        try:
+            with zipfile.ZipFile(excel_source, 'r') as zip_file:
+                reader = DrawingAnchorReader(zip_file)
+                for sheet in reader.list_sheets():
+                    if sheet["name"] != sheet_name:
+                        continue
+                    for drawing_part in reader.sheet_drawing_parts(sheet["part"]):
+                        for r_id, target in reader.embed_index(drawing_part).items():
+                            media_by_rid.setdefault(r_id, target)
+        except Exception as e:
+            print(f"Error leyendo relaciones de dibujos: {str(e)}")
+        return media_by_rid
     
-    def _extract_images_from_zip(self, excel_path: str, output_dir: str) -> List[Dict[str, Any]]:
-        """Extrae imágenes del archivo Excel tratándolo como ZIP"""
+    def _extract_images_from_zip(self, excel_source: ExcelSource, output_dir: Optional[str] = None) -> List[Dict[str, Any]]:
+        """
+        Extrae imágenes del archivo Excel tratándolo como ZIP.
+        Los contenidos repetidos se escriben una sola vez y todas las partes
+        xl/media que los comparten apuntan al mismo archivo (blob_id).
+        Sin output_dir no se escribe nada: los bytes quedan en 'data'.
+        """
         images_info = []
         
         try:
-            with zipfile.ZipFile(excel_path, 'r') as zip_file:
-                # Buscar archivos de imagen en el directorio xl/media/
-                for file_info in zip_file.filelist:
-                    if file_info.filename.startswith('xl/media/') and not file_info.is_dir():
-                        # Extraer el archivo
-                        extracted_data = zip_file.read(file_info.filename)
-                        
-                        # Generar nombre de archivo único
-                        original_name = os.path.basename(file_info.filename)
-                        name, ext = os.path.splitext(original_name)
-                        
-                        # Crear archivo en el directorio de salida
-                        output_path = os.path.join(output_dir, original_name)
-                        counter = 1
-                        while os.path.exists(output_path):
-                            output_path = os.path.join(output_dir, f"{name}_{counter}{ext}")
-                            counter += 1
-                        
-                        with open(output_path, 'wb') as output_file:
-                            output_file.write(extracted_data)
-                        
-                        # Agregar información de la imagen
-                        images_info.append({
-                            'filename': os.path.basename(output_path),
-                            'path': output_path,
-                            'size': len(extracted_data),
-                            'extension': ext.lower()
-                        })
+            with zipfile.ZipFile(excel_source, 'r') as zip_file:
+                media_store = MediaStore.from_zip(zip_file)
+
+            written_paths = {}
+            for media_target, blob_id in media_store.blob_by_part.items():
+                blob = media_store.blobs[blob_id]
+                original_name = os.path.basename(media_target)
+                name, ext = os.path.splitext(original_name)
+
+                if output_dir is None:
+                    images_info.append({
+                        'media_target': media_target,
+                        'blob_id': blob_id,
+                        'filename': original_name,
+                        'data': blob["data"],
+                        'size': blob["size"],
+                        'extension': ext.lower()
+                    })
+                    continue
+
+                if blob_id not in written_paths:
+                    # Crear archivo en el directorio de salida con nombre único
+                    output_path = os.path.join(output_dir, original_name)
+                    counter = 1
+                    while os.path.exists(output_path):
+                        output_path = os.path.join(output_dir, f"{name}_{counter}{ext}")
+                        counter += 1
+
+                    with open(output_path, 'wb') as output_file:
+                        output_file.write(blob["data"])
+                    written_paths[blob_id] = output_path
+
+                # Agregar información de la imagen
+                images_info.append({
+                    'media_target': media_target,
+                    'blob_id': blob_id,
+                    'filename': original_name,
+                    'path': written_paths[blob_id],
+                    'size': blob["size"],
+                    'extension': ext.lower()
+                })
+
+            if media_store.duplicate_count:
+                print(f"{media_store.duplicate_count} imágenes duplicadas en xl/media "
+                      f"({len(media_store.blobs)} contenidos únicos)")
         
         except Exception as e:
             print(f"Error extrayendo del ZIP: {str(e)}")
@@ -198,38 +540,737 @@ class ExcelImageExtractor:
         
         return images_info
     
-    def _merge_position_and_images(self, position_info: List[Dict], zip_images: List[Dict]) -> List[Dict]:
-        """Combina información de posición con imágenes extraídas"""
+    def _merge_position_and_images(self, position_info: List[Dict], zip_images: List[Dict]):
+        """
+        Combina información de posición con imágenes extraídas.
+        La unión se hace por la parte xl/media referenciada por el r:embed de
+        cada anclaje, por lo que cada imagen queda en su celda real. Devuelve
+        (imágenes ancladas, partes xl/media sin anclaje).
+        """
+        media_index = {img['media_target']: img for img in zip_images}
         merged_images = []
-        
-        # Copiar todas las imágenes del ZIP
-        for img in zip_images:
-            merged_images.append(img.copy())
-        
-        # Intentar asignar información de posición
-        for i, position in enumerate(position_info):
-            if i < len(merged_images):
-                merged_images[i].update({
-                    'sheet': position.get('sheet', 'DETALLE'),  # Usar DETALLE por defecto
-                    'cell_address': position.get('cell_address', f'E{6 + i}'),  # Fallback a E6, E7, etc.
-                    'row': position.get('row', 6 + i),  # Fallback a fila 6, 7, etc.
-                    'column': position.get('column', 5),  # Columna E = 5
-                    'column_letter': position.get('column_letter', 'E'),
-                    'anchor_type': position.get('anchor_type', 'unknown')
-                })
-        
-        # Para imágenes sin información de posición, agregar datos por defecto
-        for i in range(len(position_info), len(merged_images)):
-            merged_images[i].update({
-                'sheet': 'DETALLE',
-                'cell_address': f'E{6 + i}',
-                'row': 6 + i,
-                'column': 5,  # Columna E
-                'column_letter': 'E',
-                'anchor_type': 'unknown'
+        used_media = set()
+
+        for position in position_info:
+            media_target = position.get('media_target')
+            image = media_index.get(media_target)
+            if image is None:
+                print(f"Anclaje {position.get('cell_address')} sin imagen en el ZIP (r:embed={position.get('embed_rid')})")
+                continue
+
+            merged = image.copy()
+            merged.update({
+                'sheet': position.get('sheet', 'DETALLE'),
+                'cell_address': position.get('cell_address'),
+                'row': position.get('row'),
+                'column': position.get('column'),
+                'column_letter': position.get('column_letter'),
+                'anchor_type': position.get('anchor_type', 'unknown')
             })
-        
-        return merged_images
+            merged_images.append(merged)
+            used_media.add(media_target)
+
+        unanchored = [img for target, img in sorted(media_index.items()) if target not in used_media]
+        if unanchored:
+            print(f"{len(unanchored)} imágenes sin anclaje en la columna de diseño: "
+                  f"{', '.join(img['media_target'] for img in unanchored)}")
+
+        return merged_images, unanchored
+
+def image_entry(img_info: Dict[str, Any], blob_key: Optional[str]) -> Dict[str, Any]:
+    """Datos de una imagen anclada tal como se devuelven al cliente (sin bytes)"""
+    return {
+        "filename": img_info["filename"],
+        "mimeType": MIME_TYPES.get(img_info["extension"], 'image/png'),
+        "size": img_info["size"],
+        "extension": img_info["extension"],
+        "sheet": img_info.get("sheet", "DETALLE"),  # Usar DETALLE por defecto
+        "cellAddress": img_info.get("cell_address", "unknown"),
+        "row": img_info.get("row"),
+        "column": img_info.get("column"),
+        "columnLetter": img_info.get("column_letter", "E"),  # Usar E por defecto
+        "anchorType": img_info.get("anchor_type", "unknown"),
+        "mediaPart": img_info.get("media_target"),
+        "blobId": blob_key
+    }
+
+def unanchored_entry(img: Dict[str, Any]) -> Dict[str, Any]:
+    """Parte xl/media sin anclaje en la columna de diseño"""
+    return {
+        "filename": img["filename"],
+        "mediaPart": img["media_target"],
+        "blobId": img.get("blob_id"),
+        "size": img["size"],
+        "extension": img["extension"]
+    }
+
+def ndjson_image_stream(excel_source: BinaryIO, anchor_mode: str, filename: str,
+                        renditions: Optional[Dict[str, Any]] = None, cache_key: Optional[str] = None):
+    """
+    Genera la respuesta NDJSON: una línea de cabecera, una línea por imagen
+    (con 'data' en base64 solo la primera vez que aparece cada blobId) y una
+    línea final con conteos y tiempos. Con cache_key el resultado crudo se
+    arma mientras se envía y se guarda en la caché al terminar, como en la
+    ruta JSON. Cierra la subida al terminar.
+    """
+    # Líneas de imagen en orden, con sus renditions aún calculándose en el pool
+    pending = deque()
+    # Para la caché: imágenes tal como las produce el extractor y renditions crudas por blobId
+    images_info = []
+    blob_renditions: Dict[str, List[Dict[str, Any]]] = {}
+
+    def flush_oldest():
+        line, future = pending.popleft()
+        if future is not None:
+            data = line.pop("data")
+            result = future.result()
+            if cache_key is not None:
+                blob_renditions[line["blobId"]] = result
+            line["renditions"] = [
+                dict(rendition, data=base64.b64encode(rendition["data"]).decode("utf-8")) for rendition in result
+            ]
+            if renditions["originals"] or not line["renditions"]:
+                line["data"] = base64.b64encode(data).decode("utf-8")
+        return ndjson_line(line)
+
+    try:
+        extractor = ExcelImageExtractor(anchor_mode)
+        for kind, payload in extractor.iter_images(excel_source):
+            if kind == 'header':
+                yield ndjson_line({
+                    "type": "header",
+                    "filename": filename,
+                    "sheet": payload["sheet"],
+                    "designColumn": payload["design_column"],
+                    "designColumnLetter": payload["design_column_letter"],
+                    "anchorMode": payload["anchor_mode"],
+                    "anchors": payload["anchors"]
+                })
+            elif kind == 'image':
+                if cache_key is not None:
+                    images_info.append(payload)
+                line = {"type": "image"}
+                line.update(image_entry(payload, payload["blob_id"]))
+                future = None
+                if payload["data"] is not None:
+                    if renditions is not None:
+                        # El original queda en la línea hasta saber si hay que enviarlo
+                        line["data"] = payload["data"]
+                        future = extraction_pool.submit(
+                            ndjson_renditions, payload["data"], payload["blob_id"], renditions
+                        )
+                    else:
+                        line["data"] = base64.b64encode(payload["data"]).decode("utf-8")
+                pending.append((line, future))
+                # Un trabajo más que trabajadores, como en sheet_pdf_stream
+                while sum(future is not None for _, future in pending) > extraction_pool.max_workers:
+                    yield flush_oldest()
+            else:
+                while pending:
+                    yield flush_oldest()
+                if cache_key is not None:
+                    manifest, blobs = build_images_manifest(images_info, payload["unanchored_media"])
+                    metadata = {blob["id"]: blob for blob in manifest["blobs"]}
+                    for blob_id, result in blob_renditions.items():
+                        if blob_id in blobs:
+                            store_renditions(blobs[blob_id], metadata[blob_id], result, renditions)
+                    result_cache.put(cache_key, (manifest, blobs))
+                yield ndjson_line({
+                    "type": "trailer",
+                    "success": True,
+                    "count": payload["count"],
+                    "uniqueBlobs": payload["unique_blobs"],
+                    "skippedAnchors": payload["skipped_anchors"],
+                    "unanchoredMedia": [unanchored_entry(img) for img in payload["unanchored_media"]],
+                    "timingsMs": payload["timings_ms"]
+                })
+    except Exception as e:
+        print(f"Error en extracción NDJSON: {str(e)}")
+        print(traceback.format_exc())
+        yield ndjson_line({"type": "error", "success": False, "message": f"Error procesando archivo: {str(e)}"})
+    finally:
+        for _, future in pending:
+            if future is not None:
+                future.cancel()
+        excel_source.close()
+
+def ndjson_cached_stream(manifest: Dict[str, Any], blobs: Dict[str, Dict[str, Any]], filename: str,
+                         anchor_mode: str):
+    """
+    Las mismas líneas que ndjson_image_stream a partir de un resultado en
+    caché. La caché no guarda la lectura de anclajes: la hoja y la columna
+    de diseño salen de las imágenes, 'anchors' cuenta las imágenes ancladas
+    y 'skippedAnchors' es 0.
+    """
+    started = time.perf_counter()
+    images = manifest["images"]
+    first = images[0] if images else {}
+    yield ndjson_line({
+        "type": "header",
+        "filename": filename,
+        "sheet": first.get("sheet"),
+        "designColumn": first.get("column"),
+        "designColumnLetter": first.get("columnLetter"),
+        "anchorMode": anchor_mode,
+        "anchors": len(images)
+    })
+
+    sent_blobs = set()
+    for image in images:
+        line = {"type": "image"}
+        line.update(image)
+        blob = blobs.get(image["blobId"])
+        if blob is not None and image["blobId"] not in sent_blobs:
+            sent_blobs.add(image["blobId"])
+            if "renditions" in blob:
+                line["renditions"] = [
+                    dict(rendition, data=base64.b64encode(rendition["data"]).decode("utf-8"))
+                    for rendition in blob["renditions"]
+                ]
+            if blob["data"] is not None:
+                line["data"] = base64.b64encode(blob["data"]).decode("utf-8")
+        yield ndjson_line(line)
+
+    yield ndjson_line({
+        "type": "trailer",
+        "success": True,
+        "count": len(images),
+        "uniqueBlobs": len(sent_blobs),
+        "skippedAnchors": 0,
+        "unanchoredMedia": manifest["unanchoredMedia"],
+        "timingsMs": {"total": round((time.perf_counter() - started) * 1000, 2)}
+    })
+
+def ndjson_renditions(data: bytes, blob_id: str, options: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """Trabajo del pool: renditions de una imagen del stream NDJSON, con su id"""
+    try:
+        result = render_renditions(data, options["sizes"], options["format"])
+    except Exception as e:
+        print(f"No se pudieron generar renditions para {blob_id}: {str(e)}")
+        return []
+    return [dict(rendition, id=f"{blob_id}_{rendition['size']}") for rendition in result]
+
+def build_images_manifest(images_info: List[Dict], unanchored: List[Dict]):
+    """
+    Separa el resultado de la extracción en un manifiesto sin bytes de imagen
+    y los contenidos únicos {blobId: {'id', 'data', 'mimeType', 'size', 'extension', 'width', 'height'}}.
+    Cada imagen anclada referencia su contenido por 'blobId'.
+    """
+    unanchored_media = [unanchored_entry(img) for img in unanchored]
+
+    blobs: Dict[str, Dict[str, Any]] = {}
+    image_files = []
+    for img_info in images_info:
+        blob_key = img_info.get("blob_id") or img_info.get("path")
+        try:
+            if blob_key not in blobs:
+                raw_data = img_info.get("data")
+                if raw_data is None:
+                    with open(img_info["path"], "rb") as img_file:
+                        raw_data = img_file.read()
+                width, height = image_dimensions(raw_data)
+                blobs[blob_key] = {
+                    "id": blob_key,
+                    "data": raw_data,
+                    "mimeType": MIME_TYPES.get(img_info["extension"], 'image/png'),
+                    "size": img_info["size"],
+                    "extension": img_info["extension"],
+                    "width": width,
+                    "height": height
+                }
+        except Exception as e:
+            print(f"Error leyendo imagen {img_info['filename']}: {str(e)}")
+            continue
+
+        image_files.append(image_entry(img_info, blob_key))
+
+    if image_files:
+        message = f"Se extrajeron {len(image_files)} imágenes correctamente"
+    else:
+        message = "No se encontraron imágenes en el archivo Excel"
+
+    manifest = {
+        "success": True,
+        "message": message,
+        "images": image_files,
+        "count": len(image_files),
+        "unanchoredMedia": unanchored_media,
+        "blobs": [
+            {key: value for key, value in blob.items() if key != "data"}
+            for blob in blobs.values()
+        ]
+    }
+    return manifest, blobs
+
+def encode_images_response(manifest: Dict[str, Any], blobs: Dict[str, Dict[str, Any]],
+                           dedupe: bool = False) -> Dict[str, Any]:
+    """
+    Convierte manifiesto + blobs crudos en la respuesta JSON con base64.
+    Cada contenido distinto se codifica una sola vez. Con dedupe=True los
+    datos van en 'blobs' y cada imagen anclada los referencia por 'blobId';
+    si no, cada imagen lleva su propio 'data' (y sus 'renditions').
+    """
+    encoded = {}
+    for blob_id, blob in blobs.items():
+        encoded[blob_id] = {
+            "data": base64.b64encode(blob["data"]).decode("utf-8") if blob.get("data") is not None else None,
+            "renditions": [
+                dict(rendition, data=base64.b64encode(rendition["data"]).decode("utf-8"))
+                for rendition in blob.get("renditions", [])
+            ]
+        }
+
+    response = dict(manifest)
+    if dedupe:
+        response["blobs"] = []
+        for blob in manifest["blobs"]:
+            entry = dict(blob)
+            if encoded[blob["id"]]["data"] is not None:
+                entry["data"] = encoded[blob["id"]]["data"]
+            if "renditions" in blob:
+                entry["renditions"] = encoded[blob["id"]]["renditions"]
+            response["blobs"].append(entry)
+    else:
+        del response["blobs"]
+        response["images"] = []
+        for image in manifest["images"]:
+            entry = dict(image)
+            if encoded[image["blobId"]]["data"] is not None:
+                entry["data"] = encoded[image["blobId"]]["data"]
+            if "renditions" in blobs[image["blobId"]]:
+                entry["renditions"] = encoded[image["blobId"]]["renditions"]
+            response["images"].append(entry)
+    return response
+
+def build_images_response(images_info: List[Dict], unanchored: List[Dict], dedupe: bool = False) -> Dict[str, Any]:
+    """Arma la respuesta JSON de /extract-images con las imágenes en base64"""
+    manifest, blobs = build_images_manifest(images_info, unanchored)
+    return encode_images_response(manifest, blobs, dedupe)
+
+def build_extraction_result(extractor: "ExcelImageExtractor", images_info: List[Dict],
+                            dedupe: bool, encode_json: bool):
+    """JSON base64 listo para responder o (manifiesto, blobs crudos) para seguir procesando"""
+    if encode_json:
+        return build_images_response(images_info, extractor.unanchored_media, dedupe)
+    return build_images_manifest(images_info, extractor.unanchored_media)
+
+def binary_images_response(manifest: Dict[str, Any], blobs: Dict[str, Dict[str, Any]], response_format: str):
+    """StreamingResponse multipart/mixed o ZIP a partir del manifiesto y los blobs"""
+    if response_format == FORMAT_ZIP:
+        return StreamingResponse(
+            zip_stream(manifest, blobs),
+            media_type=MEDIA_TYPE_ZIP,
+            headers={"Content-Disposition": 'attachment; filename="images.zip"'}
+        )
+
+    boundary = new_boundary()
+    return StreamingResponse(
+        multipart_stream(manifest, blobs, boundary),
+        media_type=f'{MEDIA_TYPE_MULTIPART}; boundary="{boundary}"'
+    )
+
+def rendition_options(renditions: Optional[str], rendition_format: str, originals: bool) -> Optional[Dict[str, Any]]:
+    """Valida los parámetros de renditions; None si no se pidieron"""
+    if not renditions:
+        if not originals:
+            raise HTTPException(status_code=400, detail="originals=false requiere indicar renditions")
+        return None
+    if not PIL_AVAILABLE:
+        raise HTTPException(status_code=400, detail="Renditions no disponibles: Pillow no está instalado")
+    if rendition_format not in RENDITION_FORMATS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Formato de rendition no válido: {rendition_format}. Use uno de {', '.join(RENDITION_FORMATS)}"
+        )
+    try:
+        sizes = parse_rendition_sizes(renditions)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Tamaños de rendition no válidos: {str(e)}")
+    return {"sizes": sizes, "format": rendition_format, "originals": originals}
+
+async def add_renditions(manifest: Dict[str, Any], blobs: Dict[str, Dict[str, Any]], options: Dict[str, Any]):
+    """
+    Genera las renditions de cada contenido único en paralelo en el pool y las
+    agrega a los blobs (con bytes) y al manifiesto (solo metadatos)
+    """
+    blob_ids = list(blobs)
+    results = await asyncio.gather(
+        *(
+            extraction_pool.run(render_renditions, blobs[blob_id]["data"], options["sizes"], options["format"])
+            for blob_id in blob_ids
+        ),
+        return_exceptions=True
+    )
+
+    metadata = {blob["id"]: blob for blob in manifest["blobs"]}
+    for blob_id, result in zip(blob_ids, results):
+        if isinstance(result, Exception):
+            # Formatos que Pillow no abre (SVG, EMF...): se mantiene el original
+            print(f"No se pudieron generar renditions para {blob_id}: {str(result)}")
+            result = []
+        for rendition in result:
+            rendition["id"] = f"{blob_id}_{rendition['size']}"
+        store_renditions(blobs[blob_id], metadata[blob_id], result, options)
+
+def store_renditions(blob: Dict[str, Any], metadata: Dict[str, Any], result: List[Dict[str, Any]],
+                     options: Dict[str, Any]):
+    """Renditions (con id) de un contenido: con bytes en el blob y solo metadatos en su entrada del manifiesto"""
+    blob["renditions"] = result
+    metadata["renditions"] = [
+        {key: value for key, value in rendition.items() if key != "data"}
+        for rendition in result
+    ]
+    if not options["originals"] and result:
+        blob["data"] = None
+
+async def serialize_images(manifest: Dict[str, Any], blobs: Dict[str, Dict[str, Any]],
+                           response_format: str, dedupe: bool):
+    """JSON base64 (codificado en el pool) o stream binario a partir de manifiesto + blobs"""
+    if response_format == FORMAT_JSON:
+        return await extraction_pool.run(encode_images_response, manifest, blobs, dedupe)
+    return binary_images_response(manifest, blobs, response_format)
+
+async def respond_with_images(result, response_format: str, dedupe: bool, renditions: Optional[Dict[str, Any]]):
+    """Último paso común: renditions opcionales y serialización según el formato pedido"""
+    if renditions is None:
+        if response_format == FORMAT_JSON:
+            return result
+        return binary_images_response(*result, response_format)
+
+    manifest, blobs = result
+    await add_renditions(manifest, blobs, renditions)
+    return await serialize_images(manifest, blobs, response_format, dedupe)
+
+async def spool_upload(file: UploadFile, spool_max_bytes: int = SPOOL_MAX_BYTES):
+    """
+    Copia la subida por bloques: queda en memoria hasta spool_max_bytes y solo
+    por encima se vuelca a un archivo temporal. El SHA-256 se calcula al vuelo
+    y se corta con 413 apenas se supera MAX_UPLOAD_BYTES.
+    Devuelve (archivo posicionado al inicio, bytes totales, sha256 hex, bytes de
+    la copia retenidos en memoria).
+    """
+    spooled = await spool_upload_chunks(file, MAX_UPLOAD_BYTES, spool_max_bytes, UPLOAD_CHUNK_SIZE)
+
+    upload_stats["uploads"] += 1
+    upload_stats["bytes"] += spooled["size"]
+    upload_stats["spilled_to_disk"] += 1 if spooled["on_disk"] else 0
+    upload_stats["max_spooled_bytes"] = max(upload_stats["max_spooled_bytes"], spooled["spooled_bytes"])
+
+    print(f"Archivo recibido: {file.filename} ({spooled['size']} bytes, "
+          f"{'volcado a disco' if spooled['on_disk'] else 'en memoria'}, "
+          f"copia en memoria {spooled['spooled_bytes']} bytes)")
+    return spooled["file"], spooled["size"], spooled["sha256"], spooled["spooled_bytes"]
+
+async def lookup_cached_result(upload_sha256: str, anchor_mode: str,
+                               rendition_opts: Optional[Dict[str, Any]], use_cache: bool):
+    """(clave de caché o None, (manifiesto, blobs) guardados o None, estado de caché)"""
+    if not (use_cache and result_cache.enabled):
+        return None, None, CACHE_BYPASS
+    cache_key = result_cache.make_key(upload_sha256, anchor_mode, rendition_opts)
+    cached, cache_status = await asyncio.to_thread(result_cache.get, cache_key)
+    if cached is not None:
+        print(f"Resultado en caché ({cache_status}) para {upload_sha256[:12]}")
+    return cache_key, cached, cache_status
+
+async def extract_json_result(upload: Union[BinaryIO, str], total_bytes: int, upload_sha256: str,
+                              anchor_mode: str, dedupe: bool, use_cache: bool):
+    """
+    Respuesta JSON sin renditions y su estado de caché. Si hay que extraer,
+    el mismo trabajo del pool extrae y codifica; el resultado crudo vuelve
+    solo para guardarlo en la caché, así los blobs cruzan el pool una vez.
+    """
+    cache_key, cached, cache_status = await lookup_cached_result(upload_sha256, anchor_mode, None, use_cache)
+    if cached is not None:
+        return await extraction_pool.run(encode_images_response, cached[0], cached[1], dedupe), cache_status
+
+    source, spill_path = _pool_source(upload, total_bytes)
+    try:
+        if cache_key is None:
+            return await extraction_pool.run(run_extraction_job, source, anchor_mode, dedupe, True), cache_status
+        manifest, blobs, result = await extraction_pool.run(run_cached_extraction_job, source, anchor_mode, dedupe)
+    finally:
+        if spill_path and os.path.exists(spill_path):
+            os.remove(spill_path)
+
+    await asyncio.to_thread(result_cache.put, cache_key, (manifest, blobs))
+    return result, cache_status
+
+async def extract_raw_result(upload: Union[BinaryIO, str], total_bytes: int, upload_sha256: str, anchor_mode: str,
+                             rendition_opts: Optional[Dict[str, Any]], use_cache: bool = True,
+                             on_stage: Optional[Callable[[str], None]] = None):
+    """
+    Extracción en el pool devolviendo (manifiesto, blobs crudos, estado de caché).
+    El resultado, con renditions si se pidieron, se reutiliza desde la caché
+    para el mismo archivo y opciones. on_stage recibe el nombre de cada etapa.
+    """
+    cache_key, cached, cache_status = await lookup_cached_result(
+        upload_sha256, anchor_mode, rendition_opts, use_cache
+    )
+    if cached is not None:
+        return cached[0], cached[1], cache_status
+
+    if on_stage is not None:
+        on_stage("extracting")
+    source, spill_path = _pool_source(upload, total_bytes)
+    try:
+        manifest, blobs = await extraction_pool.run(run_extraction_job, source, anchor_mode, False, False)
+    finally:
+        if spill_path and os.path.exists(spill_path):
+            os.remove(spill_path)
+
+    if rendition_opts is not None:
+        if on_stage is not None:
+            on_stage("renditions")
+        await add_renditions(manifest, blobs, rendition_opts)
+    if cache_key is not None:
+        if on_stage is not None:
+            on_stage("storing")
+        await asyncio.to_thread(result_cache.put, cache_key, (manifest, blobs))
+    return manifest, blobs, cache_status
+
+def with_cache_status(result, cache_status: str, headers: Optional[Dict[str, str]] = None):
+    """Agrega la cabecera X-Cache (y otras opcionales) tanto a respuestas ya armadas como a dicts JSON"""
+    if not isinstance(result, Response):
+        result = JSONResponse(result)
+    result.headers["X-Cache"] = cache_status
+    for name, value in (headers or {}).items():
+        result.headers[name] = value
+    return result
+
+def run_extraction_job(excel_source: Union[bytes, str, BinaryIO], anchor_mode: str, dedupe: bool,
+                       encode_json: bool = True):
+    """Trabajo del pool: extracción en memoria y armado de la respuesta"""
+    extractor = ExcelImageExtractor(anchor_mode)
+    images_info = extractor.extract_images_in_memory(excel_source)
+    return build_extraction_result(extractor, images_info, dedupe, encode_json)
+
+def run_cached_extraction_job(excel_source: Union[bytes, str, BinaryIO], anchor_mode: str, dedupe: bool):
+    """Trabajo del pool: (manifiesto, blobs crudos) para la caché y la respuesta JSON ya codificada"""
+    extractor = ExcelImageExtractor(anchor_mode)
+    images_info = extractor.extract_images_in_memory(excel_source)
+    manifest, blobs = build_images_manifest(images_info, extractor.unanchored_media)
+    return manifest, blobs, encode_images_response(manifest, blobs, dedupe)
+
+def run_disk_extraction_job(excel_path: str, output_dir: str, anchor_mode: str, dedupe: bool,
+                            encode_json: bool = True):
+    """Trabajo del pool para el modo en disco"""
+    extractor = ExcelImageExtractor(anchor_mode)
+    images_info = extractor.extract_images_from_excel(excel_path, output_dir)
+    return build_extraction_result(extractor, images_info, dedupe, encode_json)
+
+def rows_header_entry(payload: Dict[str, Any]) -> Dict[str, Any]:
+    """Hoja, encabezados y, si se pidieron colores, paleta y estilos de los encabezados"""
+    entry = {
+        "sheet": payload["sheet"],
+        "headerRow": payload["header_row"],
+        "headers": payload["headers"]
+    }
+    if "palette" in payload:
+        entry["palette"] = payload["palette"]
+        entry["headerStyles"] = payload["header_styles"]
+    return entry
+
+def parse_rows_page(excel_source: Union[bytes, str, BinaryIO], header_row: int, offset: int,
+                    limit: Optional[int], skip_empty: bool, with_colors: bool = False) -> Dict[str, Any]:
+    """Trabajo del pool: una página de filas tipadas de la hoja DETALLE"""
+    if isinstance(excel_source, bytes):
+        excel_source = io.BytesIO(excel_source)
+    with zipfile.ZipFile(excel_source, 'r') as zip_file:
+        parser = SheetRowParser(zip_file, header_row, with_colors=with_colors)
+        response = {"success": True}
+        rows = []
+        for kind, payload in parser.iter_rows(offset, limit, skip_empty):
+            if kind == 'header':
+                response.update(rows_header_entry(payload))
+            elif kind == 'row':
+                rows.append(payload)
+            else:
+                response.update({
+                    "offset": payload["offset"],
+                    "limit": limit,
+                    "count": payload["count"],
+                    "nextOffset": payload["next_offset"]
+                })
+    response["rows"] = rows
+    return response
+
+def ndjson_rows_stream(excel_source: BinaryIO, filename: str, header_row: int, offset: int,
+                       limit: Optional[int], skip_empty: bool, with_colors: bool = False):
+    """Filas en NDJSON a medida que se leen: cabecera, una línea por fila y resumen"""
+    try:
+        with zipfile.ZipFile(excel_source, 'r') as zip_file:
+            parser = SheetRowParser(zip_file, header_row, with_colors=with_colors)
+            for kind, payload in parser.iter_rows(offset, limit, skip_empty):
+                if kind == 'header':
+                    line = {"type": "header", "filename": filename}
+                    line.update(rows_header_entry(payload))
+                    yield ndjson_line(line)
+                elif kind == 'row':
+                    yield ndjson_line(dict(payload, type="row"))
+                else:
+                    yield ndjson_line({
+                        "type": "trailer",
+                        "success": True,
+                        "offset": payload["offset"],
+                        "count": payload["count"],
+                        "nextOffset": payload["next_offset"]
+                    })
+    except Exception as e:
+        print(f"Error leyendo filas en NDJSON: {str(e)}")
+        print(traceback.format_exc())
+        yield ndjson_line({"type": "error", "success": False, "message": f"Error procesando archivo: {str(e)}"})
+    finally:
+        excel_source.close()
+
+def row_images_entry(payload: Dict[str, Any]) -> Dict[str, Any]:
+    """Fila con sus referencias de imagen en formato de respuesta"""
+    entry = {"row": payload["row"], "values": payload["values"]}
+    if "styles" in payload:
+        entry["styles"] = payload["styles"]
+    entry["images"] = [
+            {
+                "blobId": image["blob_id"],
+                "mediaPart": image["media_part"],
+                "cellAddress": image["cell_address"],
+                "anchorType": image["anchor_type"]
+            }
+            for image in payload["images"]
+        ]
+    return entry
+
+def row_blob_entry(payload: Dict[str, Any]) -> Dict[str, Any]:
+    """Contenido de imagen (una sola vez por blobId) con sus bytes en base64"""
+    width, height = image_dimensions(payload["data"])
+    return {
+        "id": payload["id"],
+        "mediaPart": payload["media_part"],
+        "mimeType": MIME_TYPES.get(payload["extension"], 'image/png'),
+        "size": payload["size"],
+        "extension": payload["extension"],
+        "width": width,
+        "height": height,
+        "data": base64.b64encode(payload["data"]).decode("utf-8")
+    }
+
+def rows_trailer_entry(payload: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        "offset": payload["offset"],
+        "count": payload["count"],
+        "nextOffset": payload["next_offset"],
+        "linkedImages": payload["linked_images"],
+        "otherAnchors": [
+            {
+                "mediaPart": anchor["media_target"],
+                "cellAddress": anchor["cell_address"],
+                "anchorType": anchor["anchor_type"]
+            }
+            for anchor in payload["other_anchors"]
+        ],
+        "unanchoredMedia": [unanchored_entry(img) for img in payload["unanchored_media"]]
+    }
+
+def rows_with_images_page(excel_source: Union[bytes, str, BinaryIO], header_row: int, offset: int,
+                          limit: Optional[int], skip_empty: bool, with_colors: bool = False) -> Dict[str, Any]:
+    """Trabajo del pool: una página de filas con sus imágenes y los blobs que referencian"""
+    if isinstance(excel_source, bytes):
+        excel_source = io.BytesIO(excel_source)
+    with zipfile.ZipFile(excel_source, 'r') as zip_file:
+        response = {"success": True}
+        rows = []
+        blobs = []
+        for kind, payload in iter_rows_with_images(zip_file, header_row, offset, limit, skip_empty, with_colors):
+            if kind == 'header':
+                response.update(rows_header_entry(payload))
+                response.update({
+                    "designColumn": payload["design_column"],
+                    "designColumnLetter": get_column_letter(payload["design_column"])
+                })
+            elif kind == 'blob':
+                blobs.append(row_blob_entry(payload))
+            elif kind == 'row':
+                rows.append(row_images_entry(payload))
+            else:
+                response.update(rows_trailer_entry(payload))
+                response["limit"] = limit
+    response["rows"] = rows
+    response["blobs"] = blobs
+    return response
+
+def ndjson_rows_with_images_stream(excel_source: BinaryIO, filename: str, header_row: int, offset: int,
+                                   limit: Optional[int], skip_empty: bool, with_colors: bool = False):
+    """
+    NDJSON de filas con imágenes: cabecera, una línea 'blob' la primera vez
+    que aparece cada contenido (antes de la fila que lo usa), una línea por
+    fila y un resumen final
+    """
+    try:
+        with zipfile.ZipFile(excel_source, 'r') as zip_file:
+            for kind, payload in iter_rows_with_images(zip_file, header_row, offset, limit, skip_empty, with_colors):
+                if kind == 'header':
+                    line = {"type": "header", "filename": filename}
+                    line.update(rows_header_entry(payload))
+                    line.update({
+                        "designColumn": payload["design_column"],
+                        "designColumnLetter": get_column_letter(payload["design_column"]),
+                        "anchors": payload["anchors"]
+                    })
+                    yield ndjson_line(line)
+                elif kind == 'blob':
+                    yield ndjson_line(dict(row_blob_entry(payload), type="blob"))
+                elif kind == 'row':
+                    yield ndjson_line(dict(row_images_entry(payload), type="row"))
+                else:
+                    yield ndjson_line(dict(rows_trailer_entry(payload), type="trailer", success=True))
+    except Exception as e:
+        print(f"Error leyendo filas con imágenes en NDJSON: {str(e)}")
+        print(traceback.format_exc())
+        yield ndjson_line({"type": "error", "success": False, "message": f"Error procesando archivo: {str(e)}"})
+    finally:
+        excel_source.close()
+
+def import_columns_job(excel_source: Union[bytes, str, BinaryIO], header_row: int, mapping: Dict[str, str],
+                       field_types: Dict[str, str], skip_empty: bool, computed: bool,
+                       tolerance: float, validate: bool,
+                       rules: Optional[List[Dict[str, Any]]], decimal_separator: str) -> Dict[str, Any]:
+    """Trabajo del pool: columnas mapeadas de la hoja DETALLE ya convertidas y validadas"""
+    if isinstance(excel_source, bytes):
+        excel_source = io.BytesIO(excel_source)
+    with zipfile.ZipFile(excel_source, 'r') as zip_file:
+        return import_columns(
+            zip_file, mapping, header_row, field_types, skip_empty, computed, tolerance, validate, rules,
+            decimal_separator
+        )
+
+def _parse_json_object(raw: Optional[str], name: str) -> Dict[str, str]:
+    """Campo de formulario con un objeto JSON {texto: texto}"""
+    if not raw:
+        return {}
+    try:
+        value = json.loads(raw)
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"'{name}' no es un JSON válido")
+    if not isinstance(value, dict) or not all(
+        isinstance(key, str) and isinstance(item, str) for key, item in value.items()
+    ):
+        raise HTTPException(status_code=400, detail=f"'{name}' debe ser un objeto {{campo: texto}}")
+    return value
+
+def _pool_source(upload: Union[BinaryIO, str], total_bytes: int):
+    """
+    Prepara la subida para enviarla al pool. Una ruta (subida reanudable ya
+    ensamblada) y, con hilos, el archivo abierto se pasan tal cual; con
+    procesos hay que serializarlo: bytes si cabe en memoria o la ruta de una
+    copia temporal si superó SPOOL_MAX_BYTES.
+    Devuelve (origen, ruta temporal a borrar o None).
+    """
+    if isinstance(upload, str) or extraction_pool.kind != POOL_KIND_PROCESS:
+        return upload, None
+    if total_bytes <= SPOOL_MAX_BYTES:
+        return upload.read(), None
+
+    with tempfile.NamedTemporaryFile(prefix="excel_upload_", suffix=".xlsx", delete=False) as named:
+        shutil.copyfileobj(upload, named)
+    return named.name, named.name
 
 @app.get("/")
 async def root():
@@ -246,20 +1287,311 @@ async def health_check():
     return {
         "status": "healthy",
         "service": "excel-image-extractor",
-        "openpyxl_available": True
+        "openpyxl_available": True,
+        "pillow_available": PIL_AVAILABLE,
+        "anchor_mode": DEFAULT_ANCHOR_MODE,
+        "worker_pool": extraction_pool.metrics(),
+        "result_cache": result_cache.stats(),
+        "workbook_store": workbook_store.stats(),
+        "job_queue": job_queue.stats(),
+        "uploads": dict(upload_stats, max_upload_bytes=MAX_UPLOAD_BYTES, max_batch_bytes=MAX_BATCH_BYTES),
+        "upload_sessions": upload_sessions.stats()
     }
 
+@app.get("/metrics/pool")
+async def pool_metrics():
+    """Métricas de saturación del pool de extracción"""
+    return extraction_pool.metrics()
+
+@app.get("/metrics/cache")
+async def cache_metrics():
+    """Aciertos, fallos y desalojos de la caché de resultados"""
+    return result_cache.stats()
+
 @app.post("/extract-images")
-async def extract_images(file: UploadFile = File(...)):
+async def extract_images(
+    request: Request,
+    file: UploadFile = File(...),
+    anchor_mode: Optional[str] = Query(None, description="Motor de anclajes: 'xml' u 'openpyxl'"),
+    dedupe: bool = Query(False, description="Enviar cada imagen distinta una sola vez en 'blobs'"),
+    in_memory: bool = Query(True, description="Procesar sin directorio temporal (False = modo en disco)"),
+    renditions: Optional[str] = Query(None, description="Tamaños de las versiones reducidas en px, ej. 64,256,1024"),
+    rendition_format: str = Query(DEFAULT_RENDITION_FORMAT, description="Formato de las renditions: webp o jpeg"),
+    originals: bool = Query(True, description="Incluir los originales además de las renditions"),
+    cache: bool = Query(True, description="Usar la caché de resultados por hash de la subida")
+):
     """
-    Extrae imágenes de un archivo Excel subido
+    Extrae imágenes de un archivo Excel subido.
+    Según la cabecera Accept responde JSON con base64 (por defecto),
+    multipart/mixed (manifiesto + imágenes crudas), application/zip o
+    application/x-ndjson (una línea por imagen a medida que se extrae).
     """
     if not file.filename.endswith(('.xlsx', '.xlsm')):
         raise HTTPException(
             status_code=400, 
             detail="Solo se admiten archivos Excel (.xlsx, .xlsm)"
         )
+
+    if anchor_mode is not None and anchor_mode not in ANCHOR_MODES:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Modo de anclaje no válido: {anchor_mode}. Use uno de {', '.join(ANCHOR_MODES)}"
+        )
     
+    response_format = negotiate_format(request.headers.get("accept", ""))
+    rendition_opts = rendition_options(renditions, rendition_format, originals)
+
+    if not in_memory and response_format != FORMAT_NDJSON:
+        return await _extract_images_on_disk(file, anchor_mode, dedupe, response_format, rendition_opts)
+
+    upload = None
+    try:
+        upload, total_bytes, upload_sha256, spooled_bytes = await spool_upload(file)
+        anchor_mode = anchor_mode or DEFAULT_ANCHOR_MODE
+        upload_headers = {"X-Upload-Spooled-Bytes": str(spooled_bytes)}
+
+        use_cache = cache and result_cache.enabled
+        # La extracción corre en el pool para no bloquear el event loop
+        if response_format == FORMAT_NDJSON:
+            cache_key, cached, cache_status = await lookup_cached_result(
+                upload_sha256, anchor_mode, rendition_opts, use_cache
+            )
+            if cached is not None:
+                stream = ndjson_cached_stream(cached[0], cached[1], file.filename, anchor_mode)
+            else:
+                # El generador es síncrono: Starlette lo recorre fuera del event loop
+                # y se encarga de cerrar la subida al terminar
+                stream = ndjson_image_stream(upload, anchor_mode, file.filename, rendition_opts, cache_key)
+                upload = None
+            return StreamingResponse(
+                stream, media_type=MEDIA_TYPE_NDJSON, headers=dict(upload_headers, **{"X-Cache": cache_status})
+            )
+
+        if response_format == FORMAT_JSON and rendition_opts is None:
+            # El trabajador devuelve el JSON ya codificado (y el resultado crudo si va a la caché)
+            result, cache_status = await extract_json_result(
+                upload, total_bytes, upload_sha256, anchor_mode, dedupe, use_cache
+            )
+            return with_cache_status(result, cache_status, upload_headers)
+
+        manifest, blobs, cache_status = await extract_raw_result(
+            upload, total_bytes, upload_sha256, anchor_mode, rendition_opts, use_cache
+        )
+        result = await serialize_images(manifest, blobs, response_format, dedupe)
+        return with_cache_status(result, cache_status, upload_headers)
+
+    except HTTPException:
+        raise
+
+    except Exception as e:
+        error_msg = f"Error procesando archivo: {str(e)}"
+        print(error_msg)
+        print(traceback.format_exc())
+
+        raise HTTPException(status_code=500, detail=error_msg)
+
+    finally:
+        if upload is not None:
+            upload.close()
+
+@app.post("/parse-rows")
+async def parse_rows(
+    request: Request,
+    file: Optional[UploadFile] = File(None),
+    upload_id: Optional[str] = Query(None, description="Sesión de POST /uploads ya completa a paginar sin volver a subirla"),
+    header_row: int = Query(HEADER_ROW, ge=1, description="Fila de encabezados (1-based)"),
+    offset: int = Query(0, ge=0, description="Filas de datos a saltear"),
+    limit: Optional[int] = Query(None, ge=1, description="Máximo de filas a devolver"),
+    skip_empty: bool = Query(True, description="Omitir filas sin valores"),
+    colors: bool = Query(False, description="Incluir paleta de colores e id de estilo por celda")
+):
+    """
+    Lee las filas de la hoja DETALLE (o la primera hoja) con valores tipados.
+    JSON paginado por offset/limit (nextOffset indica la página siguiente) o,
+    con Accept: application/x-ndjson, una línea por fila a medida que se lee.
+    Con colors=true cada fila trae 'styles' (ids de una 'palette' compartida
+    de pares {backgroundColor, fontColor}) en lugar de colores por celda.
+    Para recorrer un libro grande por páginas conviene subirlo una vez con
+    POST /uploads y pedir cada página con upload_id en lugar de file.
+    """
+    return await _respond_with_rows(
+        request, file, upload_id, parse_rows_page, ndjson_rows_stream, header_row, offset, limit, skip_empty, colors
+    )
+
+@app.post("/parse-rows-with-images")
+async def parse_rows_with_images(
+    request: Request,
+    file: Optional[UploadFile] = File(None),
+    upload_id: Optional[str] = Query(None, description="Sesión de POST /uploads ya completa a paginar sin volver a subirla"),
+    header_row: int = Query(HEADER_ROW, ge=1, description="Fila de encabezados (1-based)"),
+    offset: int = Query(0, ge=0, description="Filas de datos a saltear"),
+    limit: Optional[int] = Query(None, ge=1, description="Máximo de filas a devolver"),
+    skip_empty: bool = Query(True, description="Omitir filas sin valores ni imágenes"),
+    colors: bool = Query(False, description="Incluir paleta de colores e id de estilo por celda")
+):
+    """
+    Filas de producto con las imágenes de diseño ancladas en cada una, leyendo
+    el libro una sola vez. Cada fila trae 'images' con blobIds; los bytes van
+    una sola vez por contenido en 'blobs' (o en líneas 'blob' con NDJSON).
+    Igual que /parse-rows acepta upload_id en lugar de file para paginar.
+    """
+    return await _respond_with_rows(
+        request, file, upload_id, rows_with_images_page, ndjson_rows_with_images_stream,
+        header_row, offset, limit, skip_empty, colors
+    )
+
+@app.post("/import-columns")
+async def import_columns_endpoint(
+    file: UploadFile = File(...),
+    mapping: str = Form(..., description='Mapeo JSON {campo del sistema: encabezado del Excel}'),
+    types: Optional[str] = Form(None, description="Tipos JSON {campo: number|integer|text} adicionales"),
+    rules: Optional[str] = Form(None, description="Reglas de validación JSON (reemplazan las predeterminadas)"),
+    header_row: int = Query(HEADER_ROW, ge=1, description="Fila de encabezados (1-based)"),
+    skip_empty: bool = Query(True, description="Omitir filas sin valores en las columnas mapeadas"),
+    computed: bool = Query(True, description="Agregar columnas calculadas (superficies, precio base)"),
+    tolerance: float = Query(DEFAULT_RELATIVE_TOLERANCE, ge=0, le=1,
+                             description="Diferencia relativa admitida entre valor guardado y calculado"),
+    validate: bool = Query(True, description="Validar las columnas y agregar el resumen de errores por regla"),
+    decimal_separator: str = Query(DEFAULT_DECIMAL_SEPARATOR,
+                                   description="Separador decimal de la planilla (',' o '.'); decide textos como '1.200'")
+):
+    """
+    Importa las columnas del mapeo en una sola lectura de la hoja y devuelve
+    un resultado columnar: por campo, el arreglo de valores ya convertidos
+    (coma decimal, unidades y blancos resueltos) y un bitmap de celdas con
+    error. 'rows' trae el número de fila de Excel de cada posición. Con
+    computed, 'computed' trae superficie, superficie total y precio base
+    recalculados y 'mismatchRows' las filas cuyo valor guardado no coincide.
+    Con validate, 'validation' resume las fallas agrupadas por regla con los
+    tramos de filas afectados.
+    """
+    if not file.filename.endswith(('.xlsx', '.xlsm')):
+        raise HTTPException(status_code=400, detail="Solo se admiten archivos Excel (.xlsx, .xlsm)")
+    column_mapping = {field: header for field, header in _parse_json_object(mapping, "mapping").items() if header}
+    if not column_mapping:
+        raise HTTPException(status_code=400, detail="No se pudo crear un mapeo de columnas válido")
+    field_types = _parse_json_object(types, "types")
+    invalid_types = sorted(set(field_types.values()) - set(COLUMN_TYPES))
+    if invalid_types:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Tipo de columna no válido: {', '.join(invalid_types)}. Use uno de {', '.join(COLUMN_TYPES)}"
+        )
+    if decimal_separator not in DECIMAL_SEPARATORS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Separador decimal no válido: '{decimal_separator}'. Use ',' o '.'"
+        )
+    validation_rules = None
+    if rules:
+        try:
+            validation_rules = parse_rules(json.loads(rules))
+        except ValueError as e:  # JSON mal formado o InvalidRule
+            raise HTTPException(status_code=400, detail=f"Reglas de validación no válidas: {e}")
+
+    upload = None
+    spill_path = None
+    try:
+        upload, total_bytes, _, _ = await spool_upload(file)
+        source, spill_path = _pool_source(upload, total_bytes)
+        started = time.perf_counter()
+        result = await extraction_pool.run(
+            import_columns_job, source, header_row, column_mapping, field_types, skip_empty,
+            computed, tolerance, validate, validation_rules, decimal_separator
+        )
+        print(
+            f"Importadas {result['rowCount']} filas x {len(result['columns'])} columnas "
+            f"en {time.perf_counter() - started:.2f}s"
+        )
+        return result
+
+    except HTTPException:
+        raise
+
+    except InvalidRule as e:
+        raise HTTPException(status_code=400, detail=f"Reglas de validación no válidas: {e}")
+
+    except Exception as e:
+        error_msg = f"Error procesando archivo: {str(e)}"
+        print(error_msg)
+        print(traceback.format_exc())
+        raise HTTPException(status_code=500, detail=error_msg)
+
+    finally:
+        if upload is not None:
+            upload.close()
+        if spill_path and os.path.exists(spill_path):
+            os.remove(spill_path)
+
+async def _stored_upload(upload_id: str) -> Dict[str, Any]:
+    """Sesión de subida completa (verificada) para leerla sin copiarla; no la borra"""
+    try:
+        return await upload_sessions.finalize(upload_id)
+    except KeyError:
+        raise HTTPException(status_code=404, detail="Sesión de subida no encontrada o expirada")
+    except UploadSessionError as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e))
+
+async def _respond_with_rows(request: Request, file: Optional[UploadFile], upload_id: Optional[str],
+                             page_job: Callable, ndjson_stream: Callable,
+                             header_row: int, offset: int, limit: Optional[int], skip_empty: bool,
+                             with_colors: bool):
+    """
+    Flujo común de /parse-rows: página JSON en el pool o stream NDJSON. El
+    libro llega en file o, para paginar sin volver a subirlo ni copiarlo,
+    es el archivo de la sesión upload_id (que sigue viva hasta su TTL o
+    DELETE /uploads/{id}).
+    """
+    if (file is None) == (upload_id is None):
+        raise HTTPException(status_code=400, detail="Envíe el archivo en 'file' o una sesión en 'upload_id'")
+    session = await _stored_upload(upload_id) if upload_id is not None else None
+    filename = session["filename"] if session is not None else file.filename
+    if not filename.endswith(('.xlsx', '.xlsm')):
+        raise HTTPException(status_code=400, detail="Solo se admiten archivos Excel (.xlsx, .xlsm)")
+
+    response_format = negotiate_format(request.headers.get("accept", ""))
+    if response_format != FORMAT_NDJSON:
+        limit = min(limit or PARSE_ROWS_DEFAULT_LIMIT, PARSE_ROWS_MAX_LIMIT)
+
+    upload = None
+    spill_path = None
+    try:
+        if session is not None:
+            upload, total_bytes = session["path"], session["offset"]
+        else:
+            upload, total_bytes, _, _ = await spool_upload(file)
+        if response_format == FORMAT_NDJSON:
+            if session is not None:
+                upload = await asyncio.to_thread(open, session["path"], "rb")
+            stream = ndjson_stream(upload, filename, header_row, offset, limit, skip_empty, with_colors)
+            upload = None
+            return StreamingResponse(stream, media_type=MEDIA_TYPE_NDJSON)
+
+        source, spill_path = _pool_source(upload, total_bytes)
+        page = await extraction_pool.run(page_job, source, header_row, offset, limit, skip_empty, with_colors)
+        if session is not None:
+            page["uploadId"] = upload_id
+        return page
+
+    except HTTPException:
+        raise
+
+    except Exception as e:
+        error_msg = f"Error procesando archivo: {str(e)}"
+        print(error_msg)
+        print(traceback.format_exc())
+        raise HTTPException(status_code=500, detail=error_msg)
+
+    finally:
+        if upload is not None and not isinstance(upload, str):
+            upload.close()
+        if spill_path and os.path.exists(spill_path):
+            os.remove(spill_path)
+
+async def _extract_images_on_disk(file: UploadFile, anchor_mode: Optional[str], dedupe: bool,
+                                  response_format: str = FORMAT_JSON,
+                                  rendition_opts: Optional[Dict[str, Any]] = None):
+    """Modo original: guarda la subida y las imágenes en un directorio temporal"""
     temp_dir = None
     
     try:
@@ -267,72 +1599,31 @@ async def extract_images(file: UploadFile = File(...)):
         temp_dir = tempfile.mkdtemp(prefix="excel_images_")
         excel_path = os.path.join(temp_dir, file.filename)
         
-        # Guardar archivo temporal
+        # Guardar archivo temporal por bloques, sin cargarlo entero en memoria
+        total_bytes = 0
         with open(excel_path, "wb") as buffer:
-            content = await file.read()
-            buffer.write(content)
+            async for chunk in iter_upload_chunks(file, MAX_UPLOAD_BYTES, UPLOAD_CHUNK_SIZE):
+                buffer.write(chunk)
+                total_bytes += len(chunk)
         
         print(f"Archivo guardado temporalmente: {excel_path}")
-        print(f"Tamaño del archivo: {len(content)} bytes")
+        print(f"Tamaño del archivo: {total_bytes} bytes")
         
         # Extraer imágenes
         output_dir = os.path.join(temp_dir, "images")
-        extractor = ExcelImageExtractor()
-        images_info = extractor.extract_images_from_excel(excel_path, output_dir)
-        
-        if not images_info:
-            return {
-                "success": True,
-                "message": "No se encontraron imágenes en el archivo Excel",
-                "images": [],
-                "count": 0
-            }
-        
-        # Preparar respuesta con imágenes en base64
-        image_files = []
-        for img_info in images_info:
-            try:
-                with open(img_info["path"], "rb") as img_file:
-                    image_data = base64.b64encode(img_file.read()).decode("utf-8")
-                    
-                    # Determinar MIME type
-                    mime_types = {
-                        '.png': 'image/png',
-                        '.jpg': 'image/jpeg',
-                        '.jpeg': 'image/jpeg',
-                        '.gif': 'image/gif',
-                        '.bmp': 'image/bmp',
-                        '.tiff': 'image/tiff',
-                        '.svg': 'image/svg+xml'
-                    }
-                    
-                    mime_type = mime_types.get(img_info["extension"], 'image/png')
-                    
-                    image_files.append({
-                        "filename": img_info["filename"],
-                        "data": image_data,
-                        "mimeType": mime_type,
-                        "size": img_info["size"],
-                        "extension": img_info["extension"],
-                        "sheet": img_info.get("sheet", "DETALLE"),  # Usar DETALLE por defecto
-                        "cellAddress": img_info.get("cell_address", "unknown"),
-                        "row": img_info.get("row"),
-                        "column": img_info.get("column"),
-                        "columnLetter": img_info.get("column_letter", "E"),  # Usar E por defecto
-                        "anchorType": img_info.get("anchor_type", "unknown")
-                    })
-                    
-            except Exception as e:
-                print(f"Error leyendo imagen {img_info['filename']}: {str(e)}")
-                continue
-        
-        return {
-            "success": True,
-            "message": f"Se extrajeron {len(image_files)} imágenes correctamente",
-            "images": image_files,
-            "count": len(image_files)
-        }
+        encode_json = response_format == FORMAT_JSON and rendition_opts is None
+        result = await extraction_pool.run(
+            run_disk_extraction_job, excel_path, output_dir, anchor_mode or DEFAULT_ANCHOR_MODE,
+            dedupe, encode_json
+        )
+        # El modo en disco no consulta la caché
+        return with_cache_status(
+            await respond_with_images(result, response_format, dedupe, rendition_opts), CACHE_BYPASS
+        )
         
+    except HTTPException:
+        raise
+
     except Exception as e:
         error_msg = f"Error procesando archivo: {str(e)}"
         print(error_msg)
@@ -349,6 +1640,770 @@ async def extract_images(file: UploadFile = File(...)):
             except Exception as e:
                 print(f"Error limpiando directorio temporal: {str(e)}")
 
+async def _extract_batch_file(index: int, job: Dict[str, Any], anchor_mode: str, dedupe: bool,
+                              rendition_opts: Optional[Dict[str, Any]], use_cache: bool,
+                              slots: asyncio.Semaphore) -> Dict[str, Any]:
+    """
+    Procesa un archivo del lote; los errores quedan en su propia línea sin
+    cortar el lote. slots limita cuántos archivos se leen y procesan a la vez.
+    """
+    started = time.perf_counter()
+    filename = job["filename"]
+    upload = job["upload"]
+    line = {"type": "file", "index": index, "filename": filename}
+    try:
+        if upload is None:
+            raise ValueError(job["error"])
+        async with slots:
+            manifest, blobs, cache_status = await extract_raw_result(
+                upload, job["total_bytes"], job["sha256"], anchor_mode, rendition_opts, use_cache
+            )
+            line.update({
+                "success": True,
+                "cache": cache_status,
+                "result": await serialize_images(manifest, blobs, FORMAT_JSON, dedupe)
+            })
+    except Exception as e:
+        print(f"Error procesando {filename} en el lote: {str(e)}")
+        line.update({"success": False, "error": str(e)})
+    finally:
+        if upload is not None:
+            upload.close()
+    line["elapsedMs"] = round((time.perf_counter() - started) * 1000, 2)
+    return line
+
+async def _batch_stream(jobs: List[Dict[str, Any]], anchor_mode: str, dedupe: bool,
+                        rendition_opts: Optional[Dict[str, Any]], use_cache: bool):
+    """
+    Procesa hasta un archivo por trabajador del pool a la vez y emite cada
+    resultado apenas termina. Cada archivo se lee recién al tomar su turno,
+    así no quedan todas las subidas cargadas para el pool al mismo tiempo.
+    """
+    started = time.perf_counter()
+    yield ndjson_line({"type": "batch", "count": len(jobs)})
+
+    slots = asyncio.Semaphore(extraction_pool.max_workers)
+    tasks = [
+        asyncio.create_task(
+            _extract_batch_file(index, job, anchor_mode, dedupe, rendition_opts, use_cache, slots)
+        )
+        for index, job in enumerate(jobs)
+    ]
+    succeeded = 0
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            line = await next_done
+            succeeded += 1 if line["success"] else 0
+            yield ndjson_line(line)
+    finally:
+        # Si el cliente corta la conexión no se siguen procesando los pendientes
+        for task in tasks:
+            task.cancel()
+        for job in jobs:
+            if job["upload"] is not None:
+                job["upload"].close()
+
+    yield ndjson_line({
+        "type": "summary",
+        "count": len(jobs),
+        "succeeded": succeeded,
+        "failed": len(jobs) - succeeded,
+        "elapsedMs": round((time.perf_counter() - started) * 1000, 2)
+    })
+
+@app.post("/extract-images/batch")
+async def extract_images_batch(
+    files: List[UploadFile] = File(...),
+    anchor_mode: Optional[str] = Query(None, description="Motor de anclajes: 'xml' u 'openpyxl'"),
+    dedupe: bool = Query(False, description="Enviar cada imagen distinta una sola vez en 'blobs'"),
+    renditions: Optional[str] = Query(None, description="Tamaños de las versiones reducidas en px, ej. 64,256,1024"),
+    rendition_format: str = Query(DEFAULT_RENDITION_FORMAT, description="Formato de las renditions: webp o jpeg"),
+    originals: bool = Query(True, description="Incluir los originales además de las renditions"),
+    cache: bool = Query(True, description="Usar la caché de resultados por hash de la subida")
+):
+    """
+    Extrae imágenes de varios libros en paralelo sobre el pool de trabajadores.
+    Responde application/x-ndjson: una cabecera, una línea por archivo (con el
+    mismo JSON que /extract-images o el error) en orden de finalización y un
+    resumen final. Un archivo inválido no hace fallar el lote.
+    """
+    if len(files) > BATCH_MAX_FILES:
+        raise HTTPException(
+            status_code=400,
+            detail=f"El lote tiene {len(files)} archivos; el máximo es {BATCH_MAX_FILES}"
+        )
+
+    if anchor_mode is not None and anchor_mode not in ANCHOR_MODES:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Modo de anclaje no válido: {anchor_mode}. Use uno de {', '.join(ANCHOR_MODES)}"
+        )
+
+    rendition_opts = rendition_options(renditions, rendition_format, originals)
+
+    # Las subidas se copian antes de responder: FastAPI cierra los UploadFile
+    # cuando termina el endpoint, pero el stream sigue después. Entre todas las
+    # copias retienen a lo sumo BATCH_SPOOL_MAX_BYTES en memoria; el resto va a disco
+    jobs = []
+    memory_left = BATCH_SPOOL_MAX_BYTES
+    try:
+        for file in files:
+            job = {"filename": file.filename, "upload": None, "total_bytes": 0, "sha256": None, "error": None}
+            if not file.filename.endswith(('.xlsx', '.xlsm')):
+                job["error"] = "Solo se admiten archivos Excel (.xlsx, .xlsm)"
+            else:
+                spool_limit = min(SPOOL_MAX_BYTES, memory_left)
+                try:
+                    job["upload"], job["total_bytes"], job["sha256"], _ = await spool_upload(file, spool_limit)
+                    if job["total_bytes"] <= spool_limit:
+                        memory_left -= job["total_bytes"]
+                except UploadTooLarge as e:
+                    job["error"] = e.detail
+            jobs.append(job)
+    except Exception:
+        for job in jobs:
+            if job["upload"] is not None:
+                job["upload"].close()
+        raise
+
+    print(f"Lote recibido: {len(jobs)} archivos")
+    stream = _batch_stream(jobs, anchor_mode or DEFAULT_ANCHOR_MODE, dedupe, rendition_opts,
+                           cache and result_cache.enabled)
+    return StreamingResponse(stream, media_type=MEDIA_TYPE_NDJSON)
+
+def workbook_manifest(record: Dict[str, Any]) -> Dict[str, Any]:
+    """Manifiesto liviano de un libro ingerido: sin bytes, con la URL de cada imagen"""
+    manifest = record["manifest"]
+    workbook_id = record["id"]
+    blobs_meta = {blob["id"]: blob for blob in manifest["blobs"]}
+
+    images = []
+    for image in manifest["images"]:
+        blob = blobs_meta.get(image["blobId"], {})
+        entry = dict(image)
+        # imageId es el mismo blobId que usa la URL (y /export-products)
+        entry.update({
+            "imageId": image["blobId"],
+            "contentHash": image["blobId"],
+            "width": blob.get("width"),
+            "height": blob.get("height"),
+            "url": f"/workbooks/{workbook_id}/images/{image['blobId']}"
+        })
+        images.append(entry)
+
+    return {
+        "success": True,
+        "workbookId": workbook_id,
+        "filename": record["filename"],
+        "sha256": record["sha256"],
+        "expiresAt": record["expires_at"],
+        "ttlSeconds": WORKBOOK_TTL_SECONDS,
+        "message": manifest["message"],
+        "count": manifest["count"],
+        "images": images,
+        "unanchoredMedia": manifest["unanchoredMedia"],
+        "blobs": manifest["blobs"]
+    }
+
+@app.post("/workbooks")
+async def ingest_workbook(
+    file: UploadFile = File(...),
+    anchor_mode: Optional[str] = Query(None, description="Motor de anclajes: 'xml' u 'openpyxl'"),
+    renditions: Optional[str] = Query(None, description="Tamaños de las versiones reducidas en px, ej. 64,256"),
+    rendition_format: str = Query(DEFAULT_RENDITION_FORMAT, description="Formato de las renditions: webp o jpeg")
+):
+    """
+    Procesa un libro una sola vez y devuelve un manifiesto sin bytes de imagen.
+    Las imágenes se piden después con GET /workbooks/{id}/images/{image_id}.
+    """
+    if not file.filename.endswith(('.xlsx', '.xlsm')):
+        raise HTTPException(status_code=400, detail="Solo se admiten archivos Excel (.xlsx, .xlsm)")
+    if anchor_mode is not None and anchor_mode not in ANCHOR_MODES:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Modo de anclaje no válido: {anchor_mode}. Use uno de {', '.join(ANCHOR_MODES)}"
+        )
+    rendition_opts = rendition_options(renditions, rendition_format, True)
+
+    upload = None
+    try:
+        upload, total_bytes, upload_sha256, spooled_bytes = await spool_upload(file)
+        manifest, blobs, cache_status = await extract_raw_result(
+            upload, total_bytes, upload_sha256, anchor_mode or DEFAULT_ANCHOR_MODE, rendition_opts
+        )
+        record = workbook_store.add(manifest, blobs, filename=file.filename, sha256=upload_sha256)
+        print(f"Libro {record['id']} ingerido: {file.filename} ({manifest['count']} imágenes)")
+        return with_cache_status(
+            workbook_manifest(record), cache_status, {"X-Upload-Spooled-Bytes": str(spooled_bytes)}
+        )
+
+    except WorkbookTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+
+    except HTTPException:
+        raise
+
+    except Exception as e:
+        error_msg = f"Error procesando archivo: {str(e)}"
+        print(error_msg)
+        print(traceback.format_exc())
+        raise HTTPException(status_code=500, detail=error_msg)
+
+    finally:
+        if upload is not None:
+            upload.close()
+
+@app.get("/workbooks/{workbook_id}")
+async def get_workbook(workbook_id: str):
+    """Vuelve a entregar el manifiesto de un libro ingerido (renueva su TTL)"""
+    record = workbook_store.get(workbook_id)
+    if record is None:
+        raise HTTPException(status_code=404, detail="Libro no encontrado o expirado")
+    return workbook_manifest(record)
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """True si la cabecera If-None-Match incluye el ETag (comparación débil) o es '*'"""
+    if not if_none_match:
+        return False
+    candidates = [candidate.strip() for candidate in if_none_match.split(",")]
+    return "*" in candidates or etag in (
+        candidate[2:] if candidate.startswith("W/") else candidate for candidate in candidates
+    )
+
+@app.get("/workbooks/{workbook_id}/images/{image_id}")
+async def get_workbook_image(workbook_id: str, image_id: str, request: Request,
+                             size: Optional[int] = Query(None)):
+    """
+    Bytes crudos de una imagen del libro. image_id es el hash de contenido
+    (blobId) del manifiesto; con size se sirve la rendition de ese tamaño.
+    Con If-None-Match igual al ETag responde 304 sin cuerpo.
+    """
+    record, blob = workbook_store.get_blob(workbook_id, image_id)
+    if record is None:
+        raise HTTPException(status_code=404, detail="Libro no encontrado o expirado")
+    if blob is None:
+        raise HTTPException(status_code=404, detail=f"Imagen no encontrada: {image_id}")
+
+    part = blob
+    if size is not None:
+        part = next((r for r in blob.get("renditions", []) if r["size"] == size), None)
+        if part is None:
+            raise HTTPException(status_code=404, detail=f"Rendition de {size}px no disponible para {image_id}")
+
+    # El contenido está direccionado por hash: nunca cambia para la misma URL
+    etag = f'"{part.get("id", image_id)}"'
+    headers = {"ETag": etag, "Cache-Control": f"private, max-age={WORKBOOK_TTL_SECONDS}, immutable"}
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+    return Response(content=part["data"], media_type=part["mimeType"], headers=headers)
+
+@app.delete("/workbooks/{workbook_id}")
+async def delete_workbook(workbook_id: str):
+    """Libera un libro antes de que expire su TTL"""
+    if not workbook_store.delete(workbook_id):
+        raise HTTPException(status_code=404, detail="Libro no encontrado o expirado")
+    return {"success": True, "workbookId": workbook_id}
+
+def offer_image_source(record: Optional[Dict[str, Any]]):
+    """
+    Resuelve la imagen de diseño de cada producto en el libro ingerido: por
+    'imageId' (blobId del manifiesto) o por la fila de Excel ('row'). La clave
+    es el hash de contenido, así que la imagen se incrusta una sola vez.
+    """
+    if record is None:
+        return None
+    blobs = record["blobs"]
+    blob_by_row = {}
+    for image in record["manifest"]["images"]:
+        blob_by_row.setdefault(image.get("row"), image["blobId"])
+
+    def image_for(product: Dict[str, Any]):
+        blob_id = product.get("imageId") or blob_by_row.get(product.get("row"))
+        blob = blobs.get(blob_id) if blob_id else None
+        return (blob_id, blob["data"]) if blob else None
+
+    return image_for
+
+def _offer_pdf_stream(offer: Dict[str, Any], image_for, started: float):
+    pages = 0
+    for chunk in render_offer_pdf(offer, image_for):
+        pages += 1
+        yield chunk
+    print(f"Oferta PDF: {len(offer['productos'])} productos, {pages - 1} páginas en "
+          f"{time.perf_counter() - started:.2f}s")
+
+@app.post("/offers/pdf")
+async def offer_pdf(offer: Dict[str, Any] = Body(...)):
+    """
+    Compone el PDF de la oferta en el servidor con texto real. Con
+    'workbookId' las imágenes de diseño salen del libro ingerido y cada una se
+    incrusta una sola vez; las páginas se envían a medida que se componen.
+    """
+    try:
+        parse_offer(offer)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    record = None
+    workbook_id = offer.get("workbookId")
+    if workbook_id:
+        record = workbook_store.get(str(workbook_id))
+        if record is None:
+            raise HTTPException(status_code=404, detail="Libro no encontrado o expirado")
+
+    quote = offer.get("cubicacion") or {}
+    filename = f"Oferta_{quote.get('codigo') or 'cliente'}.pdf".replace('"', "")
+    return StreamingResponse(
+        _offer_pdf_stream(offer, offer_image_source(record), time.perf_counter()),
+        media_type="application/pdf",
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+    )
+
+def _xlsx_export_stream(products: List[Dict[str, Any]], columns: List[Dict[str, Any]], image_for,
+                        title: str, started: float):
+    stats = {}
+    yield from iter_xlsx_export(products, columns, image_for, title, stats)
+    print(f"Exportación xlsx: {stats['rows']} filas, {stats['images']} imágenes distintas en "
+          f"{stats['anchors']} anclas, {time.perf_counter() - started:.2f}s")
+
+@app.post("/exports/products")
+async def export_products(export: Dict[str, Any] = Body(...)):
+    """
+    Exporta productos a un .xlsx con el formato de la hoja DETALLE. El libro
+    se escribe y se envía por partes mientras se generan las filas. Con
+    'workbookId' la imagen de diseño de cada producto ('imageId' o 'row') sale
+    del libro ingerido y cada imagen distinta se guarda una sola vez en
+    xl/media.
+    """
+    try:
+        columns = parse_export(export)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    record = None
+    workbook_id = export.get("workbookId")
+    if workbook_id:
+        record = workbook_store.get(str(workbook_id))
+        if record is None:
+            raise HTTPException(status_code=404, detail="Libro no encontrado o expirado")
+
+    filename = str(export.get("filename") or "productos").replace('"', "")
+    if not filename.endswith(".xlsx"):
+        filename += ".xlsx"
+    return StreamingResponse(
+        _xlsx_export_stream(export["productos"], columns, offer_image_source(record),
+                            str(export.get("title") or ""), time.perf_counter()),
+        media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+    )
+
+def _template_fill_stream(fill: TemplateFill, template: zipfile.ZipFile, upload, started: float):
+    try:
+        yield from fill.iter_bytes()
+        print(f"Plantilla rellenada: {fill.rows_written} filas, {len(fill.blocks)} bloques, "
+              f"{len(fill.anchors)} imágenes ({len(fill.media)} distintas) en {time.perf_counter() - started:.2f}s")
+    except Exception as e:
+        # La respuesta 200 ya salió: se relanza para cortar la conexión en vez de cerrar un ZIP truncado
+        print(f"Error rellenando la plantilla: {str(e)}")
+        print(traceback.format_exc())
+        raise
+    finally:
+        template.close()
+        upload.close()
+
+@app.post("/templates/fill")
+async def fill_template(
+    file: UploadFile = File(...),
+    data: str = Form(..., description="Datos JSON para los marcadores {{...}}"),
+    sheet: Optional[str] = Query(None, description="Hoja a rellenar (por defecto DETALLE o la primera)")
+):
+    """
+    Rellena una plantilla de cubicación sin cargarla con openpyxl: solo se
+    reescriben la hoja, su dibujo y los metadatos afectados; el resto de las
+    partes se copia comprimido tal cual. Las filas con marcadores de una lista
+    se repiten por elemento. Con 'workbookId' en los datos, {{lista.imagen}}
+    ancla la imagen de diseño del elemento ('imageId' o 'row') del libro
+    ingerido.
+    """
+    if not file.filename.endswith(('.xlsx', '.xlsm')):
+        raise HTTPException(status_code=400, detail="Solo se admiten archivos Excel (.xlsx, .xlsm)")
+    try:
+        values = json.loads(data)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="'data' no es un JSON válido")
+    if not isinstance(values, dict):
+        raise HTTPException(status_code=400, detail="'data' debe ser un objeto JSON")
+
+    record = None
+    workbook_id = values.get("workbookId")
+    if workbook_id:
+        record = workbook_store.get(str(workbook_id))
+        if record is None:
+            raise HTTPException(status_code=404, detail="Libro no encontrado o expirado")
+
+    upload = None
+    template = None
+    try:
+        upload, _, _, _ = await spool_upload(file)
+        started = time.perf_counter()
+        template = zipfile.ZipFile(upload)
+        fill = await asyncio.to_thread(TemplateFill, template, values, sheet, offer_image_source(record))
+
+    except (zipfile.BadZipFile, ValueError) as e:
+        if template is not None:
+            template.close()
+        if upload is not None:
+            upload.close()
+        raise HTTPException(status_code=400, detail=f"Plantilla no válida: {str(e)}")
+
+    except Exception as e:
+        if template is not None:
+            template.close()
+        if upload is not None:
+            upload.close()
+        if isinstance(e, HTTPException):
+            raise
+        error_msg = f"Error procesando plantilla: {str(e)}"
+        print(error_msg)
+        print(traceback.format_exc())
+        raise HTTPException(status_code=500, detail=error_msg)
+
+    name, extension = os.path.splitext(os.path.basename(file.filename))
+    media_type = ("application/vnd.ms-excel.sheet.macroEnabled.12" if extension == ".xlsm"
+                  else "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet")
+    filled_name = f"{name}_rellena{extension}".replace('"', "")
+    return StreamingResponse(
+        _template_fill_stream(fill, template, upload, started),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{filled_name}"'}
+    )
+
+def sheet_pdf_stream(events, title: str, zip_file: zipfile.ZipFile, upload, started: float):
+    """
+    Compone el PDF mientras se lee la hoja: cada imagen distinta se incrusta
+    al aparecer y cada tramo de páginas ya paginado se compone en el pool
+    (varios a la vez); las páginas se envían en orden a medida que llegan sus
+    tramos. Solo se retienen las filas de los tramos en curso. Cierra la
+    subida al terminar.
+    """
+    writer = PdfStreamWriter(title=title)
+    in_flight = deque()
+    image_table = {}
+    layout = None
+    row_count = 0
+
+    def flush_oldest():
+        for page in in_flight.popleft().result():
+            writer.add_rendered_page(page)
+        return writer.drain()
+
+    try:
+        for kind, payload in events:
+            if kind == 'blob':
+                image = writer.image(payload["id"], payload["data"])
+                if image is not None:
+                    image_table[payload["id"]] = image
+            elif kind == 'layout':
+                layout = dict(payload, page_total=writer.text_form())
+            elif kind == 'pages':
+                first_page, rows, breaks = payload
+                row_count += len(rows)
+                images = {
+                    blob_id: image_table[blob_id]
+                    for row in rows for blob_id in row["images"] if blob_id in image_table
+                }
+                in_flight.append(extraction_pool.submit(render_sheet_pages, layout, rows, breaks, first_page, images))
+                yield writer.drain()
+                # Un tramo más que trabajadores para que ninguno quede ocioso mientras se envía
+                while len(in_flight) > extraction_pool.max_workers:
+                    yield flush_oldest()
+        while in_flight:
+            yield flush_oldest()
+        write_page_total(writer, layout)
+        yield writer.close()
+        print(f"Hoja a PDF: {row_count} filas, {writer.page_count} páginas, {writer.image_count} imágenes en "
+              f"{time.perf_counter() - started:.2f}s")
+
+    except Exception as e:
+        # La respuesta 200 ya salió: se relanza para cortar la conexión en vez de cerrar un PDF truncado
+        print(f"Error generando el PDF de la hoja: {str(e)}")
+        print(traceback.format_exc())
+        raise
+    finally:
+        for pending in in_flight:
+            pending.cancel()
+        zip_file.close()
+        upload.close()
+
+@app.post("/sheet-to-pdf")
+async def sheet_to_pdf(
+    file: UploadFile = File(...),
+    header_row: int = Query(HEADER_ROW, ge=1, description="Fila de encabezados (1-based)"),
+    skip_empty: bool = Query(True, description="Omitir filas vacías")
+):
+    """
+    Convierte la hoja DETALLE en una tabla PDF paginada: anchos de columna y
+    colores del libro, imágenes de diseño en su celda y el encabezado repetido
+    en cada página. La hoja se lee mientras se envía el PDF y las páginas se
+    componen en el pool por tramos.
+    """
+    if not file.filename.endswith(('.xlsx', '.xlsm')):
+        raise HTTPException(status_code=400, detail="Solo se admiten archivos Excel (.xlsx, .xlsm)")
+
+    upload = None
+    zip_file = None
+    try:
+        upload, _, _, _ = await spool_upload(file)
+        started = time.perf_counter()
+        zip_file = await asyncio.to_thread(zipfile.ZipFile, upload, 'r')
+        events = iter_sheet_pages(zip_file, file.filename, header_row, skip_empty)
+        # La cabecera se lee antes de responder para que un libro inválido siga dando 500
+        _, header = await asyncio.to_thread(next, events)
+
+    except Exception as e:
+        if zip_file is not None:
+            zip_file.close()
+        if upload is not None:
+            upload.close()
+        if isinstance(e, HTTPException):
+            raise
+        error_msg = f"Error procesando archivo: {str(e)}"
+        print(error_msg)
+        print(traceback.format_exc())
+        raise HTTPException(status_code=500, detail=error_msg)
+
+    pdf_name = os.path.splitext(os.path.basename(file.filename))[0].replace('"', "") + ".pdf"
+    return StreamingResponse(
+        sheet_pdf_stream(events, header["title"], zip_file, upload, started),
+        media_type="application/pdf",
+        headers={"Content-Disposition": f'attachment; filename="{pdf_name}"'}
+    )
+
+def job_status(job: Dict[str, Any]) -> Dict[str, Any]:
+    """Estado público de un trabajo (sin el resultado)"""
+    return {
+        "jobId": job["id"],
+        "filename": job["filename"],
+        "status": job["status"],
+        "stage": job["stage"],
+        "progress": job["progress"],
+        "createdAt": job["created_at"],
+        "startedAt": job["started_at"],
+        "finishedAt": job["finished_at"],
+        "expiresAt": job["expires_at"],
+        "error": job["error"],
+        "statusUrl": f"/jobs/{job['id']}",
+        "resultUrl": f"/jobs/{job['id']}/result"
+    }
+
+@app.post("/jobs", status_code=202)
+async def submit_job(
+    file: UploadFile = File(...),
+    anchor_mode: Optional[str] = Query(None, description="Motor de anclajes: 'xml' u 'openpyxl'"),
+    renditions: Optional[str] = Query(None, description="Tamaños de las versiones reducidas en px, ej. 64,256,1024"),
+    rendition_format: str = Query(DEFAULT_RENDITION_FORMAT, description="Formato de las renditions: webp o jpeg"),
+    originals: bool = Query(True, description="Incluir los originales además de las renditions"),
+    cache: bool = Query(True, description="Usar la caché de resultados por hash de la subida")
+):
+    """
+    Encola la extracción de un libro grande y responde de inmediato con el id
+    del trabajo. El avance se consulta en GET /jobs/{id} y el resultado en
+    GET /jobs/{id}/result.
+    """
+    if not file.filename.endswith(('.xlsx', '.xlsm')):
+        raise HTTPException(status_code=400, detail="Solo se admiten archivos Excel (.xlsx, .xlsm)")
+    if anchor_mode is not None and anchor_mode not in ANCHOR_MODES:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Modo de anclaje no válido: {anchor_mode}. Use uno de {', '.join(ANCHOR_MODES)}"
+        )
+    rendition_opts = rendition_options(renditions, rendition_format, originals)
+
+    upload, total_bytes, upload_sha256, _ = await spool_upload(file)
+    anchor_mode = anchor_mode or DEFAULT_ANCHOR_MODE
+    use_cache = cache and result_cache.enabled
+
+    async def run_job(job: Dict[str, Any]):
+        def on_stage(stage: str):
+            job_queue.progress(job, stage, JOB_STAGE_PROGRESS[stage])
+
+        manifest, blobs, cache_status = await extract_raw_result(
+            upload, total_bytes, upload_sha256, anchor_mode, rendition_opts, use_cache, on_stage
+        )
+        job["cache"] = cache_status
+        return manifest, blobs
+
+    # La subida pertenece al trabajo: se cierra cuando termina, falla o se cancela
+    job = job_queue.submit(run_job, upload.close, filename=file.filename, sha256=upload_sha256, cache=None)
+    print(f"Trabajo {job['id']} encolado: {file.filename} ({total_bytes} bytes)")
+    return job_status(job)
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    """Etapa y porcentaje de avance de un trabajo"""
+    job = job_queue.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Trabajo no encontrado o expirado")
+    return job_status(job)
+
+@app.get("/jobs/{job_id}/result")
+async def get_job_result(
+    job_id: str,
+    request: Request,
+    dedupe: bool = Query(False, description="Enviar cada imagen distinta una sola vez en 'blobs'")
+):
+    """
+    Resultado de un trabajo terminado con el mismo formato que /extract-images
+    (JSON con base64, multipart/mixed o application/zip según Accept).
+    """
+    job = job_queue.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Trabajo no encontrado o expirado")
+    if job["status"] == JOB_FAILED:
+        raise HTTPException(status_code=500, detail=f"Error procesando archivo: {job['error']}")
+    if job["status"] != JOB_DONE:
+        raise HTTPException(status_code=409, detail=f"El trabajo no terminó (estado: {job['status']})")
+
+    response_format = negotiate_format(request.headers.get("accept", ""))
+    if response_format == FORMAT_NDJSON:
+        response_format = FORMAT_JSON
+    manifest, blobs = job["result"]
+    return with_cache_status(await serialize_images(manifest, blobs, response_format, dedupe), job["cache"])
+
+@app.delete("/jobs/{job_id}")
+async def cancel_job(job_id: str):
+    """
+    Cancela un trabajo pendiente o en curso, o descarta el resultado de uno
+    terminado. Uno en curso responde 'cancelling' hasta que el pool libere su
+    etapa actual; GET /jobs/{id} informa 'cancelled' cuando se cortó.
+    """
+    job = job_queue.cancel(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Trabajo no encontrado o expirado")
+    return {
+        "success": True,
+        "jobId": job_id,
+        "status": job["status"],
+        "discarded": job["status"] in FINAL_STATES
+    }
+
+def upload_session_status(session: Dict[str, Any]) -> Dict[str, Any]:
+    """Estado público de una sesión de subida reanudable"""
+    return {
+        "uploadId": session["id"],
+        "filename": session["filename"],
+        "size": session["size"],
+        "offset": session["offset"],
+        "expiresAt": session["expires_at"],
+        "uploadUrl": f"/uploads/{session['id']}",
+        "finalizeUrl": f"/uploads/{session['id']}/finalize"
+    }
+
+@app.post("/uploads", status_code=201)
+async def create_upload_session(
+    filename: str = Query(..., description="Nombre del archivo Excel"),
+    size: Optional[int] = Query(None, description="Tamaño total en bytes, si se conoce"),
+    sha256: Optional[str] = Query(None, description="SHA-256 esperado del archivo completo")
+):
+    """
+    Abre una subida reanudable. El cliente envía luego las partes con
+    PUT /uploads/{id}?offset=N y cierra con POST /uploads/{id}/finalize.
+    """
+    if not filename.endswith(('.xlsx', '.xlsm')):
+        raise HTTPException(status_code=400, detail="Solo se admiten archivos Excel (.xlsx, .xlsm)")
+    try:
+        session = await asyncio.to_thread(upload_sessions.create, filename, size, sha256)
+    except UploadSessionError as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e))
+    print(f"Sesión de subida {session['id']} abierta: {filename} ({size or '?'} bytes)")
+    return upload_session_status(session)
+
+@app.put("/uploads/{upload_id}")
+async def upload_chunk(
+    upload_id: str,
+    request: Request,
+    offset: int = Query(..., description="Posición de la parte dentro del archivo")
+):
+    """
+    Agrega una parte con el cuerpo crudo de la petición. Si offset no coincide
+    con lo ya recibido responde 409 con el offset correcto para reanudar.
+    """
+    try:
+        session = await upload_sessions.append(upload_id, offset, request.stream())
+    except KeyError:
+        raise HTTPException(status_code=404, detail="Sesión de subida no encontrada o expirada")
+    except UploadSessionError as e:
+        session = await asyncio.to_thread(upload_sessions.get, upload_id)
+        raise HTTPException(
+            status_code=e.status_code,
+            detail=str(e),
+            headers={"Upload-Offset": str(session["offset"])} if session else None
+        )
+    return JSONResponse(upload_session_status(session), headers={"Upload-Offset": str(session["offset"])})
+
+@app.get("/uploads/{upload_id}")
+async def get_upload_session(upload_id: str):
+    """Offset confirmado de una sesión: desde ahí se reanuda la subida"""
+    session = await asyncio.to_thread(upload_sessions.get, upload_id)
+    if session is None:
+        raise HTTPException(status_code=404, detail="Sesión de subida no encontrada o expirada")
+    return JSONResponse(upload_session_status(session), headers={"Upload-Offset": str(session["offset"])})
+
+@app.post("/uploads/{upload_id}/finalize")
+async def finalize_upload_session(
+    upload_id: str,
+    request: Request,
+    anchor_mode: Optional[str] = Query(None, description="Motor de anclajes: 'xml' u 'openpyxl'"),
+    dedupe: bool = Query(False, description="Enviar cada imagen distinta una sola vez en 'blobs'"),
+    renditions: Optional[str] = Query(None, description="Tamaños de las versiones reducidas en px, ej. 64,256,1024"),
+    rendition_format: str = Query(DEFAULT_RENDITION_FORMAT, description="Formato de las renditions: webp o jpeg"),
+    originals: bool = Query(True, description="Incluir los originales además de las renditions"),
+    cache: bool = Query(True, description="Usar la caché de resultados por hash de la subida")
+):
+    """
+    Verifica el archivo ensamblado y extrae sus imágenes directamente desde el
+    archivo de la sesión, sin otra copia. Responde en los mismos formatos que
+    /extract-images (salvo NDJSON) y borra la sesión al responder con éxito.
+    """
+    if anchor_mode is not None and anchor_mode not in ANCHOR_MODES:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Modo de anclaje no válido: {anchor_mode}. Use uno de {', '.join(ANCHOR_MODES)}"
+        )
+    response_format = negotiate_format(request.headers.get("accept", ""))
+    if response_format == FORMAT_NDJSON:
+        response_format = FORMAT_JSON
+    rendition_opts = rendition_options(renditions, rendition_format, originals)
+
+    session = await _stored_upload(upload_id)
+
+    try:
+        manifest, blobs, cache_status = await extract_raw_result(
+            session["path"], session["offset"], session["sha256"], anchor_mode or DEFAULT_ANCHOR_MODE,
+            rendition_opts, cache and result_cache.enabled
+        )
+        result = await serialize_images(manifest, blobs, response_format, dedupe)
+
+    except HTTPException:
+        raise
+
+    except Exception as e:
+        error_msg = f"Error procesando archivo: {str(e)}"
+        print(error_msg)
+        print(traceback.format_exc())
+        raise HTTPException(status_code=500, detail=error_msg)
+
+    # Si la extracción falla la sesión se conserva hasta su TTL para reintentar
+    await asyncio.to_thread(upload_sessions.delete, upload_id)
+    return with_cache_status(result, cache_status)
+
+@app.delete("/uploads/{upload_id}")
+async def delete_upload_session(upload_id: str):
+    """Descarta una subida reanudable y su archivo parcial"""
+    if not await asyncio.to_thread(upload_sessions.delete, upload_id):
+        raise HTTPException(status_code=404, detail="Sesión de subida no encontrada o expirada")
+    return {"success": True, "uploadId": upload_id}
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8000)
@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+"""
+Medios de xl/media deduplicados por contenido
+
+Las planillas de ventanas reutilizan la misma imagen de diseño en muchas filas.
+Cada contenido distinto se guarda una sola vez bajo su SHA-256 y cada parte
+xl/media apunta a ese blob. Para no descomprimir dos veces los duplicados se
+agrupa primero por CRC32 y tamaño del directorio central del ZIP.
+"""
+
+import hashlib
+import os
+import struct
+import zipfile
+from typing import Dict, List, Any, Optional, Tuple
+
+from zip_utils import read_compressed_bytes
+
+MEDIA_PREFIX = "xl/media/"
+
+
+class MediaStore:
+    """Blobs únicos de xl/media indexados por hash de contenido"""
+
+    def __init__(self):
+        # blob_id (sha256) -> {'id', 'data', 'size', 'extension', 'media_parts'}
+        self.blobs: Dict[str, Dict[str, Any]] = {}
+        # parte xl/media -> blob_id
+        self.blob_by_part: Dict[str, str] = {}
+
+    @classmethod
+    def from_zip(cls, zip_file: zipfile.ZipFile) -> "MediaStore":
+        """Lee y deduplica todas las entradas xl/media de un ZIP abierto"""
+        store = cls()
+
+        # Primera pasada: agrupar por (CRC32, tamaño) sin leer datos
+        groups: Dict[tuple, List[zipfile.ZipInfo]] = {}
+        for info in zip_file.infolist():
+            if info.filename.startswith(MEDIA_PREFIX) and not info.is_dir():
+                groups.setdefault((info.CRC, info.file_size), []).append(info)
+
+        for members in groups.values():
+            if len(members) == 1:
+                store._add(members[0].filename, zip_file.read(members[0]))
+                continue
+
+            # Candidatos a duplicado: comparar los bytes comprimidos y
+            # descomprimir una sola vez cada variante distinta
+            decoded: Dict[tuple, str] = {}
+            for info in members:
+                raw_key = (info.compress_type, hashlib.sha256(read_compressed_bytes(zip_file, info)).digest())
+                if raw_key in decoded:
+                    store._link(info.filename, decoded[raw_key])
+                else:
+                    decoded[raw_key] = store._add(info.filename, zip_file.read(info))
+
+        return store
+
+    def _add(self, media_part: str, data: bytes) -> str:
+        """Registra el contenido de una parte y devuelve su blob_id"""
+        blob_id = hashlib.sha256(data).hexdigest()
+        if blob_id not in self.blobs:
+            self.blobs[blob_id] = {
+                "id": blob_id,
+                "data": data,
+                "size": len(data),
+                "extension": os.path.splitext(media_part)[1].lower(),
+                "media_parts": [],
+            }
+        self._link(media_part, blob_id)
+        return blob_id
+
+    def _link(self, media_part: str, blob_id: str):
+        self.blobs[blob_id]["media_parts"].append(media_part)
+        self.blob_by_part[media_part] = blob_id
+
+    def blob_for_part(self, media_part: str) -> Optional[Dict[str, Any]]:
+        blob_id = self.blob_by_part.get(media_part)
+        return self.blobs.get(blob_id) if blob_id else None
+
+    @property
+    def duplicate_count(self) -> int:
+        """Cantidad de partes xl/media que repetían un contenido ya visto"""
+        return len(self.blob_by_part) - len(self.blobs)
+
+
+def image_dimensions(data: bytes) -> Tuple[Optional[int], Optional[int]]:
+    """
+    Ancho y alto en píxeles leyendo solo la cabecera (PNG, JPEG, GIF, BMP).
+    Devuelve (None, None) para formatos no reconocidos (EMF, SVG...).
+    """
+    try:
+        if data[:8] == b"\x89PNG\r\n\x1a\n":
+            return struct.unpack(">II", data[16:24])
+        if data[:6] in (b"GIF87a", b"GIF89a"):
+            return struct.unpack("<HH", data[6:10])
+        if data[:2] == b"BM":
+            width, height = struct.unpack("<ii", data[18:26])
+            return width, abs(height)
+        if data[:2] == b"\xff\xd8":
+            # Recorrer los segmentos JPEG hasta el marcador SOFn
+            offset = 2
+            while offset + 9 < len(data):
+                if data[offset] != 0xFF:
+                    offset += 1
+                    continue
+                marker = data[offset + 1]
+                if marker in (0xD8, 0x01) or 0xD0 <= marker <= 0xD7:
+                    offset += 2
+                    continue
+                length = struct.unpack(">H", data[offset + 2:offset + 4])[0]
+                if 0xC0 <= marker <= 0xCF and marker not in (0xC4, 0xC8, 0xCC):
+                    height, width = struct.unpack(">HH", data[offset + 5:offset + 9])
+                    return width, height
+                offset += 2 + length
+    except struct.error:
+        pass
+    return None, None
@@ -0,0 +1,281 @@
+#!/usr/bin/env python3
+"""
+Oferta en PDF compuesta en el servidor a partir de datos estructurados
+
+PdfService.generatePdf capturaba el DOM de la oferta con html2canvas a escala
+2 y pegaba la misma imagen gigante en cada página con distinto
+desplazamiento: PDFs enormes, lentos y sin texto seleccionable. Aquí la
+oferta (cliente, proyecto, productos y sus imágenes de diseño) se compone
+con bloques de alto fijo, cada página se envía apenas se termina y cada
+imagen distinta se incrusta una sola vez aunque varios productos la usen.
+"""
+
+import datetime
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+from pdf_writer import (
+    A4_HEIGHT, A4_WIDTH, FONT_BOLD, FONT_REGULAR, PageCanvas, PdfStreamWriter, fit_text, text_width, wrap_text
+)
+
+MARGIN = 36
+CONTENT_WIDTH = A4_WIDTH - 2 * MARGIN
+HEADER_HEIGHT = 78
+FOOTER_HEIGHT = 24
+PRODUCT_HEIGHT = 196
+PRODUCT_GAP = 10
+SUMMARY_HEIGHT = 118
+
+IMAGE_BOX_WIDTH = 190
+IMAGE_BOX_HEIGHT = 112
+OBSERVATION_LINES = 3
+VALIDITY_DAYS = 30
+MAX_PRODUCTS = 20000
+
+BRAND_COLOR = (0.12, 0.22, 0.39)
+RED = (0.75, 0.1, 0.1)
+GREY = (0.5, 0.5, 0.5)
+LIGHT_GREY = (0.93, 0.93, 0.93)
+BORDER = (0.75, 0.75, 0.75)
+WHITE = (1, 1, 1)
+
+# Nombres de campo del componente de la oferta y sus equivalentes del producto importado
+FIELD_ALIASES = {
+    "ancho": ("ancho_diseno", "ancho_m", "ancho"),
+    "alto": ("alto_diseno", "alto_m", "alto"),
+    "cantidad": ("cantidad", "cantidad_por_unidad"),
+    "precio_unitario": ("precio_unitario", "precio_unitario_usd"),
+    "precio_total": ("precio_total", "precio_total_pieza_usd"),
+    "tipo_perfil": ("tipo_perfil", "perfil_mm"),
+    "espesor_vidrio": ("espesor_vidrio", "espesor_vidrio_mm"),
+    "color_estructura": ("color_estructura", "color_body"),
+    "tipo_apertura": ("tipo_apertura", "apertura"),
+}
+
+# Obtiene (clave de contenido, bytes) de la imagen de diseño de un producto
+ImageSource = Callable[[Dict[str, Any]], Optional[Tuple[str, bytes]]]
+
+
+def field(product: Dict[str, Any], name: str) -> Any:
+    for key in FIELD_ALIASES.get(name, (name,)):
+        value = product.get(key)
+        if value not in (None, ""):
+            return value
+    return None
+
+
+def as_number(value: Any) -> Optional[float]:
+    if isinstance(value, bool) or value is None:
+        return None
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def format_amount(value: Any) -> str:
+    """Número con formato es-CL: 1.234,50"""
+    number = as_number(value) or 0.0
+    return f"{number:,.2f}".replace(",", "_").replace(".", ",").replace("_", ".")
+
+
+def format_quantity(value: Any) -> str:
+    number = as_number(value)
+    if number is None:
+        return "0"
+    return str(int(number)) if number.is_integer() else format_amount(number)
+
+
+def dimension_text(product: Dict[str, Any]) -> str:
+    ancho, alto = as_number(field(product, "ancho")), as_number(field(product, "alto"))
+    if not ancho and not alto:
+        return "N/A"
+    return " x ".join(f"{value:.2f}m" if value else "" for value in (ancho, alto))
+
+
+def glass_details(product: Dict[str, Any]) -> str:
+    details = [field(product, name) for name in
+               ("material", "espesor_vidrio", "color_estructura", "tipo_vidrio", "tipo_apertura")]
+    return "; ".join(str(detail) for detail in details if detail).upper()
+
+
+def parse_offer(offer: Any) -> Dict[str, Any]:
+    """Valida la forma del cuerpo de la oferta; lanza ValueError"""
+    if not isinstance(offer, dict):
+        raise ValueError("La oferta debe ser un objeto JSON")
+    products = offer.get("productos")
+    if not isinstance(products, list) or not products:
+        raise ValueError("La oferta requiere una lista 'productos' no vacía")
+    if len(products) > MAX_PRODUCTS:
+        raise ValueError(f"La oferta supera el máximo de {MAX_PRODUCTS} productos")
+    if not all(isinstance(product, dict) for product in products):
+        raise ValueError("Cada producto debe ser un objeto")
+    for key in ("cliente", "cubicacion"):
+        if offer.get(key) is not None and not isinstance(offer[key], dict):
+            raise ValueError(f"'{key}' debe ser un objeto")
+    return offer
+
+
+def paginate(product_count: int) -> List[Tuple[int, int]]:
+    """
+    Tramos [desde, hasta) de productos por página. El alto de cada bloque es
+    fijo, así que el total de páginas se conoce antes de componer ninguna.
+    La última página lleva además el resumen.
+    """
+    block = PRODUCT_HEIGHT + PRODUCT_GAP
+    first_capacity = int((A4_HEIGHT - 2 * MARGIN - HEADER_HEIGHT - FOOTER_HEIGHT) // block)
+    capacity = int((A4_HEIGHT - 2 * MARGIN - FOOTER_HEIGHT) // block)
+
+    pages = []
+    start = 0
+    page_capacity = first_capacity
+    while start < product_count:
+        end = min(product_count, start + page_capacity)
+        pages.append((start, end))
+        start = end
+        page_capacity = capacity
+
+    # ¿Cabe el resumen bajo los productos de la última página?
+    last_start, last_end = pages[-1]
+    used = (HEADER_HEIGHT if len(pages) == 1 else 0) + (last_end - last_start) * block
+    if used + SUMMARY_HEIGHT > A4_HEIGHT - 2 * MARGIN - FOOTER_HEIGHT:
+        pages.append((product_count, product_count))
+    return pages
+
+
+class OfferRenderer:
+    """Compone la oferta página por página sobre un PdfStreamWriter"""
+
+    def __init__(self, offer: Dict[str, Any], image_source: Optional[ImageSource] = None):
+        self.offer = offer
+        self.products: List[Dict[str, Any]] = offer["productos"]
+        self.image_source = image_source
+        self.client = offer.get("cliente") or {}
+        self.quote = offer.get("cubicacion") or {}
+        self.date = offer.get("fecha") or datetime.date.today().strftime("%d/%m/%Y")
+        self.writer = PdfStreamWriter(title=self.file_title())
+
+    def file_title(self) -> str:
+        return f"Oferta {self.client.get('nombre') or 'Cliente'} {self.quote.get('codigo') or ''}".strip()
+
+    def render(self) -> Iterator[bytes]:
+        pages = paginate(len(self.products))
+        for page_number, (start, end) in enumerate(pages, 1):
+            canvas = PageCanvas()
+            top = MARGIN
+            if page_number == 1:
+                self.draw_header(canvas, top)
+                top += HEADER_HEIGHT
+            for product in self.products[start:end]:
+                self.draw_product(canvas, top, product)
+                top += PRODUCT_HEIGHT + PRODUCT_GAP
+            if page_number == len(pages):
+                self.draw_summary(canvas, top)
+            self.draw_footer(canvas, page_number, len(pages))
+            self.writer.add_page(canvas)
+            yield self.writer.drain()
+        yield self.writer.close()
+
+    def draw_header(self, canvas: PageCanvas, top: float):
+        canvas.rect(MARGIN, top, CONTENT_WIDTH, HEADER_HEIGHT - 14, fill=BRAND_COLOR)
+        canvas.text(MARGIN + 14, top + 12, "Oferta del Cliente", FONT_BOLD, 16, WHITE)
+        client_line = " - ".join(
+            str(value) for value in (self.client.get("nombre"), self.quote.get("proyecto")) if value
+        )
+        canvas.text(MARGIN + 14, top + 34, fit_text(client_line, FONT_REGULAR, 10, CONTENT_WIDTH - 28),
+                    FONT_REGULAR, 10, WHITE)
+        canvas.text(MARGIN + 14, top + 48,
+                    f"Proyecto: {self.quote.get('nombre') or '-'} / Fecha: {self.date}", FONT_REGULAR, 9, WHITE)
+
+    def draw_product(self, canvas: PageCanvas, top: float, product: Dict[str, Any]):
+        left, right = MARGIN, MARGIN + CONTENT_WIDTH
+        canvas.rect(left, top, CONTENT_WIDTH, PRODUCT_HEIGHT, stroke=BORDER)
+        canvas.rect(left, top, CONTENT_WIDTH, 18, fill=BRAND_COLOR)
+        title = str(product.get("codigo") or f"Producto {product.get('id', '')}".strip())
+        canvas.text(left + 8, top + 4, fit_text(title, FONT_BOLD, 10, CONTENT_WIDTH - 16), FONT_BOLD, 10, WHITE)
+
+        label_x, value_x = left + 8, left + 110
+        value_width = right - value_x - 8
+        rows = [
+            ("Dimensiones:", dimension_text(product), (0, 0, 0)),
+            ("Serie de Perfiles:", str(field(product, "tipo_perfil") or "").upper(), RED),
+            ("Vidrios:", glass_details(product), (0, 0, 0)),
+        ]
+        row_top = top + 24
+        for label, value, color in rows:
+            canvas.text(label_x, row_top, label, FONT_BOLD, 8, color)
+            canvas.text(value_x, row_top, fit_text(value, FONT_REGULAR, 8, value_width), FONT_REGULAR, 8, color)
+            row_top += 13
+
+        image_top = row_top + 4
+        self.draw_image(canvas, product, left + 8, image_top, IMAGE_BOX_WIDTH, IMAGE_BOX_HEIGHT)
+
+        detail_x = left + IMAGE_BOX_WIDTH + 22
+        canvas.rect(detail_x, image_top, right - detail_x - 8, 14, fill=LIGHT_GREY)
+        canvas.text(detail_x + 6, image_top + 3, "Detalle", FONT_BOLD, 8)
+        superficie = format_amount(product.get("superficie_total"))
+        details = [
+            ("Precio unitario", f"${format_amount(field(product, 'precio_unitario'))} USD", FONT_REGULAR, (0, 0, 0)),
+            ("Cantidad", f"{superficie} m² ({format_quantity(field(product, 'cantidad'))} Pzas.)", FONT_REGULAR, RED),
+            ("Valor Neto Total", f"${format_amount(field(product, 'precio_total'))} USD", FONT_BOLD, (0, 0, 0)),
+        ]
+        detail_top = image_top + 20
+        for label, value, font, color in details:
+            canvas.text(detail_x + 6, detail_top, label, FONT_REGULAR, 8, color)
+            canvas.text_right(right - 14, detail_top, value, font, 8, color)
+            detail_top += 14
+
+        observations = product.get("observaciones") or "SIN OBSERVACIONES"
+        lines = wrap_text(observations, FONT_REGULAR, 7.5, right - detail_x - 20, OBSERVATION_LINES)
+        for line in lines:
+            detail_top += 11
+            canvas.text(detail_x + 6, detail_top, line, FONT_REGULAR, 7.5, GREY)
+
+    def draw_image(self, canvas: PageCanvas, product: Dict[str, Any], x: float, top: float,
+                   width: float, height: float):
+        canvas.rect(x, top, width, height, stroke=BORDER)
+        image = None
+        source = self.image_source(product) if self.image_source else None
+        if source is not None:
+            image = self.writer.image(*source)
+        if image is None:
+            canvas.text(x + width / 2 - text_width("Sin imagen", FONT_REGULAR, 8) / 2, top + height / 2 - 4,
+                        "Sin imagen", FONT_REGULAR, 8, GREY)
+            return
+
+        # Ajustar dentro del recuadro conservando la proporción
+        name, object_id, pixel_width, pixel_height = image
+        scale = min((width - 6) / pixel_width, (height - 6) / pixel_height)
+        draw_width, draw_height = pixel_width * scale, pixel_height * scale
+        canvas.image(name, object_id, x + (width - draw_width) / 2, top + (height - draw_height) / 2,
+                     draw_width, draw_height)
+
+    def draw_summary(self, canvas: PageCanvas, top: float):
+        total_surface = sum(as_number(product.get("superficie_total")) or 0 for product in self.products)
+        total_pieces = sum(as_number(field(product, "cantidad")) or 0 for product in self.products)
+        total_amount = sum(as_number(field(product, "precio_total")) or 0 for product in self.products)
+
+        canvas.text(MARGIN, top + 4, "Resumen Total", FONT_BOLD, 12, BRAND_COLOR)
+        rows = [
+            ("Total Superficie:", f"{format_amount(total_surface)} m²", FONT_REGULAR),
+            ("Total Piezas:", f"{format_quantity(total_pieces)} Pzas.", FONT_REGULAR),
+            ("Valor Total Neto:", f"${format_amount(total_amount)} USD", FONT_BOLD),
+        ]
+        row_top = top + 24
+        for label, value, font in rows:
+            canvas.rect(MARGIN, row_top, CONTENT_WIDTH, 18, stroke=BORDER,
+                        fill=LIGHT_GREY if font == FONT_BOLD else None)
+            canvas.text(MARGIN + 8, row_top + 5, label, font, 9)
+            canvas.text_right(MARGIN + CONTENT_WIDTH - 8, row_top + 5, value, font, 9)
+            row_top += 18
+        canvas.text(MARGIN, row_top + 12,
+                    f"Oferta válida por {VALIDITY_DAYS} días a partir de la fecha de emisión",
+                    FONT_REGULAR, 8, GREY)
+
+    def draw_footer(self, canvas: PageCanvas, page_number: int, page_count: int):
+        canvas.text_right(A4_WIDTH - MARGIN, A4_HEIGHT - MARGIN - 8, f"Página {page_number}/{page_count}",
+                          FONT_REGULAR, 8, GREY)
+
+
+def render_offer_pdf(offer: Dict[str, Any], image_source: Optional[ImageSource] = None) -> Iterator[bytes]:
+    """Bytes del PDF por página, listos para una StreamingResponse"""
+    return OfferRenderer(offer, image_source).render()
@@ -0,0 +1,429 @@
+#!/usr/bin/env python3
+"""
+Escritor de PDF incremental con imágenes compartidas
+
+Cada página se escribe apenas se termina de componer y su salida queda lista
+para enviarse (drain), así que la memoria no crece con la cantidad de páginas:
+solo se recuerdan los números de objeto de páginas e imágenes. Cada imagen
+distinta se incrusta una sola vez como XObject y las páginas la referencian.
+Los PNG sin transparencia y los JPEG se copian sin recomprimir (IDAT con
+predictor PNG y DCTDecode); el resto se convierte con Pillow si está
+instalado. El texto usa las fuentes estándar Helvetica (texto real,
+seleccionable) con codificación WinAnsi.
+"""
+
+import io
+import struct
+import unicodedata
+import zlib
+from typing import Dict, List, Optional, Tuple
+
+try:
+    from PIL import Image as PILImage
+    PIL_AVAILABLE = True
+except ImportError:  # Sin Pillow solo se incrustan PNG y JPEG compatibles
+    PILImage = None
+    PIL_AVAILABLE = False
+
+# A4 en puntos
+A4_WIDTH = 595.28
+A4_HEIGHT = 841.89
+
+FONT_REGULAR = "F1"
+FONT_BOLD = "F2"
+STANDARD_FONTS = {FONT_REGULAR: "Helvetica", FONT_BOLD: "Helvetica-Bold"}
+
+# Anchos AFM (1/1000 em) de los caracteres ASCII 32-126
+_HELVETICA_WIDTHS = [
+    278, 278, 355, 556, 556, 889, 667, 191, 333, 333, 389, 584, 278, 333, 278, 278,
+    556, 556, 556, 556, 556, 556, 556, 556, 556, 556, 278, 278, 584, 584, 584, 556,
+    1015, 667, 667, 722, 722, 667, 611, 778, 722, 278, 500, 667, 556, 833, 722, 778,
+    667, 778, 722, 667, 611, 722, 667, 944, 667, 667, 611, 278, 278, 278, 469, 556,
+    333, 556, 556, 500, 556, 556, 278, 556, 556, 222, 222, 500, 222, 833, 556, 556,
+    556, 556, 333, 500, 278, 556, 500, 722, 500, 500, 500, 334, 260, 334, 584,
+]
+_HELVETICA_BOLD_WIDTHS = [
+    278, 333, 474, 556, 556, 889, 722, 238, 333, 333, 389, 584, 278, 333, 278, 278,
+    556, 556, 556, 556, 556, 556, 556, 556, 556, 556, 333, 333, 584, 584, 584, 611,
+    975, 722, 722, 722, 722, 667, 611, 778, 722, 278, 556, 722, 611, 833, 722, 778,
+    667, 778, 722, 667, 611, 722, 667, 944, 667, 667, 611, 333, 278, 333, 584, 556,
+    333, 556, 611, 556, 611, 556, 333, 611, 611, 278, 278, 556, 278, 889, 611, 611,
+    611, 611, 389, 556, 333, 611, 556, 778, 556, 556, 500, 389, 280, 389, 584,
+]
+FONT_WIDTHS = {FONT_REGULAR: _HELVETICA_WIDTHS, FONT_BOLD: _HELVETICA_BOLD_WIDTHS}
+DEFAULT_CHAR_WIDTH = 556
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+_PNG_COLORS = {0: 1, 2: 3, 3: 1}
+_JPEG_COLOR_SPACES = {1: "/DeviceGray", 3: "/DeviceRGB"}
+
+
+def _char_width(char: str, widths: List[int]) -> int:
+    code = ord(char)
+    if 32 <= code <= 126:
+        return widths[code - 32]
+    # Letras acentuadas: mismo ancho que la letra base
+    base = unicodedata.normalize("NFKD", char)[:1]
+    if base and 32 <= ord(base) <= 126:
+        return widths[ord(base) - 32]
+    return DEFAULT_CHAR_WIDTH
+
+
+def text_width(text: str, font: str, size: float) -> float:
+    """Ancho en puntos de un texto en una de las fuentes estándar"""
+    widths = FONT_WIDTHS[font]
+    return sum(_char_width(char, widths) for char in text) * size / 1000.0
+
+
+def _ellipsize(text: str, font: str, size: float, width: float) -> str:
+    while text and text_width(text + "...", font, size) > width:
+        text = text[:-1]
+    return text + "..."
+
+
+def wrap_text(text: str, font: str, size: float, width: float, max_lines: int) -> List[str]:
+    """
+    Corta el texto en líneas por palabras. Las líneas que no caben (una
+    palabra más ancha que el espacio) y la última, si sobra texto, terminan
+    en '...'.
+    """
+    lines: List[str] = []
+    current = ""
+    for word in str(text).split():
+        candidate = f"{current} {word}" if current else word
+        if current and text_width(candidate, font, size) > width:
+            lines.append(current)
+            current = word
+        else:
+            current = candidate
+    if current:
+        lines.append(current)
+
+    overflow = len(lines) > max_lines
+    lines = lines[:max_lines]
+    for index, line in enumerate(lines):
+        if text_width(line, font, size) > width or (overflow and index == len(lines) - 1):
+            lines[index] = _ellipsize(line, font, size, width)
+    return lines
+
+
+def fit_text(text: str, font: str, size: float, width: float) -> str:
+    """Texto en una sola línea, recortado con '...' si no cabe"""
+    lines = wrap_text(text, font, size, width, 1)
+    return lines[0] if lines else ""
+
+
+def pdf_string(text: str) -> bytes:
+    """Literal de cadena PDF en WinAnsi (cp1252); lo que no existe en cp1252 queda como '?'"""
+    raw = text.encode("cp1252", errors="replace")
+    raw = raw.replace(b"\\", b"\\\\").replace(b"(", b"\\(").replace(b")", b"\\)")
+    raw = raw.replace(b"\r", b" ").replace(b"\n", b" ")
+    return b"(" + raw + b")"
+
+
+def _number(value: float) -> str:
+    return f"{value:.2f}".rstrip("0").rstrip(".") if value != int(value) else str(int(value))
+
+
+def _png_image(data: bytes) -> Optional[Tuple[int, int, str, bytes]]:
+    """
+    (ancho, alto, entradas del diccionario, IDAT) para copiar un PNG tal cual.
+    None si el PNG necesita decodificarse (alfa, entrelazado, 16 bits, tRNS).
+    """
+    if not data.startswith(PNG_SIGNATURE):
+        return None
+    position = len(PNG_SIGNATURE)
+    header = None
+    palette = b""
+    idat = []
+    while position + 8 <= len(data):
+        length, chunk_type = struct.unpack(">I4s", data[position:position + 8])
+        chunk = data[position + 8:position + 8 + length]
+        position += 12 + length
+        if chunk_type == b"IHDR":
+            header = struct.unpack(">IIBBBBB", chunk)
+        elif chunk_type == b"PLTE":
+            palette = chunk
+        elif chunk_type == b"tRNS":
+            return None
+        elif chunk_type == b"IDAT":
+            idat.append(chunk)
+        elif chunk_type == b"IEND":
+            break
+
+    if header is None or not idat:
+        return None
+    width, height, bit_depth, color_type, _, _, interlace = header
+    if interlace or bit_depth > 8 or color_type not in _PNG_COLORS:
+        return None
+
+    if color_type == 3:
+        if not palette:
+            return None
+        color_space = f"[/Indexed /DeviceRGB {len(palette) // 3 - 1} <{palette.hex()}>]"
+    else:
+        color_space = "/DeviceGray" if color_type == 0 else "/DeviceRGB"
+    entries = (
+        f"/ColorSpace {color_space} /BitsPerComponent {bit_depth} /Filter /FlateDecode "
+        f"/DecodeParms << /Predictor 15 /Colors {_PNG_COLORS[color_type]} "
+        f"/BitsPerComponent {bit_depth} /Columns {width} >>"
+    )
+    return width, height, entries, b"".join(idat)
+
+
+def _jpeg_image(data: bytes) -> Optional[Tuple[int, int, str, bytes]]:
+    """(ancho, alto, entradas, datos) de un JPEG en escala de grises o RGB"""
+    if not data.startswith(b"\xff\xd8"):
+        return None
+    position = 2
+    while position + 4 <= len(data):
+        if data[position] != 0xFF:
+            return None
+        marker = data[position + 1]
+        length = struct.unpack(">H", data[position + 2:position + 4])[0]
+        # SOF0-SOF15 salvo DHT (C4), JPG (C8) y DAC (CC)
+        if 0xC0 <= marker <= 0xCF and marker not in (0xC4, 0xC8, 0xCC):
+            _, height, width, components = struct.unpack(">BHHB", data[position + 4:position + 10])
+            color_space = _JPEG_COLOR_SPACES.get(components)
+            if color_space is None:
+                return None
+            return width, height, f"/ColorSpace {color_space} /BitsPerComponent 8 /Filter /DCTDecode", data
+        position += 2 + length
+    return None
+
+
+def _pillow_image(data: bytes) -> Optional[Tuple[int, int, str, bytes]]:
+    """Cualquier formato que Pillow abra, aplanado sobre blanco y comprimido con Flate"""
+    if not PIL_AVAILABLE:
+        return None
+    try:
+        with PILImage.open(io.BytesIO(data)) as source:
+            source.load()
+            if source.mode in ("RGBA", "LA", "P", "PA"):
+                rgba = source.convert("RGBA")
+                image = PILImage.new("RGB", rgba.size, (255, 255, 255))
+                image.paste(rgba, mask=rgba.getchannel("A"))
+            else:
+                image = source.convert("RGB")
+    except Exception:
+        return None
+    width, height = image.size
+    entries = "/ColorSpace /DeviceRGB /BitsPerComponent 8 /Filter /FlateDecode"
+    return width, height, entries, zlib.compress(image.tobytes(), 6)
+
+
+class PageCanvas:
+    """Operadores de contenido de una página con coordenadas desde arriba a la izquierda"""
+
+    def __init__(self, width: float = A4_WIDTH, height: float = A4_HEIGHT):
+        self.width = width
+        self.height = height
+        self.images: Dict[str, int] = {}
+        self._ops: List[bytes] = []
+
+    def text(self, x: float, top: float, text: str, font: str = FONT_REGULAR, size: float = 9,
+             color: Tuple[float, float, float] = (0, 0, 0)):
+        """Texto con la línea base a 'size' puntos bajo top"""
+        if not text:
+            return
+        baseline = self.height - top - size
+        self._ops.append(
+            b"BT %s rg /%s %s Tf %s %s Td %s Tj ET" % (
+                " ".join(_number(c) for c in color).encode(), font.encode(), _number(size).encode(),
+                _number(x).encode(), _number(baseline).encode(), pdf_string(text)
+            )
+        )
+
+    def text_right(self, right: float, top: float, text: str, font: str = FONT_REGULAR, size: float = 9,
+                   color: Tuple[float, float, float] = (0, 0, 0)):
+        self.text(right - text_width(text, font, size), top, text, font, size, color)
+
+    def rect(self, x: float, top: float, width: float, height: float,
+             fill: Optional[Tuple[float, float, float]] = None,
+             stroke: Optional[Tuple[float, float, float]] = None, line_width: float = 0.5):
+        ops = []
+        if fill is not None:
+            ops.append(" ".join(_number(c) for c in fill) + " rg")
+        if stroke is not None:
+            ops.append(" ".join(_number(c) for c in stroke) + f" RG {_number(line_width)} w")
+        ops.append(f"{_number(x)} {_number(self.height - top - height)} {_number(width)} {_number(height)} re")
+        ops.append("B" if fill is not None and stroke is not None else ("f" if fill is not None else "S"))
+        self._ops.append(" ".join(ops).encode())
+
+    def line(self, x1: float, top1: float, x2: float, top2: float,
+             color: Tuple[float, float, float] = (0, 0, 0), line_width: float = 0.5):
+        self._ops.append(
+            f"{' '.join(_number(c) for c in color)} RG {_number(line_width)} w "
+            f"{_number(x1)} {_number(self.height - top1)} m {_number(x2)} {_number(self.height - top2)} l S".encode()
+        )
+
+    def image(self, name: str, object_id: int, x: float, top: float, width: float, height: float):
+        self.images[name] = object_id
+        self._ops.append(
+            f"q {_number(width)} 0 0 {_number(height)} {_number(x)} "
+            f"{_number(self.height - top - height)} cm /{name} Do Q".encode()
+        )
+
+    def form(self, name: str, object_id: int, x: float, top: float):
+        """XObject de formulario (ver PdfStreamWriter.text_form) con su esquina superior izquierda en x, top"""
+        self.images[name] = object_id
+        self._ops.append(f"q 1 0 0 1 {_number(x)} {_number(self.height - top)} cm /{name} Do Q".encode())
+
+    def content(self) -> bytes:
+        return b"\n".join(self._ops)
+
+
+# (ancho, alto, contenido comprimido, {nombre de imagen: objeto}); se puede serializar con pickle
+RenderedPage = Tuple[float, float, bytes, Dict[str, int]]
+
+
+def render_page(canvas: PageCanvas) -> RenderedPage:
+    """Comprime el contenido de una página para agregarla después con add_rendered_page"""
+    return canvas.width, canvas.height, zlib.compress(canvas.content(), 6), dict(canvas.images)
+
+
+class PdfStreamWriter:
+    """
+    Escribe un PDF por partes: imágenes y páginas se agregan en orden y drain()
+    devuelve los bytes producidos desde la llamada anterior.
+    """
+
+    def __init__(self, title: str = ""):
+        self._pending: List[bytes] = []
+        self._offset = 0
+        self._offsets: Dict[int, int] = {}
+        self._next_id = 1
+        self._page_ids: List[int] = []
+        # Imágenes ya incrustadas: clave de contenido -> (nombre, objeto, ancho, alto)
+        self._images: Dict[str, Optional[Tuple[str, int, int, int]]] = {}
+        self.title = title
+
+        self.pages_id = self._reserve()
+        self.catalog_id = self._reserve()
+        self._write(b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n")
+        self._font_ids = {}
+        for name, base_font in STANDARD_FONTS.items():
+            font_id = self._reserve()
+            self._write_object(
+                font_id,
+                f"<< /Type /Font /Subtype /Type1 /BaseFont /{base_font} /Encoding /WinAnsiEncoding >>".encode()
+            )
+            self._font_ids[name] = font_id
+
+    @property
+    def page_count(self) -> int:
+        return len(self._page_ids)
+
+    @property
+    def image_count(self) -> int:
+        return sum(1 for image in self._images.values() if image is not None)
+
+    def _reserve(self) -> int:
+        object_id = self._next_id
+        self._next_id += 1
+        return object_id
+
+    def _write(self, data: bytes):
+        self._pending.append(data)
+        self._offset += len(data)
+
+    def _write_object(self, object_id: int, body: bytes):
+        self._offsets[object_id] = self._offset
+        self._write(b"%d 0 obj\n%s\nendobj\n" % (object_id, body))
+
+    def _write_stream(self, object_id: int, entries: str, data: bytes):
+        self._offsets[object_id] = self._offset
+        self._write(b"%d 0 obj\n<< %s /Length %d >>\nstream\n" % (object_id, entries.encode(), len(data)))
+        self._write(data)
+        self._write(b"\nendstream\nendobj\n")
+
+    def image(self, key: str, data: bytes) -> Optional[Tuple[str, int, int, int]]:
+        """
+        Incrusta la imagen la primera vez que aparece su clave (p. ej. el hash
+        de contenido) y devuelve (nombre, objeto, ancho px, alto px); None si
+        el formato no se puede incrustar.
+        """
+        if key in self._images:
+            return self._images[key]
+
+        decoded = _png_image(data) or _jpeg_image(data) or _pillow_image(data)
+        if decoded is None:
+            self._images[key] = None
+            return None
+        width, height, entries, stream = decoded
+        object_id = self._reserve()
+        self._write_stream(
+            object_id, f"/Type /XObject /Subtype /Image /Width {width} /Height {height} {entries}", stream
+        )
+        image = (f"Im{len(self._images) + 1}", object_id, width, height)
+        self._images[key] = image
+        return image
+
+    def text_form(self) -> Tuple[str, int]:
+        """
+        Reserva un XObject de formulario para un texto que recién se conoce al
+        final (p. ej. el total de páginas). Las páginas lo dibujan con
+        PageCanvas.form y el contenido se escribe con write_text_form antes de close().
+        """
+        object_id = self._reserve()
+        return f"Fm{object_id}", object_id
+
+    def write_text_form(self, object_id: int, text: str, font: str = FONT_REGULAR, size: float = 9,
+                        color: Tuple[float, float, float] = (0, 0, 0)):
+        """Texto del formulario reservado, con la línea base a 'size' puntos bajo su origen"""
+        content = b"BT %s rg /%s %s Tf 0 %s Td %s Tj ET" % (
+            " ".join(_number(c) for c in color).encode(), font.encode(), _number(size).encode(),
+            _number(-size).encode(), pdf_string(text)
+        )
+        width = text_width(text, font, size)
+        self._write_stream(object_id, (
+            f"/Type /XObject /Subtype /Form /BBox [0 {_number(-1.5 * size)} {_number(width)} 0] "
+            f"/Resources << /Font << /{font} {self._font_ids[font]} 0 R >> >>"
+        ), content)
+
+    def add_page(self, canvas: PageCanvas):
+        """Escribe el contenido (comprimido) y el objeto de la página"""
+        self.add_rendered_page(render_page(canvas))
+
+    def add_rendered_page(self, page: "RenderedPage"):
+        """Agrega una página compuesta con render_page (p. ej. en otro proceso)"""
+        width, height, content, page_images = page
+        content_id = self._reserve()
+        self._write_stream(content_id, "/Filter /FlateDecode", content)
+
+        fonts = " ".join(f"/{name} {object_id} 0 R" for name, object_id in self._font_ids.items())
+        images = " ".join(f"/{name} {object_id} 0 R" for name, object_id in page_images.items())
+        page_id = self._reserve()
+        self._write_object(page_id, (
+            f"<< /Type /Page /Parent {self.pages_id} 0 R "
+            f"/MediaBox [0 0 {_number(width)} {_number(height)}] "
+            f"/Resources << /Font << {fonts} >> /XObject << {images} >> >> "
+            f"/Contents {content_id} 0 R >>"
+        ).encode())
+        self._page_ids.append(page_id)
+
+    def drain(self) -> bytes:
+        data = b"".join(self._pending)
+        self._pending = []
+        return data
+
+    def close(self) -> bytes:
+        """Escribe el árbol de páginas, el catálogo, la tabla xref y el trailer"""
+        kids = " ".join(f"{page_id} 0 R" for page_id in self._page_ids)
+        self._write_object(
+            self.pages_id, f"<< /Type /Pages /Kids [{kids}] /Count {len(self._page_ids)} >>".encode()
+        )
+        self._write_object(self.catalog_id, f"<< /Type /Catalog /Pages {self.pages_id} 0 R >>".encode())
+        info_id = self._reserve()
+        self._write_object(info_id, b"<< /Title %s /Producer (excel-image-extractor) >>" % pdf_string(self.title))
+
+        xref_offset = self._offset
+        lines = [b"xref", b"0 %d" % self._next_id, b"0000000000 65535 f "]
+        for object_id in range(1, self._next_id):
+            lines.append(b"%010d 00000 n " % self._offsets[object_id])
+        self._write(b"\n".join(lines) + b"\n")
+        self._write(
+            b"trailer\n<< /Size %d /Root %d 0 R /Info %d 0 R >>\nstartxref\n%d\n%%%%EOF\n"
+            % (self._next_id, self.catalog_id, info_id, xref_offset)
+        )
+        return self.drain()
@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+"""
+Miniaturas y versiones reducidas (renditions) de las imágenes extraídas
+
+Las tablas de productos solo muestran vistas previas pequeñas, así que el
+servicio puede generar copias reducidas en WebP o JPEG para que el navegador no
+tenga que decodificar y escalar los originales. Requiere Pillow (opcional).
+"""
+
+import io
+from typing import Dict, List, Any
+
+try:
+    from PIL import Image as PILImage
+    PIL_AVAILABLE = True
+except ImportError:  # Pillow no instalado: las renditions quedan deshabilitadas
+    PILImage = None
+    PIL_AVAILABLE = False
+
+RENDITION_FORMATS = {
+    "webp": {"pil_format": "WEBP", "mime_type": "image/webp", "extension": ".webp"},
+    "jpeg": {"pil_format": "JPEG", "mime_type": "image/jpeg", "extension": ".jpg"},
+}
+DEFAULT_RENDITION_FORMAT = "webp"
+MAX_RENDITION_SIZE = 4096
+
+
+def parse_rendition_sizes(value: str) -> List[int]:
+    """Convierte '64,256,1024' en [64, 256, 1024] validando cada tamaño"""
+    sizes = []
+    for part in (value or "").split(","):
+        part = part.strip()
+        if not part:
+            continue
+        size = int(part)
+        if size <= 0 or size > MAX_RENDITION_SIZE:
+            raise ValueError(f"Tamaño de rendition fuera de rango (1-{MAX_RENDITION_SIZE}): {size}")
+        sizes.append(size)
+    return sorted(set(sizes))
+
+
+def render_renditions(data: bytes, sizes: List[int], rendition_format: str = DEFAULT_RENDITION_FORMAT,
+                      quality: int = 80) -> List[Dict[str, Any]]:
+    """
+    Genera una versión por tamaño con el lado mayor limitado a ese tamaño.
+    Nunca se amplía la imagen: si el original es más chico se recodifica a su
+    tamaño. Pensado para ejecutarse en el pool de procesos.
+    """
+    if not PIL_AVAILABLE:
+        raise RuntimeError("Pillow no está instalado: no se pueden generar renditions")
+
+    spec = RENDITION_FORMATS[rendition_format]
+    renditions = []
+
+    with PILImage.open(io.BytesIO(data)) as original:
+        original.load()
+        source = original
+        if spec["pil_format"] == "JPEG" and source.mode not in ("RGB", "L"):
+            # JPEG no admite transparencia: componer sobre fondo blanco
+            background = PILImage.new("RGB", source.size, "white")
+            rgba = source.convert("RGBA")
+            background.paste(rgba, mask=rgba.split()[-1])
+            source = background
+        elif source.mode not in ("RGB", "RGBA", "L"):
+            source = source.convert("RGBA")
+
+        for size in sizes:
+            copy = source.copy()
+            copy.thumbnail((size, size), PILImage.LANCZOS)
+            buffer = io.BytesIO()
+            copy.save(buffer, format=spec["pil_format"], quality=quality)
+            encoded = buffer.getvalue()
+            renditions.append({
+                "size": size,
+                "width": copy.width,
+                "height": copy.height,
+                "mimeType": spec["mime_type"],
+                "extension": spec["extension"],
+                "bytes": len(encoded),
+                "data": encoded,
+            })
+
+    return renditions
@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+"""
+Formatos de respuesta alternativos para /extract-images
+
+Además del JSON con base64 (formato por defecto), el cliente puede pedir por
+cabecera Accept:
+- multipart/mixed: primera parte con el manifiesto JSON y luego una parte con
+  los bytes crudos de cada imagen (Content-ID = blobId)
+- application/zip: manifest.json y las imágenes en images/, guardadas sin
+  comprimir porque PNG/JPEG ya vienen comprimidos
+- application/x-ndjson: una línea JSON por imagen a medida que se extrae,
+  precedida por una cabecera y seguida de un resumen final
+"""
+
+import json
+import uuid
+import zipfile
+from typing import Dict, Any, Iterator
+
+from zip_utils import ChunkSink
+
+FORMAT_JSON = "json"
+FORMAT_MULTIPART = "multipart"
+FORMAT_ZIP = "zip"
+FORMAT_NDJSON = "ndjson"
+
+MEDIA_TYPE_MULTIPART = "multipart/mixed"
+MEDIA_TYPE_ZIP = "application/zip"
+MEDIA_TYPE_NDJSON = "application/x-ndjson"
+
+
+# Tipos que el cliente tiene que nombrar en Accept, en orden de preferencia ante
+# igual calidad; JSON es el formato por defecto y el único que aceptan los comodines
+FORMAT_MEDIA_TYPES = [
+    (FORMAT_NDJSON, (MEDIA_TYPE_NDJSON, "application/ndjson")),
+    (FORMAT_ZIP, (MEDIA_TYPE_ZIP,)),
+    (FORMAT_MULTIPART, (MEDIA_TYPE_MULTIPART,)),
+    (FORMAT_JSON, ("application/json", "application/*", "*/*")),
+]
+
+
+def parse_accept(accept_header: str) -> Dict[str, float]:
+    """Rangos de la cabecera Accept -> calidad (q); los q inválidos descartan el rango"""
+    ranges: Dict[str, float] = {}
+    for item in (accept_header or "").lower().split(","):
+        media_type, *params = [part.strip() for part in item.split(";")]
+        if not media_type:
+            continue
+        quality = 1.0
+        for param in params:
+            name, _, value = param.partition("=")
+            if name.strip() == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = -1.0
+        if 0 <= quality <= 1:
+            ranges[media_type] = max(quality, ranges.get(media_type, 0.0))
+    return ranges
+
+
+def negotiate_format(accept_header: str) -> str:
+    """
+    Elige el formato de respuesta a partir de la cabecera Accept respetando
+    los q: gana el de mayor calidad y, si empatan, el primero de
+    FORMAT_MEDIA_TYPES. Un rango con q=0 excluye ese formato; sin ninguno
+    aceptable se responde JSON.
+    """
+    ranges = parse_accept(accept_header)
+    best_format, best_quality = FORMAT_JSON, 0.0
+    for response_format, media_types in FORMAT_MEDIA_TYPES:
+        # Cuenta el rango más específico que lo nombra (el primero de media_types)
+        quality = next((ranges[media_type] for media_type in media_types if media_type in ranges), 0.0)
+        if quality > best_quality:
+            best_format, best_quality = response_format, quality
+    return best_format
+
+
+def ndjson_line(payload: Dict[str, Any]) -> bytes:
+    """Serializa un objeto como una línea NDJSON"""
+    return json.dumps(payload, ensure_ascii=False).encode("utf-8") + b"\n"
+
+
+def _binary_parts(blob: Dict[str, Any]) -> Iterator[Dict[str, Any]]:
+    """Original (si se incluye) y renditions de un blob, cada uno con id, bytes y tipo"""
+    if blob.get("data") is not None:
+        yield blob
+    for rendition in blob.get("renditions", []):
+        yield rendition
+
+
+def blob_archive_name(part: Dict[str, Any]) -> str:
+    """Nombre de la imagen (o rendition) dentro del ZIP de respuesta"""
+    # Solo las renditions llevan "bytes"; los originales también tienen width/height
+    folder = "renditions" if "bytes" in part else "images"
+    return f"{folder}/{part['id']}{part['extension']}"
+
+
+def multipart_stream(manifest: Dict[str, Any], blobs: Dict[str, Dict[str, Any]], boundary: str) -> Iterator[bytes]:
+    """Genera el cuerpo multipart/mixed parte por parte"""
+    delimiter = f"--{boundary}\r\n".encode("ascii")
+
+    yield delimiter
+    yield b"Content-Type: application/json; charset=utf-8\r\n\r\n"
+    yield json.dumps(manifest, ensure_ascii=False).encode("utf-8")
+    yield b"\r\n"
+
+    for blob in blobs.values():
+        for part in _binary_parts(blob):
+            yield delimiter
+            headers = (
+                f"Content-Type: {part['mimeType']}\r\n"
+                f"Content-ID: <{part['id']}>\r\n"
+                f"Content-Length: {len(part['data'])}\r\n"
+                f"Content-Disposition: attachment; filename=\"{part['id']}{part['extension']}\"\r\n\r\n"
+            )
+            yield headers.encode("ascii")
+            yield part["data"]
+            yield b"\r\n"
+
+    yield f"--{boundary}--\r\n".encode("ascii")
+
+
+def new_boundary() -> str:
+    return f"excel-images-{uuid.uuid4().hex}"
+
+
+def zip_stream(manifest: Dict[str, Any], blobs: Dict[str, Dict[str, Any]]) -> Iterator[bytes]:
+    """
+    Genera un ZIP entrada por entrada. Como el destino no es posicionable,
+    zipfile usa descriptores de datos y cada entrada se puede emitir apenas
+    se escribe.
+    """
+    sink = ChunkSink()
+    with zipfile.ZipFile(sink, mode="w") as archive:
+        archive.writestr(
+            "manifest.json",
+            json.dumps(manifest, ensure_ascii=False),
+            compress_type=zipfile.ZIP_DEFLATED,
+        )
+        yield sink.drain()
+
+        for blob in blobs.values():
+            for part in _binary_parts(blob):
+                archive.writestr(blob_archive_name(part), part["data"], compress_type=zipfile.ZIP_STORED)
+                yield sink.drain()
+
+    yield sink.drain()
@@ -0,0 +1,190 @@
+#!/usr/bin/env python3
+"""
+Caché de resultados de extracción por hash SHA-256 de la subida
+
+Los usuarios vuelven a subir el mismo libro varias veces mientras ajustan el
+mapeo de columnas. El resultado (manifiesto + blobs crudos) se guarda en un LRU
+en memoria cuyo presupuesto se cuenta en bytes, con un nivel opcional en disco
+que recibe lo que sale de memoria.
+"""
+
+import hashlib
+import json
+import os
+import pickle
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+CACHE_HIT = "HIT"
+CACHE_HIT_DISK = "HIT-DISK"
+CACHE_MISS = "MISS"
+CACHE_BYPASS = "BYPASS"
+
+
+def result_size(value: Tuple[Dict[str, Any], Dict[str, Dict[str, Any]]]) -> int:
+    """Tamaño aproximado en bytes de (manifiesto, blobs): bytes de imagen + JSON"""
+    manifest, blobs = value
+    size = len(json.dumps(manifest, ensure_ascii=False))
+    for blob in blobs.values():
+        size += len(blob.get("data") or b"")
+        for rendition in blob.get("renditions", []):
+            size += len(rendition["data"])
+    return size
+
+
+class ResultCache:
+    """LRU con presupuesto en bytes y nivel opcional en disco"""
+
+    def __init__(self, max_bytes: int, disk_dir: Optional[str] = None, disk_max_bytes: int = 0):
+        self.max_bytes = max_bytes
+        self.disk_dir = disk_dir
+        self.disk_max_bytes = disk_max_bytes if disk_dir else 0
+        self._entries: "OrderedDict[str, Tuple[Any, int]]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.disk_evictions = 0
+        self.rejected = 0
+
+        if self.disk_dir:
+            os.makedirs(self.disk_dir, exist_ok=True)
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0 or self.disk_max_bytes > 0
+
+    @staticmethod
+    def make_key(upload_sha256: str, *options: Any) -> str:
+        """Clave = hash de la subida + opciones que cambian el resultado"""
+        suffix = hashlib.sha256(json.dumps(options, sort_keys=True, default=str).encode("utf-8")).hexdigest()[:16]
+        return f"{upload_sha256}-{suffix}"
+
+    def get(self, key: str) -> Tuple[Optional[Any], str]:
+        """Devuelve (valor, estado) donde estado es HIT, HIT-DISK o MISS"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[0], CACHE_HIT
+
+        value = self._read_disk(key)
+        if value is not None:
+            with self._lock:
+                self.disk_hits += 1
+            # Promover a memoria: vuelve a ser el más reciente
+            self._put_memory(key, value, result_size(value))
+            return value, CACHE_HIT_DISK
+
+        with self._lock:
+            self.misses += 1
+        return None, CACHE_MISS
+
+    def put(self, key: str, value: Any):
+        """Guarda un resultado; si no cabe en memoria va directo al disco"""
+        size = result_size(value)
+        if size > self.max_bytes:
+            with self._lock:
+                self.rejected += 1
+            self._write_disk(key, value, size)
+            return
+        self._put_memory(key, value, size)
+
+    def _put_memory(self, key: str, value: Any, size: int):
+        if size > self.max_bytes:
+            return
+        evicted = []
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._bytes -= previous[1]
+            self._entries[key] = (value, size)
+            self._bytes += size
+            while self._bytes > self.max_bytes and self._entries:
+                old_key, (old_value, old_size) = self._entries.popitem(last=False)
+                self._bytes -= old_size
+                self.evictions += 1
+                evicted.append((old_key, old_value, old_size))
+
+        # Lo que sale de memoria pasa al nivel en disco (fuera del lock)
+        for old_key, old_value, old_size in evicted:
+            self._write_disk(old_key, old_value, old_size)
+
+    def _disk_path(self, key: str) -> str:
+        return os.path.join(self.disk_dir, f"{key}.pkl")
+
+    def _read_disk(self, key: str) -> Optional[Any]:
+        if not self.disk_max_bytes:
+            return None
+        path = self._disk_path(key)
+        try:
+            with open(path, "rb") as cache_file:
+                value = pickle.load(cache_file)
+            os.utime(path)  # Marca de uso reciente para el LRU en disco
+            return value
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            print(f"Error leyendo caché en disco {path}: {str(e)}")
+            return None
+
+    def _write_disk(self, key: str, value: Any, size: int):
+        if not self.disk_max_bytes or size > self.disk_max_bytes:
+            return
+        path = self._disk_path(key)
+        temp_path = f"{path}.tmp"
+        try:
+            with open(temp_path, "wb") as cache_file:
+                pickle.dump(value, cache_file, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(temp_path, path)
+        except Exception as e:
+            print(f"Error escribiendo caché en disco {path}: {str(e)}")
+            return
+        self._trim_disk()
+
+    def _trim_disk(self):
+        """Borra los archivos usados hace más tiempo hasta respetar el presupuesto"""
+        entries = []
+        total = 0
+        for name in os.listdir(self.disk_dir):
+            if not name.endswith(".pkl"):
+                continue
+            path = os.path.join(self.disk_dir, name)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+            total += stat.st_size
+
+        for _, file_size, path in sorted(entries):
+            if total <= self.disk_max_bytes:
+                break
+            try:
+                os.remove(path)
+                total -= file_size
+                with self._lock:
+                    self.disk_evictions += 1
+            except FileNotFoundError:
+                pass
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "enabled": self.enabled,
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "disk_dir": self.disk_dir,
+                "disk_max_bytes": self.disk_max_bytes,
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "disk_evictions": self.disk_evictions,
+                "rejected": self.rejected,
+            }
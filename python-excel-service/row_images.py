@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+"""
+Filas de producto con sus imágenes de diseño en una sola pasada
+
+El cliente parseaba las filas con ExcelJS, llamaba aparte a /extract-images y
+luego unía row/cellAddress con cada fila: dos lecturas completas del libro y
+una unión en el navegador. Aquí el ZIP se abre una vez: los anclajes de la
+hoja se agrupan en un índice fila -> imágenes y cada fila sale ya con las
+referencias (blobId) a las imágenes de la columna de diseño ancladas en ella.
+"""
+
+import hashlib
+import os
+import zipfile
+from typing import Any, Dict, List, Optional
+
+from sheet_rows import SheetRowParser, HEADER_ROW, find_design_column
+
+
+def build_row_image_index(anchors: List[Dict[str, Any]], design_column: int):
+    """
+    Agrupa los anclajes de la columna de diseño por fila. Devuelve
+    (índice {fila: [anclajes]}, anclajes fuera de la columna o sin celda).
+    """
+    by_row: Dict[int, List[Dict[str, Any]]] = {}
+    others = []
+    for anchor in anchors:
+        if anchor["row"] and anchor["column"] == design_column and anchor["media_target"]:
+            by_row.setdefault(anchor["row"], []).append(anchor)
+        else:
+            others.append(anchor)
+    return by_row, others
+
+
+def iter_rows_with_images(zip_file: zipfile.ZipFile, header_row: int = HEADER_ROW, offset: int = 0,
+                          limit: Optional[int] = None, skip_empty: bool = True, with_colors: bool = False):
+    """
+    Produce ('header', {...}), luego por cada fila ('blob', {...}) la primera
+    vez que aparece un contenido seguido de ('row', {'row', 'values',
+    'images'}), y al final ('trailer', {...}). Los bytes de cada imagen se
+    leen del ZIP recién cuando una fila de la página la referencia.
+    """
+    parser = SheetRowParser(zip_file, header_row, with_colors=with_colors)
+    reader = parser.reader
+    sheet_part = parser.sheet["part"]
+    design_column = None
+    anchors: List[Dict[str, Any]] = []
+    row_images: Dict[int, List[Dict[str, Any]]] = {}
+    others: List[Dict[str, Any]] = []
+
+    def index_row_images(header_values: Dict[int, Any]):
+        # La fila de encabezados llega en la misma pasada que las filas de datos
+        nonlocal design_column, anchors, row_images, others
+        design_column = find_design_column(header_values)
+        anchors = reader.read_sheet_anchors(sheet_part)
+        row_images, others = build_row_image_index(anchors, design_column)
+        return row_images
+
+    names = set(zip_file.namelist())
+    blob_by_part: Dict[str, str] = {}
+    sent_blobs = set()
+    linked = 0
+
+    for kind, payload in parser.iter_rows(offset, limit, skip_empty, keep_rows=index_row_images):
+        if kind == 'header':
+            yield 'header', dict(payload, design_column=design_column, anchors=len(anchors), sheet_part=sheet_part)
+            continue
+
+        if kind == 'trailer':
+            anchored_media = {anchor["media_target"] for anchor in anchors}
+            # Mismas claves que ExcelImageExtractor.unanchored_media
+            unanchored = [
+                {
+                    'media_target': info.filename,
+                    'blob_id': blob_by_part.get(info.filename),
+                    'filename': os.path.basename(info.filename),
+                    'size': info.file_size,
+                    'extension': os.path.splitext(info.filename)[1].lower()
+                }
+                for info in zip_file.infolist()
+                if info.filename.startswith("xl/media/") and not info.is_dir()
+                and info.filename not in anchored_media
+            ]
+            yield 'trailer', dict(
+                payload,
+                linked_images=linked,
+                other_anchors=others,
+                unanchored_media=sorted(unanchored, key=lambda img: img['media_target'])
+            )
+            continue
+
+        images = []
+        for anchor in row_images.get(payload["row"], []):
+            media_target = anchor["media_target"]
+            if media_target not in names:
+                continue
+
+            blob_id = blob_by_part.get(media_target)
+            if blob_id is None:
+                data = zip_file.read(media_target)
+                blob_id = hashlib.sha256(data).hexdigest()
+                blob_by_part[media_target] = blob_id
+                if blob_id not in sent_blobs:
+                    sent_blobs.add(blob_id)
+                    yield 'blob', {
+                        'id': blob_id,
+                        'media_part': media_target,
+                        'data': data,
+                        'size': len(data),
+                        'extension': os.path.splitext(media_target)[1].lower()
+                    }
+
+            images.append({
+                'blob_id': blob_id,
+                'media_part': media_target,
+                'cell_address': anchor["cell_address"],
+                'anchor_type': anchor["anchor_type"]
+            })
+            linked += 1
+
+        yield 'row', dict(payload, images=images)
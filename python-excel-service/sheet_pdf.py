@@ -0,0 +1,315 @@
+#!/usr/bin/env python3
+"""
+Hoja DETALLE a PDF: tabla paginada con los colores y las imágenes del libro
+
+La conversión Excel -> PDF pasaba por el parseo en el navegador y una captura
+con html2canvas. Aquí la hoja se lee una sola vez (iter_rows_with_images con
+colores), los anchos salen de <cols> del mismo XML y las filas se paginan a
+medida que se leen, por filas completas y repitiendo el encabezado en cada
+página. Cada tramo de páginas se compone por separado (render_sheet_pages)
+para repartirlo en el pool de procesos mientras sigue la lectura; cada
+imagen se incrusta una vez al aparecer y los tramos solo la referencian. El
+total de páginas del pie se escribe al final como un formulario compartido.
+"""
+
+import zipfile
+from typing import Any, Dict, List, Optional, Set, Tuple
+from xml.etree.ElementTree import iterparse
+
+from drawing_anchors import NS_MAIN, _tag
+from pdf_writer import (
+    A4_HEIGHT, A4_WIDTH, FONT_BOLD, FONT_REGULAR, PageCanvas, PdfStreamWriter, RenderedPage, fit_text,
+    render_page, text_width, wrap_text
+)
+from row_images import iter_rows_with_images
+from sheet_rows import HEADER_ROW, SHEET_DATA_TAG
+
+# A4 apaisado: los cuadros de cubicación son anchos
+PAGE_WIDTH = A4_HEIGHT
+PAGE_HEIGHT = A4_WIDTH
+MARGIN = 28
+TITLE_HEIGHT = 20
+FOOTER_HEIGHT = 14
+FOOTER_FONT_SIZE = 7
+
+BASE_FONT_SIZE = 7
+MIN_FONT_SIZE = 4
+CELL_PADDING = 2
+HEADER_LINES = 2
+# Alto de una fila con imagen de diseño antes de escalar
+IMAGE_ROW_HEIGHT = 48
+# Páginas por trabajo del pool
+PAGES_PER_CHUNK = 8
+
+# Ancho por defecto de Excel en caracteres (Calibri 11)
+DEFAULT_COLUMN_WIDTH = 8.43
+COL_TAG = _tag(NS_MAIN, "col")
+SHEET_FORMAT_TAG = _tag(NS_MAIN, "sheetFormatPr")
+
+GRID_COLOR = (0.7, 0.7, 0.7)
+HEADER_BACKGROUND = (0.9, 0.9, 0.9)
+GREY = (0.5, 0.5, 0.5)
+
+
+def column_width_points(characters: float) -> float:
+    """Ancho de columna de Excel (caracteres de 7 px más 5 px de margen) en puntos"""
+    return int(characters * 7 + 5) * 0.75
+
+
+def read_column_widths(zip_file: zipfile.ZipFile, sheet_part: str) -> Tuple[Dict[int, float], Set[int], float]:
+    """
+    ({columna: ancho en caracteres}, columnas ocultas, ancho por defecto).
+    <cols> va antes de <sheetData>, así que solo se lee el comienzo del XML.
+    """
+    widths: Dict[int, float] = {}
+    hidden: Set[int] = set()
+    default_width = DEFAULT_COLUMN_WIDTH
+    with zip_file.open(sheet_part) as stream:
+        for _, element in iterparse(stream, events=("start",)):
+            tag = element.tag
+            if tag == SHEET_DATA_TAG:
+                break
+            if tag == SHEET_FORMAT_TAG and element.get("defaultColWidth"):
+                default_width = float(element.get("defaultColWidth"))
+            elif tag == COL_TAG:
+                first, last = int(element.get("min", "1")), int(element.get("max", "1"))
+                for column in range(first, min(last, first + 1000) + 1):
+                    if element.get("width"):
+                        widths[column] = float(element.get("width"))
+                    if element.get("hidden") in ("1", "true"):
+                        hidden.add(column)
+    return widths, hidden, default_width
+
+
+def hex_to_rgb(color: Optional[str]) -> Optional[Tuple[float, float, float]]:
+    """'#RRGGBB' de la paleta a componentes 0-1; None para 'transparent'"""
+    if not color or not color.startswith("#") or len(color) != 7:
+        return None
+    return tuple(int(color[i:i + 2], 16) / 255.0 for i in (1, 3, 5))
+
+
+def format_cell(value: Any) -> Tuple[str, bool]:
+    """(texto a mostrar, alinear a la derecha) de un valor tipado de la hoja"""
+    if value is None:
+        return "", False
+    if isinstance(value, bool):
+        return ("VERDADERO" if value else "FALSO"), False
+    if isinstance(value, int):
+        return str(value), True
+    if isinstance(value, float):
+        text = f"{value:.4f}".rstrip("0").rstrip(".")
+        return text.replace(".", ","), True
+    return str(value), False
+
+
+def table_row(payload: Dict[str, Any]) -> Dict[str, Any]:
+    """Fila de iter_rows_with_images como texto ya formateado, con los blobId de sus imágenes"""
+    cells = [format_cell(value) for value in payload["values"]]
+    return {
+        "row": payload["row"],
+        "texts": [text for text, _ in cells],
+        "numeric": [numeric for _, numeric in cells],
+        "styles": payload["styles"],
+        "images": [image["blob_id"] for image in payload["images"]]
+    }
+
+
+def sheet_layout(zip_file: zipfile.ZipFile, header: Dict[str, Any], title: str, has_rows: bool) -> Dict[str, Any]:
+    """
+    Geometría común a todas las páginas: las columnas visibles salen de <cols>
+    y la tabla se escala para que todas quepan en el ancho de la página (como
+    'ajustar columnas en una página' de Excel); de la escala salen la fuente
+    y los altos de fila
+    """
+    widths, hidden, default_width = read_column_widths(zip_file, header["sheet_part"])
+    # La columna de diseño se incluye aunque no tenga encabezado
+    last_column = max(len(header["headers"]), (header["design_column"] or 0) if has_rows else 0)
+    visible = [
+        (column, column_width_points(widths.get(column, default_width)))
+        for column in range(1, last_column + 1) if column not in hidden
+    ]
+
+    natural_width = sum(width for _, width in visible) or 1.0
+    scale = min(1.0, (PAGE_WIDTH - 2 * MARGIN) / natural_width)
+    font_size = max(MIN_FONT_SIZE, BASE_FONT_SIZE * scale)
+    text_row_height = font_size + 2 * CELL_PADDING + 2
+
+    columns = []
+    x = MARGIN
+    for column, width in visible:
+        columns.append((column, x, width * scale))
+        x += width * scale
+
+    return {
+        "title": title,
+        "sheet": header["sheet"],
+        "headers": header["headers"],
+        "header_styles": header["header_styles"],
+        "palette": header["palette"],
+        "design_column": header["design_column"],
+        "columns": columns,
+        "table_width": x - MARGIN,
+        "font_size": font_size,
+        "row_height": text_row_height,
+        "image_row_height": max(text_row_height, IMAGE_ROW_HEIGHT * max(scale, 0.5)),
+        "header_height": HEADER_LINES * (font_size + 1) + 2 * CELL_PADDING + 2,
+    }
+
+
+def row_height(layout: Dict[str, Any], row: Dict[str, Any]) -> float:
+    return layout["image_row_height"] if row["images"] else layout["row_height"]
+
+
+def iter_sheet_pages(zip_file: zipfile.ZipFile, filename: str, header_row: int = HEADER_ROW,
+                     skip_empty: bool = True, pages_per_chunk: int = PAGES_PER_CHUNK):
+    """
+    Una sola pasada por la hoja para el PDF. Produce ('header', {'sheet',
+    'title'}), ('blob', {'id', 'media_part', 'data'}) la primera vez que una
+    fila referencia cada imagen, ('layout', geometría) antes del primer tramo
+    y ('pages', (primera página 1-based, filas, cortes [desde, hasta)))
+    cada pages_per_chunk páginas. Las filas se paginan a medida que se leen
+    (los cortes caen siempre entre filas) y solo se retienen las del tramo
+    en curso.
+    """
+    header = None
+    title = ""
+    layout = None
+    available = 0.0
+    rows: List[Dict[str, Any]] = []
+    breaks: List[Tuple[int, int]] = []
+    start = 0
+    used = 0.0
+    first_page = 1
+
+    for kind, payload in iter_rows_with_images(zip_file, header_row, skip_empty=skip_empty, with_colors=True):
+        if kind == 'header':
+            header = payload
+            title = f"{payload['sheet']} - {filename}"
+            yield 'header', {"sheet": payload["sheet"], "title": title}
+        elif kind == 'blob':
+            yield 'blob', payload
+        elif kind == 'row':
+            if layout is None:
+                layout = sheet_layout(zip_file, header, title, has_rows=True)
+                available = PAGE_HEIGHT - 2 * MARGIN - TITLE_HEIGHT - FOOTER_HEIGHT - layout["header_height"]
+                yield 'layout', layout
+            row = table_row(payload)
+            height = row_height(layout, row)
+            if used + height > available and len(rows) > start:
+                breaks.append((start, len(rows)))
+                start, used = len(rows), 0.0
+                if len(breaks) == pages_per_chunk:
+                    yield 'pages', (first_page, rows, breaks)
+                    first_page += len(breaks)
+                    rows, breaks, start = [], [], 0
+            rows.append(row)
+            used += height
+
+    if layout is None:
+        yield 'layout', sheet_layout(zip_file, header, title, has_rows=False)
+    breaks.append((start, len(rows)))
+    yield 'pages', (first_page, rows, breaks)
+
+
+def _cell_colors(layout: Dict[str, Any], style_id: int):
+    entry = layout["palette"][style_id] if style_id < len(layout["palette"]) else {}
+    return hex_to_rgb(entry.get("backgroundColor")), hex_to_rgb(entry.get("fontColor")) or (0, 0, 0)
+
+
+def _draw_header(canvas: PageCanvas, layout: Dict[str, Any], top: float):
+    font_size = layout["font_size"]
+    height = layout["header_height"]
+    headers, styles = layout["headers"], layout["header_styles"]
+    for column, x, width in layout["columns"]:
+        style_id = styles[column - 1] if column <= len(styles) else 0
+        background, color = _cell_colors(layout, style_id)
+        canvas.rect(x, top, width, height, fill=background or HEADER_BACKGROUND)
+        header = headers[column - 1] if column <= len(headers) else ""
+        lines = wrap_text(header, FONT_BOLD, font_size, width - 2 * CELL_PADDING, HEADER_LINES)
+        for index, line in enumerate(lines):
+            canvas.text(x + CELL_PADDING, top + CELL_PADDING + index * (font_size + 1), line,
+                        FONT_BOLD, font_size, color)
+
+
+def _draw_images(canvas: PageCanvas, image_table: Dict[str, Tuple[str, int, int, int]], blob_ids: List[str],
+                 x: float, top: float, width: float, height: float):
+    """Imágenes de la celda lado a lado, cada una ajustada a su parte del ancho"""
+    images = [image_table[blob_id] for blob_id in blob_ids if blob_id in image_table]
+    if not images:
+        return
+    slot = (width - CELL_PADDING) / len(images)
+    for index, (name, object_id, pixel_width, pixel_height) in enumerate(images):
+        scale = min((slot - CELL_PADDING) / pixel_width, (height - 2 * CELL_PADDING) / pixel_height)
+        if scale <= 0:
+            continue
+        draw_width, draw_height = pixel_width * scale, pixel_height * scale
+        left = x + CELL_PADDING + index * slot
+        canvas.image(name, object_id, left + (slot - CELL_PADDING - draw_width) / 2,
+                     top + (height - draw_height) / 2, draw_width, draw_height)
+
+
+def render_sheet_pages(layout: Dict[str, Any], rows: List[Dict[str, Any]], pages: List[Tuple[int, int]],
+                       first_page: int, image_table: Dict[str, Tuple[str, int, int, int]]) -> List[RenderedPage]:
+    """
+    Trabajo del pool: compone un tramo de páginas. rows son las filas del
+    tramo, pages sus cortes [desde, hasta) relativos a rows e image_table las
+    imágenes ya incrustadas que usan. layout['page_total'] es el formulario
+    reservado para el total de páginas (ver write_page_total).
+    """
+    font_size = layout["font_size"]
+    design_column = layout["design_column"]
+    table_left = MARGIN
+    table_right = MARGIN + layout["table_width"]
+    rendered = []
+
+    for page_offset, (start, end) in enumerate(pages):
+        canvas = PageCanvas(PAGE_WIDTH, PAGE_HEIGHT)
+        canvas.text(MARGIN, MARGIN, fit_text(layout["title"], FONT_BOLD, 10, PAGE_WIDTH - 2 * MARGIN), FONT_BOLD, 10)
+
+        table_top = MARGIN + TITLE_HEIGHT
+        _draw_header(canvas, layout, table_top)
+        top = table_top + layout["header_height"]
+        canvas.line(table_left, top, table_right, top, GRID_COLOR)
+
+        for row in rows[start:end]:
+            height = row_height(layout, row)
+            texts, numeric, styles = row["texts"], row["numeric"], row["styles"]
+            for column, x, width in layout["columns"]:
+                index = column - 1
+                background, color = _cell_colors(layout, styles[index] if index < len(styles) else 0)
+                if background is not None:
+                    canvas.rect(x, top, width, height, fill=background)
+                if column == design_column and row["images"]:
+                    _draw_images(canvas, image_table, row["images"], x, top, width, height)
+                    continue
+                text = texts[index] if index < len(texts) else ""
+                if not text:
+                    continue
+                text = fit_text(text, FONT_REGULAR, font_size, width - 2 * CELL_PADDING)
+                text_top = top + (height - font_size) / 2
+                if numeric[index]:
+                    canvas.text_right(x + width - CELL_PADDING, text_top, text, FONT_REGULAR, font_size, color)
+                else:
+                    canvas.text(x + CELL_PADDING, text_top, text, FONT_REGULAR, font_size, color)
+            top += height
+            canvas.line(table_left, top, table_right, top, GRID_COLOR)
+
+        # Separadores de columna de una vez por página
+        for _, x, _ in layout["columns"]:
+            canvas.line(x, table_top, x, top, GRID_COLOR)
+        canvas.line(table_right, table_top, table_right, top, GRID_COLOR)
+        canvas.line(table_left, table_top, table_right, table_top, GRID_COLOR)
+
+        # El total de páginas es un formulario que se escribe al cerrar el PDF
+        footer = f"Página {first_page + page_offset}/"
+        footer_top = PAGE_HEIGHT - MARGIN - FOOTER_FONT_SIZE
+        canvas.text(MARGIN, footer_top, footer, FONT_REGULAR, FOOTER_FONT_SIZE, GREY)
+        name, object_id = layout["page_total"]
+        canvas.form(name, object_id, MARGIN + text_width(footer, FONT_REGULAR, FOOTER_FONT_SIZE), footer_top)
+        rendered.append(render_page(canvas))
+    return rendered
+
+
+def write_page_total(writer: PdfStreamWriter, layout: Dict[str, Any]):
+    """Escribe el total de páginas en el formulario que referencian los pies de página"""
+    writer.write_text_form(layout["page_total"][1], str(writer.page_count), FONT_REGULAR, FOOTER_FONT_SIZE, GREY)
@@ -0,0 +1,293 @@
+#!/usr/bin/env python3
+"""
+Lectura de filas de la hoja DETALLE directamente desde el XML de la hoja
+
+El cliente parseaba el libro completo en el navegador con SheetJS/ExcelJS. Aquí
+las filas se recorren con iterparse sobre xl/worksheets/sheetN.xml: cada fila
+procesada se descarta, así que la memoria no crece con la cantidad de filas.
+Los valores se devuelven tipados (número, texto, booleano, fecha ISO) usando
+las cadenas compartidas y los formatos de número de xl/styles.xml.
+"""
+
+import datetime
+import functools
+import itertools
+import re
+import zipfile
+from collections import deque
+from typing import Any, Callable, Collection, Dict, Iterator, List, Optional, Set, Tuple, Union
+from xml.etree.ElementTree import iterparse
+
+from openpyxl.utils import column_index_from_string
+
+from drawing_anchors import DrawingAnchorReader, NS_MAIN, _tag
+from style_palette import StylePalette
+
+# Fila de encabezados de la hoja DETALLE (1-based), igual que la búsqueda de DESIGN
+HEADER_ROW = 5
+MAX_COLUMNS = 50
+# Si ningún encabezado menciona DESIGN se asume la columna E
+DEFAULT_DESIGN_COLUMN = 5
+
+# numFmtId integrados de Excel que representan fechas u horas
+BUILTIN_DATE_FORMATS = set(range(14, 23)) | {45, 46, 47}
+# Tokens de fecha en formatos personalizados (sin contar texto entre comillas ni colores)
+_DATE_TOKENS = re.compile(r"[dmyhs]", re.IGNORECASE)
+_FORMAT_LITERALS = re.compile(r'"[^"]*"|\[[^\]]*\]|\\.')
+
+# Etiquetas del XML de la hoja, calculadas una vez (se comparan por cada elemento)
+SHEET_DATA_TAG = _tag(NS_MAIN, "sheetData")
+ROW_TAG = _tag(NS_MAIN, "row")
+CELL_TAG = _tag(NS_MAIN, "c")
+VALUE_TAG = _tag(NS_MAIN, "v")
+TEXT_TAG = _tag(NS_MAIN, "t")
+_ROW_DIGITS = "0123456789"
+
+# Letras de columna -> índice; hay a lo sumo unas pocas decenas de columnas distintas
+_column_index = functools.lru_cache(maxsize=1024)(column_index_from_string)
+
+
+def _is_date_format(format_code: str) -> bool:
+    return bool(_DATE_TOKENS.search(_FORMAT_LITERALS.sub("", format_code)))
+
+
+def find_design_column(header_values: Dict[int, Any]) -> int:
+    """Primera columna cuyo encabezado contiene 'design' (sin distinguir mayúsculas)"""
+    for col in sorted(header_values):
+        cell_value = header_values[col]
+        if cell_value and isinstance(cell_value, str) and 'design' in cell_value.lower():
+            return col
+    return DEFAULT_DESIGN_COLUMN
+
+
+def read_date_styles(zip_file: zipfile.ZipFile) -> Set[int]:
+    """Índices de cellXfs (atributo s de la celda) cuyo formato es de fecha/hora"""
+    part = "xl/styles.xml"
+    if part not in zip_file.namelist():
+        return set()
+
+    custom_formats: Dict[int, str] = {}
+    date_styles = set()
+    xf_index = 0
+    in_cell_xfs = False
+    with zip_file.open(part) as stream:
+        for event, element in iterparse(stream, events=("start", "end")):
+            if element.tag == _tag(NS_MAIN, "cellXfs"):
+                in_cell_xfs = event == "start"
+                if not in_cell_xfs:
+                    break
+            elif event == "end" and element.tag == _tag(NS_MAIN, "numFmt"):
+                custom_formats[int(element.get("numFmtId", "0"))] = element.get("formatCode", "")
+            elif event == "end" and in_cell_xfs and element.tag == _tag(NS_MAIN, "xf"):
+                format_id = int(element.get("numFmtId", "0"))
+                if format_id in BUILTIN_DATE_FORMATS or (
+                    format_id in custom_formats and _is_date_format(custom_formats[format_id])
+                ):
+                    date_styles.add(xf_index)
+                xf_index += 1
+    return date_styles
+
+
+def read_date1904(zip_file: zipfile.ZipFile) -> bool:
+    """True si el libro usa el sistema de fechas 1904 (Excel para Mac antiguo)"""
+    with zip_file.open("xl/workbook.xml") as stream:
+        for _, element in iterparse(stream, events=("end",)):
+            if element.tag == _tag(NS_MAIN, "workbookPr"):
+                return element.get("date1904") in ("1", "true")
+            if element.tag == _tag(NS_MAIN, "sheets"):
+                break
+    return False
+
+
+def excel_serial_to_iso(serial: float, date1904: bool = False) -> str:
+    """Número de serie de Excel a fecha ISO (con hora solo si la tiene)"""
+    epoch = datetime.datetime(1904, 1, 1) if date1904 else datetime.datetime(1899, 12, 30)
+    moment = epoch + datetime.timedelta(days=serial)
+    if moment.time() == datetime.time(0, 0):
+        return moment.date().isoformat()
+    return moment.isoformat(timespec="seconds")
+
+
+class SheetRowParser:
+    """Recorre las filas de la hoja objetivo devolviendo encabezados y valores tipados"""
+
+    def __init__(self, zip_file: zipfile.ZipFile, header_row: int = HEADER_ROW,
+                 preferred_sheet: str = "DETALLE", max_columns: int = MAX_COLUMNS,
+                 with_colors: bool = False):
+        self.zip_file = zip_file
+        # Con colores cada fila lleva además el id de paleta de cada celda
+        self.palette = StylePalette.from_zip(zip_file) if with_colors else None
+        self.header_row = header_row
+        self.max_columns = max_columns
+        self.reader = DrawingAnchorReader(zip_file)
+        self.sheet = self.reader.select_target_sheet(preferred_sheet)
+        if self.sheet is None:
+            raise ValueError("El libro no contiene hojas")
+        self._shared_strings: Optional[List[str]] = None
+        self._date_styles = read_date_styles(zip_file)
+        self._date1904 = read_date1904(zip_file)
+
+    @property
+    def shared_strings(self) -> List[str]:
+        # Proporcional a los textos distintos del libro, no a las filas
+        if self._shared_strings is None:
+            self._shared_strings = self.reader.read_all_shared_strings()
+        return self._shared_strings
+
+    def iter_raw_rows(self, min_row: int = 1,
+                      columns: Optional[Collection[int]] = None) -> Iterator[Tuple[int, Dict[int, Any], Dict[int, int]]]:
+        """
+        (número de fila, {columna: valor tipado}, {columna: id de paleta}) de
+        cada fila con celdas a partir de min_row. Los ids de paleta solo se
+        llenan con with_colors. Con columns solo se decodifican esas columnas.
+        Las filas ya leídas se eliminan del árbol.
+        """
+        sheet_data = None
+        with self.zip_file.open(self.sheet["part"]) as stream:
+            for event, element in iterparse(stream, events=("start", "end")):
+                tag = element.tag
+                if event == "start":
+                    if tag == SHEET_DATA_TAG:
+                        sheet_data = element
+                    continue
+                if tag != ROW_TAG:
+                    if tag == SHEET_DATA_TAG:
+                        break
+                    continue
+
+                row_number = int(element.get("r", "0") or 0)
+                if row_number >= min_row:
+                    values = {}
+                    styles = {}
+                    # Las celdas son hijas directas de <row>
+                    for cell in element:
+                        if cell.tag != CELL_TAG:
+                            continue
+                        letters = cell.get("r", "").rstrip(_ROW_DIGITS)
+                        if not letters:
+                            continue
+                        column = _column_index(letters)
+                        if columns is not None and column not in columns:
+                            continue
+                        value = self._cell_value(cell)
+                        if value is not None:
+                            values[column] = value
+                        if self.palette is not None:
+                            styles[column] = self.palette.style_id(int(cell.get("s", "0")))
+                    yield row_number, values, styles
+
+                # Liberar la fila procesada (y las anteriores) de sheetData
+                if sheet_data is not None:
+                    sheet_data.clear()
+
+    def _cell_value(self, cell) -> Any:
+        cell_type = cell.get("t", "n")
+        if cell_type == "inlineStr":
+            return "".join(node.text or "" for node in cell.iter(TEXT_TAG))
+
+        value_node = cell.find(VALUE_TAG)
+        if value_node is None or value_node.text is None:
+            return None
+        raw = value_node.text
+
+        if cell_type == "s":
+            index = int(raw)
+            strings = self.shared_strings
+            return strings[index] if index < len(strings) else None
+        if cell_type == "b":
+            return raw == "1"
+        if cell_type in ("str", "e", "d"):
+            return raw
+
+        number = float(raw)
+        if int(cell.get("s", "0")) in self._date_styles:
+            return excel_serial_to_iso(number, self._date1904)
+        return int(number) if number.is_integer() else number
+
+    def iter_rows(self, offset: int = 0, limit: Optional[int] = None, skip_empty: bool = True,
+                  keep_rows: Union[Collection[int], Callable[[Dict[int, Any]], Collection[int]]] = ()):
+        """
+        Primero produce ('header', {...}) con los encabezados de header_row,
+        luego ('row', {'row', 'values'}) por cada fila de datos desde offset
+        (máximo limit) y al final ('trailer', {...}). Deja de leer el XML
+        apenas completa la página. Las filas de keep_rows se emiten aunque
+        estén vacías o no existan en el XML (p. ej. filas con imágenes);
+        keep_rows puede ser una función que las calcula a partir de los
+        valores de la fila de encabezados, leída en la misma pasada.
+        """
+        raw_rows = self.iter_raw_rows(self.header_row)
+        first = next(raw_rows, None)
+        header_values: Dict[int, Any] = {}
+        header_styles: Dict[int, int] = {}
+        if first is not None and first[0] == self.header_row:
+            _, header_values, header_styles = first
+            first = None
+        if callable(keep_rows):
+            keep_rows = keep_rows(header_values)
+        headers = self._build_headers(header_values)
+        yield 'header', self._header_payload(headers, header_styles)
+
+        emitted = 0
+        skipped = 0
+        has_more = False
+        pending = deque(sorted(row for row in set(keep_rows) if row > self.header_row))
+        if first is not None:
+            raw_rows = itertools.chain([first], raw_rows)
+
+        def with_kept_rows():
+            # Intercala las filas de keep_rows que el XML no trae
+            for row_number, values, styles in raw_rows:
+                while pending and pending[0] < row_number:
+                    yield pending.popleft(), {}, {}, True
+                kept = bool(pending) and pending[0] == row_number
+                if kept:
+                    pending.popleft()
+                yield row_number, values, styles, kept
+            while pending:
+                yield pending.popleft(), {}, {}, True
+
+        for row_number, values, styles, kept in with_kept_rows():
+            if skip_empty and not values and not kept:
+                continue
+            if skipped < offset:
+                skipped += 1
+                continue
+            if limit is not None and emitted >= limit:
+                has_more = True
+                break
+
+            row = {
+                'row': row_number,
+                'values': [values.get(col) for col in range(1, len(headers) + 1)]
+            }
+            if self.palette is not None:
+                row['styles'] = [styles.get(col, 0) for col in range(1, len(headers) + 1)]
+            yield 'row', row
+            emitted += 1
+
+        yield 'trailer', {
+            'count': emitted,
+            'offset': offset,
+            'next_offset': offset + emitted if has_more else None
+        }
+
+    def _header_payload(self, headers: List[str], styles: Dict[int, int]) -> Dict[str, Any]:
+        payload = {
+            'sheet': self.sheet["name"],
+            'header_row': self.header_row,
+            'headers': headers
+        }
+        if self.palette is not None:
+            payload['header_styles'] = [styles.get(col, 0) for col in range(1, len(headers) + 1)]
+            payload['palette'] = self.palette.palette
+        return payload
+
+    def _build_headers(self, values: Dict[int, Any]) -> List[str]:
+        """Encabezados desde la columna A; las celdas vacías reciben un nombre genérico"""
+        last_column = min(max(values, default=0), self.max_columns)
+        headers = []
+        for col in range(1, last_column + 1):
+            value = values.get(col)
+            header = str(value).strip() if value is not None else ""
+            headers.append(header or f"Columna_{col}")
+        return headers
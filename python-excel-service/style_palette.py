@@ -0,0 +1,213 @@
+#!/usr/bin/env python3
+"""
+Paleta de colores de celdas resuelta a partir de xl/styles.xml y el tema
+
+generatePreviewWithColors recorría cada celda en el navegador resolviendo
+colores de tema, tintes e índices una y otra vez. Aquí styles.xml y
+theme1.xml se leen una sola vez y cada estilo de celda (índice de cellXfs)
+se traduce a un id pequeño dentro de una paleta compartida de pares
+{fondo, fuente} en #RRGGBB. Las filas solo llevan esos ids.
+"""
+
+import colorsys
+import threading
+import zipfile
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+from xml.etree.ElementTree import iterparse
+
+from drawing_anchors import NS_A, NS_MAIN, _tag
+
+STYLES_PART = "xl/styles.xml"
+THEME_PART = "xl/theme/theme1.xml"
+
+DEFAULT_BACKGROUND = "transparent"
+DEFAULT_FONT_COLOR = "#000000"
+
+# Paleta indexada por defecto de Excel (índices 0-63)
+DEFAULT_INDEXED_COLORS = [
+    "000000", "FFFFFF", "FF0000", "00FF00", "0000FF", "FFFF00", "FF00FF", "00FFFF",
+    "000000", "FFFFFF", "FF0000", "00FF00", "0000FF", "FFFF00", "FF00FF", "00FFFF",
+    "800000", "008000", "000080", "808000", "800080", "008080", "C0C0C0", "808080",
+    "9999FF", "993366", "FFFFCC", "CCFFFF", "660066", "FF8080", "0066CC", "CCCCFF",
+    "000080", "FF00FF", "FFFF00", "00FFFF", "800080", "800000", "008080", "0000FF",
+    "00CCFF", "CCFFFF", "CCFFCC", "FFFF99", "99CCFF", "FF99CC", "CC99FF", "FFCC99",
+    "3366FF", "33CCCC", "99CC00", "FFCC00", "FF9900", "FF6600", "666699", "969696",
+    "003366", "339966", "003300", "333300", "993300", "993366", "333399", "333333",
+]
+# 64 = color del sistema para primer plano, 65 = fondo del sistema
+SYSTEM_FOREGROUND_INDEX = 64
+SYSTEM_BACKGROUND_INDEX = 65
+
+# Orden de clrScheme en theme1.xml y orden de los índices theme="N" de las celdas
+# (Excel intercambia dk/lt: theme 0 es lt1 y theme 1 es dk1)
+THEME_SCHEME_ORDER = ["dk1", "lt1", "dk2", "lt2", "accent1", "accent2", "accent3",
+                      "accent4", "accent5", "accent6", "hlink", "folHlink"]
+THEME_INDEX_ORDER = ["lt1", "dk1", "lt2", "dk2", "accent1", "accent2", "accent3",
+                     "accent4", "accent5", "accent6", "hlink", "folHlink"]
+
+# Paletas ya resueltas por proceso, por CRC de styles.xml y del tema. Con el
+# pool de hilos varias lecturas la consultan a la vez: se accede con el lock
+_PALETTE_CACHE: "OrderedDict[tuple, StylePalette]" = OrderedDict()
+_PALETTE_CACHE_LOCK = threading.Lock()
+PALETTE_CACHE_SIZE = 32
+
+
+def apply_tint(rgb: str, tint: float) -> str:
+    """Aplica el tinte de Excel (luminosidad en HLS) a un color RRGGBB"""
+    if not tint:
+        return rgb
+    red, green, blue = (int(rgb[i:i + 2], 16) / 255.0 for i in (0, 2, 4))
+    hue, lightness, saturation = colorsys.rgb_to_hls(red, green, blue)
+    if tint < 0:
+        lightness = lightness * (1.0 + tint)
+    else:
+        lightness = lightness * (1.0 - tint) + tint
+    red, green, blue = colorsys.hls_to_rgb(hue, min(1.0, max(0.0, lightness)), saturation)
+    return "".join(f"{round(channel * 255):02X}" for channel in (red, green, blue))
+
+
+def read_theme_colors(zip_file: zipfile.ZipFile) -> List[str]:
+    """Colores del tema en el orden de los índices theme="N" (RRGGBB)"""
+    if THEME_PART not in zip_file.namelist():
+        return []
+
+    scheme: Dict[str, str] = {}
+    current = None
+    with zip_file.open(THEME_PART) as stream:
+        for event, element in iterparse(stream, events=("start", "end")):
+            name = element.tag.rsplit("}", 1)[-1]
+            if event == "start":
+                if element.tag.startswith(f"{{{NS_A}}}") and name in THEME_SCHEME_ORDER:
+                    current = name
+                continue
+            if current and name == "srgbClr":
+                scheme.setdefault(current, element.get("val", "000000").upper())
+            elif current and name == "sysClr":
+                scheme.setdefault(current, element.get("lastClr", "000000").upper())
+            elif name == current:
+                current = None
+            elif name == "clrScheme":
+                break
+    return [scheme.get(name, "000000") for name in THEME_INDEX_ORDER]
+
+
+class StylePalette:
+    """
+    Traducción índice de cellXfs -> id de paleta, y la paleta de pares
+    {backgroundColor, fontColor} ya resueltos a #RRGGBB
+    """
+
+    def __init__(self, palette: List[Dict[str, str]], style_ids: List[int]):
+        self.palette = palette
+        self._style_ids = style_ids
+
+    def style_id(self, xf_index: int) -> int:
+        """Id de paleta de un estilo de celda (0 = estilo por defecto)"""
+        if 0 <= xf_index < len(self._style_ids):
+            return self._style_ids[xf_index]
+        return 0
+
+    @classmethod
+    def from_zip(cls, zip_file: zipfile.ZipFile) -> "StylePalette":
+        """Paleta del libro, reutilizando la ya calculada si styles.xml y el tema no cambian"""
+        names = set(zip_file.namelist())
+        key = tuple(
+            (info.CRC, info.file_size) if info is not None else None
+            for info in (
+                zip_file.getinfo(part) if part in names else None
+                for part in (STYLES_PART, THEME_PART)
+            )
+        )
+        with _PALETTE_CACHE_LOCK:
+            cached = _PALETTE_CACHE.get(key)
+            if cached is not None:
+                _PALETTE_CACHE.move_to_end(key)
+                return cached
+
+        # Se arma fuera del lock; si dos hilos la arman a la vez queda la última
+        palette = cls._build(zip_file, names)
+        with _PALETTE_CACHE_LOCK:
+            _PALETTE_CACHE[key] = palette
+            while len(_PALETTE_CACHE) > PALETTE_CACHE_SIZE:
+                _PALETTE_CACHE.popitem(last=False)
+        return palette
+
+    @classmethod
+    def _build(cls, zip_file: zipfile.ZipFile, names) -> "StylePalette":
+        theme_colors = read_theme_colors(zip_file)
+        custom_indexed: List[str] = []
+        # Atributos crudos de cada color: <colors> va al final de styles.xml,
+        # así que se resuelven recién cuando se conoce la paleta indexada
+        font_colors: List[Optional[Dict[str, str]]] = []
+        fill_colors: List[Optional[Dict[str, str]]] = []
+        xfs: List[Tuple[int, int]] = []
+
+        if STYLES_PART in names:
+            section = None
+            sections = {_tag(NS_MAIN, name) for name in ("fonts", "fills", "cellXfs", "indexedColors")}
+            with zip_file.open(STYLES_PART) as stream:
+                for event, element in iterparse(stream, events=("start", "end")):
+                    tag = element.tag
+                    if tag in sections:
+                        section = tag if event == "start" else None
+                        continue
+                    if event != "end" or section is None:
+                        continue
+
+                    if section == _tag(NS_MAIN, "indexedColors") and tag == _tag(NS_MAIN, "rgbColor"):
+                        custom_indexed.append(element.get("rgb", "FF000000").upper()[-6:])
+                    elif section == _tag(NS_MAIN, "fonts") and tag == _tag(NS_MAIN, "font"):
+                        color = element.find(_tag(NS_MAIN, "color"))
+                        font_colors.append(dict(color.attrib) if color is not None else None)
+                        element.clear()
+                    elif section == _tag(NS_MAIN, "fills") and tag == _tag(NS_MAIN, "fill"):
+                        pattern = element.find(_tag(NS_MAIN, "patternFill"))
+                        color = None
+                        if pattern is not None and pattern.get("patternType", "none") != "none":
+                            color = pattern.find(_tag(NS_MAIN, "fgColor"))
+                        fill_colors.append(dict(color.attrib) if color is not None else None)
+                        element.clear()
+                    elif section == _tag(NS_MAIN, "cellXfs") and tag == _tag(NS_MAIN, "xf"):
+                        xfs.append((int(element.get("fontId", "0")), int(element.get("fillId", "0"))))
+                        element.clear()
+
+        indexed_colors = custom_indexed or DEFAULT_INDEXED_COLORS
+
+        def resolve(color: Optional[Dict[str, str]]) -> Optional[str]:
+            """Color (rgb, theme o indexed, con tinte) a RRGGBB, o None si es automático"""
+            if not color:
+                return None
+            if color.get("rgb"):
+                rgb = color["rgb"].upper()[-6:]  # Descartar el canal alfa de ARGB
+            elif color.get("theme") is not None:
+                index = int(color["theme"])
+                if index >= len(theme_colors):
+                    return None
+                rgb = theme_colors[index]
+            elif color.get("indexed") is not None:
+                index = int(color["indexed"])
+                if index in (SYSTEM_FOREGROUND_INDEX, SYSTEM_BACKGROUND_INDEX) or index >= len(indexed_colors):
+                    return None
+                rgb = indexed_colors[index]
+            else:
+                return None
+            return apply_tint(rgb, float(color.get("tint", "0") or 0))
+
+        fonts = [resolve(color) for color in font_colors]
+        fills = [resolve(color) for color in fill_colors]
+
+        # Id 0 siempre es el estilo por defecto
+        palette = [{"backgroundColor": DEFAULT_BACKGROUND, "fontColor": DEFAULT_FONT_COLOR}]
+        palette_ids = {(DEFAULT_BACKGROUND, DEFAULT_FONT_COLOR): 0}
+        style_ids = []
+        for font_id, fill_id in xfs:
+            fill = fills[fill_id] if fill_id < len(fills) else None
+            font = fonts[font_id] if font_id < len(fonts) else None
+            pair = (f"#{fill}" if fill else DEFAULT_BACKGROUND, f"#{font}" if font else DEFAULT_FONT_COLOR)
+            if pair not in palette_ids:
+                palette_ids[pair] = len(palette)
+                palette.append({"backgroundColor": pair[0], "fontColor": pair[1]})
+            style_ids.append(palette_ids[pair])
+
+        return cls(palette, style_ids)
@@ -0,0 +1,699 @@
+#!/usr/bin/env python3
+"""
+Relleno de plantillas de cubicación directamente sobre el ZIP
+
+Generar la cubicación desde la plantilla corporativa significaba cargarla con
+openpyxl y volver a guardarla: lento con plantillas grandes (logos, hojas de
+condiciones) y con pérdida de lo que openpyxl no entiende. Aquí solo se
+reescriben la hoja objetivo, su dibujo y los metadatos que cambian; el resto
+de las partes se copia con sus bytes comprimidos tal cual, así que el tiempo
+depende de los datos escritos y no del tamaño de la plantilla.
+
+Marcadores en las celdas (texto compartido o en línea) de la hoja objetivo:
+- {{cliente.nombre}}: valor de los datos por ruta con puntos. Si la celda es
+  solo el marcador y el valor es numérico, se escribe como número.
+- Una fila con marcadores de una lista ({{productos.codigo}}) se repite por
+  cada elemento. Las filas de abajo, las fórmulas, las celdas combinadas, los
+  rangos con nombre de la hoja, las referencias Hoja!A1 desde otras hojas y
+  gráficos, y las anclas del dibujo se desplazan.
+- {{productos.imagen}}: la imagen de diseño del elemento anclada en la celda.
+"""
+
+import bisect
+import html
+import math
+import posixpath
+import re
+import zipfile
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+from xml.sax.saxutils import escape
+
+from openpyxl.utils import get_column_letter
+
+from drawing_anchors import (
+    DrawingAnchorReader, NS_A, NS_REL, NS_XDR, REL_TYPE_DRAWING, REL_TYPE_IMAGE, rels_part_for
+)
+from media_store import image_dimensions
+from sheet_pdf import read_column_widths
+from xlsx_export import (
+    CT_DRAWING, IMAGE_MARGIN_PX, MAX_CELL_TEXT, XML_HEADER, _INVALID_XML_CHARS, anchor_xml, fit_image, image_format,
+    relationships_xml
+)
+from zip_utils import ChunkSink, copy_compressed_entry
+
+PLACEHOLDER = re.compile(r"\{\{\s*([\w.]+)\s*\}\}")
+IMAGE_FIELD = "imagen"
+# Última fila de una hoja de Excel
+MAX_SHEET_ROWS = 1048576
+DEFAULT_ROW_HEIGHT = 15.0
+CONTENT_TYPES_PART = "[Content_Types].xml"
+CALC_CHAIN_PART = "xl/calcChain.xml"
+WORKBOOK_PART = "xl/workbook.xml"
+# Filas escritas entre cada entrega de bytes al cliente
+FLUSH_ROWS = 500
+
+SHEET_DATA = re.compile(r"<sheetData\s*/>|<sheetData>(.*?)</sheetData>", re.S)
+ROW = re.compile(r"<row\b([^>]*?)(?:/>|>(.*?)</row>)", re.S)
+CELL = re.compile(r"<c\b([^>]*?)(?:/>|>(.*?)</c>)", re.S)
+FORMULA = re.compile(r"<f\b([^>]*?)(?:/>|>(.*?)</f>)", re.S)
+VALUE = re.compile(r"<v>(.*?)</v>", re.S)
+INLINE_TEXT = re.compile(r"<t\b[^>]*>(.*?)</t>", re.S)
+TAG = re.compile(r"<([A-Za-z][\w:.-]*)(\s[^<>]*?)?(/?)>")
+MERGE_CELLS = re.compile(r"<mergeCells\b[^>]*>(.*?)</mergeCells>", re.S)
+ANCHOR_ROW = re.compile(r"<((?:\w+:)?)row>(\d+)</\1row>")
+DRAWING_ROOT_END = re.compile(r"</((?:\w+:)?)wsDr>")
+CNVPR_ID = re.compile(r"cNvPr\b[^>]*?\bid=\"(\d+)\"")
+# <f> de las hojas y <c:f> de los gráficos
+LINKED_FORMULA = re.compile(r"<((?:\w+:)?)f\b([^>]*)(?<!/)>(.*?)</\1f>", re.S)
+DEFINED_NAME = re.compile(r"(<definedName\b[^>]*>)(.*?)(</definedName>)", re.S)
+QUALIFIED_REF = re.compile(r"('(?:[^']|'')+'|[\w.]+)!(\$?[A-Z]{1,3}\$?\d+(?::\$?[A-Z]{1,3}\$?\d+)?)")
+CELL_REF = re.compile(r"^(\$?)([A-Z]{1,3})(\$?)(\d+)$")
+# Referencias A1 o A1:B2 dentro de una fórmula, sin las de otras hojas (Hoja!A1)
+FORMULA_REF = re.compile(
+    r"(?<![\w.!:$'\"\]])(\$?[A-Z]{1,3}\$?\d+)(?::(\$?[A-Z]{1,3}\$?\d+))?(?![\w(!\[])"
+)
+REF_ATTRIBUTES = ("ref", "sqref", "activeCell", "topLeftCell")
+# Elementos de la hoja que van después de <drawing> (para insertarlo en orden)
+AFTER_DRAWING = ("legacyDrawing", "legacyDrawingHF", "drawingHF", "picture", "oleObjects", "controls",
+                 "webPublishItems", "tableParts", "extLst")
+
+ImageSource = Callable[[Dict[str, Any]], Optional[Tuple[str, bytes]]]
+RowMapper = Callable[[int, bool], int]
+
+_ATTRIBUTE_PATTERNS: Dict[str, "re.Pattern"] = {}
+
+
+def _attribute_pattern(name: str) -> "re.Pattern":
+    if name not in _ATTRIBUTE_PATTERNS:
+        _ATTRIBUTE_PATTERNS[name] = re.compile(rf'(?<![\w:]){re.escape(name)}="([^"]*)"')
+    return _ATTRIBUTE_PATTERNS[name]
+
+
+def get_attribute(attributes: str, name: str) -> Optional[str]:
+    match = _attribute_pattern(name).search(attributes or "")
+    return html.unescape(match.group(1)) if match else None
+
+
+def set_attribute(attributes: str, name: str, value: Optional[str]) -> str:
+    """Cambia, agrega o (con None) quita un atributo de la cadena de atributos de un tag"""
+    attributes = attributes or ""
+    pattern = _attribute_pattern(name)
+    if value is None:
+        return re.sub(rf'\s+(?<![\w:]){re.escape(name)}="[^"]*"', "", attributes)
+    replacement = f'{name}="{escape(value, {chr(34): "&quot;"})}"'
+    if pattern.search(attributes):
+        return pattern.sub(lambda _: replacement, attributes, count=1)
+    return f"{attributes} {replacement}"
+
+
+def _display(value: Any) -> str:
+    if value is None:
+        return ""
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value)
+
+
+def _inline_cell(attributes: str, text: str) -> str:
+    text = escape(_INVALID_XML_CHARS.sub("", text)[:MAX_CELL_TEXT])
+    return f'<c{set_attribute(attributes, "t", "inlineStr")}><is><t xml:space="preserve">{text}</t></is></c>'
+
+
+class TemplateFill:
+    """
+    Plan de relleno de una plantilla abierta como ZIP. El constructor lee la
+    hoja objetivo, ubica los bloques de filas y las imágenes (lanza
+    ValueError si los datos no calzan); iter_bytes() escribe el libro nuevo.
+    """
+
+    def __init__(self, zip_file: zipfile.ZipFile, data: Dict[str, Any], sheet_name: Optional[str] = None,
+                 image_source: Optional[ImageSource] = None):
+        self.zip_file = zip_file
+        self.data = data
+        self.names = set(zip_file.namelist())
+        self.reader = DrawingAnchorReader(zip_file)
+        sheet = self._find_sheet(sheet_name)
+        self.sheet_name = sheet["name"]
+        self.sheet_part = sheet["part"]
+
+        xml = zip_file.read(self.sheet_part).decode("utf-8")
+        match = SHEET_DATA.search(xml)
+        if match is None:
+            raise ValueError(f"La hoja '{self.sheet_name}' no tiene sheetData")
+        self.head, self.tail = xml[:match.start()], xml[match.end():]
+        self.rows: List[Tuple[int, str, Optional[str]]] = []
+        previous = 0
+        for row in ROW.finditer(match.group(1) or ""):
+            row_number = int(get_attribute(row.group(1), "r") or previous + 1)
+            self.rows.append((row_number, row.group(1), row.group(2)))
+            previous = row_number
+
+        self._placeholder_strings: Optional[Dict[int, str]] = None
+        self.blocks: Dict[int, Tuple[str, List[Any]]] = {}
+        for row_number, _, content in self.rows:
+            root = self._block_root(row_number, content)
+            if root is not None:
+                # Una lista vacía deja la fila en blanco para no romper las fórmulas que la usan
+                self.blocks[row_number] = (root, self.data[root] or [{}])
+
+        self._block_rows = sorted(self.blocks)
+        self._cumulative = [0]
+        for row_number in self._block_rows:
+            self._cumulative.append(self._cumulative[-1] + len(self.blocks[row_number][1]) - 1)
+        last_row = max((self.map_row(row, True) for row, _, _ in self.rows), default=0)
+        if last_row > MAX_SHEET_ROWS:
+            raise ValueError(f"El resultado tendría {last_row} filas; Excel admite {MAX_SHEET_ROWS}")
+        # si -> (columna, fila, fórmula) de las maestras; los grupos que cruzan una fila repetida se expanden
+        self.shared_masters: Dict[str, Tuple[int, int, str]] = {}
+        self.expanded_shared = set()
+        self._plan_shared_formulas()
+
+        self.image_source = image_source
+        # Clave de contenido -> (parte xl/media, rel id); anclas (columna, fila, clave, ancho px, alto px)
+        self.media: Dict[str, Tuple[str, str, bytes]] = {}
+        self.anchors: List[Tuple[int, int, str, int, int]] = []
+        self._plan_images()
+
+        self.drawing_parts = self.reader.sheet_drawing_parts(self.sheet_part)
+        self.new_drawing_part = None
+        if self.anchors and not self.drawing_parts:
+            self.new_drawing_part = self._unused_name("xl/drawings/drawing{}.xml")
+        self.drop_calc_chain = bool(self.blocks) and CALC_CHAIN_PART in self.names
+        # Hojas y gráficos que pueden tener fórmulas Hoja!A1 hacia la hoja rellenada
+        self.linked_candidates = {
+            sheet["part"] for sheet in self.reader.list_sheets() if sheet["part"] != self.sheet_part
+        } | {name for name in self.names if name.startswith("xl/charts/chart") and name.endswith(".xml")}
+        self.rows_written = 0
+
+    # --- Lectura de la plantilla ---
+
+    def _find_sheet(self, sheet_name: Optional[str]) -> Dict[str, str]:
+        sheets = self.reader.list_sheets()
+        if not sheets:
+            raise ValueError("La plantilla no contiene hojas")
+        if sheet_name is None:
+            return self.reader.select_target_sheet()
+        for sheet in sheets:
+            if sheet["name"] == sheet_name:
+                return sheet
+        raise ValueError(f"La plantilla no tiene la hoja '{sheet_name}'")
+
+    @property
+    def placeholder_strings(self) -> Dict[int, str]:
+        """Cadenas compartidas que contienen marcadores, por índice"""
+        if self._placeholder_strings is None:
+            self._placeholder_strings = {
+                index: text for index, text in enumerate(self.reader.read_all_shared_strings())
+                if text and PLACEHOLDER.search(text)
+            }
+        return self._placeholder_strings
+
+    def _template_text(self, attributes: str, inner: Optional[str]) -> Optional[str]:
+        """Texto de la celda si tiene marcadores, si no None"""
+        if not inner or "<f" in inner:
+            return None
+        cell_type = get_attribute(attributes, "t")
+        if cell_type == "s":
+            value = VALUE.search(inner)
+            return self.placeholder_strings.get(int(value.group(1))) if value else None
+        if cell_type == "inlineStr":
+            text = html.unescape("".join(INLINE_TEXT.findall(inner)))
+            return text if PLACEHOLDER.search(text) else None
+        return None
+
+    def _block_root(self, row_number: int, content: Optional[str]) -> Optional[str]:
+        """Lista de los datos que repite la fila (la primera parte de sus marcadores)"""
+        roots = set()
+        for cell in CELL.finditer(content or ""):
+            text = self._template_text(cell.group(1), cell.group(2))
+            for path in PLACEHOLDER.findall(text or ""):
+                root = path.split(".", 1)[0]
+                if isinstance(self.data.get(root), list):
+                    roots.add(root)
+        if len(roots) > 1:
+            raise ValueError(f"La fila {row_number} usa más de una lista: {', '.join(sorted(roots))}")
+        return roots.pop() if roots else None
+
+    def _plan_shared_formulas(self):
+        """
+        Fórmulas compartidas cuyo rango incluye una fila repetida: cada copia
+        necesita su propia fórmula y el rango ya no describe las celdas del
+        grupo, así que todas sus celdas se escriben como fórmulas normales
+        """
+        for row_number, _, content in self.rows:
+            if not content or 't="shared"' not in content:
+                continue
+            for cell in CELL.finditer(content):
+                formula = FORMULA.search(cell.group(2) or "")
+                if formula is None or not formula.group(2):
+                    continue
+                attributes = formula.group(1)
+                shared_ref = get_attribute(attributes, "ref")
+                position = CELL_REF.match(get_attribute(cell.group(1), "r") or "")
+                if get_attribute(attributes, "t") != "shared" or not shared_ref or position is None:
+                    continue
+                index = get_attribute(attributes, "si")
+                self.shared_masters[index] = (
+                    self._column_number(position.group(2)), int(position.group(4)), html.unescape(formula.group(2))
+                )
+                rows = [int(part.group(4)) for part in map(CELL_REF.match, shared_ref.split(":")) if part]
+                if not rows:
+                    continue
+                block = bisect.bisect_left(self._block_rows, min(rows))
+                if block < len(self._block_rows) and self._block_rows[block] <= max(rows):
+                    self.expanded_shared.add(index)
+
+    def _plan_images(self):
+        """Anclas y medios de los marcadores de imagen de las filas repetidas"""
+        image_cells = []
+        for row_number, attributes, content in self.rows:
+            if row_number not in self.blocks:
+                continue
+            root, items = self.blocks[row_number]
+            for cell in CELL.finditer(content or ""):
+                text = self._template_text(cell.group(1), cell.group(2))
+                if text and text.strip() == f"{{{{{root}.{IMAGE_FIELD}}}}}":
+                    reference = get_attribute(cell.group(1), "r") or ""
+                    column = self._column_number(reference.rstrip("0123456789"))
+                    image_cells.append((row_number, attributes, column, items))
+        if not image_cells or self.image_source is None:
+            return
+
+        widths, _, default_width = read_column_widths(self.zip_file, self.sheet_part)
+        sheet_format = re.search(r"<sheetFormatPr\b[^>]*>", self.head)
+        default_height = float(
+            (get_attribute(sheet_format.group(0), "defaultRowHeight") if sheet_format else None) or DEFAULT_ROW_HEIGHT
+        )
+        media_index = self._first_free_index("xl/media/image{}.")
+        for row_number, attributes, column, items in image_cells:
+            height = float(get_attribute(attributes, "ht") or default_height)
+            box = (max(1, int(widths.get(column, default_width) * 7 + 5) - 2 * IMAGE_MARGIN_PX),
+                   max(1, int(height * 4 / 3) - 2 * IMAGE_MARGIN_PX))
+            first_row = self.map_row(row_number)
+            for offset, item in enumerate(items):
+                image = self.image_source(item) if isinstance(item, dict) else None
+                if image is None:
+                    continue
+                key, data = image
+                if key not in self.media:
+                    detected = image_format(data)
+                    if detected is None:
+                        continue
+                    part = f"xl/media/image{media_index}.{detected[0]}"
+                    media_index += 1
+                    self.media[key] = (part, f"rIdTpl{len(self.media) + 1}", data)
+                width_px, height_px = fit_image(*image_dimensions(self.media[key][2]), *box)
+                self.anchors.append((column, first_row + offset, key, width_px, height_px))
+
+    @staticmethod
+    def _column_number(letters: str) -> int:
+        number = 0
+        for letter in letters:
+            number = number * 26 + ord(letter) - 64
+        return number
+
+    def _first_free_index(self, pattern: str) -> int:
+        prefix = pattern.split("{}")[0]
+        used = [int(match.group(1)) for name in self.names
+                for match in [re.match(re.escape(prefix) + r"(\d+)", name)] if match]
+        return max(used, default=0) + 1
+
+    def _unused_name(self, pattern: str) -> str:
+        return pattern.format(self._first_free_index(pattern))
+
+    # --- Desplazamiento de filas ---
+
+    def map_row(self, row: int, last: bool = False) -> int:
+        """
+        Fila nueva de una fila de la plantilla. Para una fila repetida es la
+        primera copia (con last, la última: fin de un rango que la incluye).
+        """
+        index = bisect.bisect_left(self._block_rows, row)
+        new_row = row + self._cumulative[index]
+        if index < len(self._block_rows) and self._block_rows[index] == row and last:
+            new_row += max(len(self.blocks[row][1]) - 1, 0)
+        return new_row
+
+    def map_reference(self, reference: str, mapper: Optional[RowMapper] = None) -> str:
+        """Desplaza 'A1' o 'A1:B2'; lo que no es una referencia de celda queda igual"""
+        mapper = mapper or self.map_row
+        parts = reference.split(":")
+        if len(parts) > 2:
+            return reference
+        mapped = []
+        for index, part in enumerate(parts):
+            match = CELL_REF.match(part)
+            if match is None:
+                return reference
+            row = mapper(int(match.group(4)), index == 1)
+            mapped.append(f"{match.group(1)}{match.group(2)}{match.group(3)}{row}")
+        return ":".join(mapped)
+
+    def shift_qualified(self, formula: str, mapper: Optional[RowMapper] = None) -> str:
+        """Desplaza las referencias Hoja!A1 a la hoja rellenada (fuera de los literales de texto)"""
+        def replace(reference):
+            sheet = reference.group(1)
+            name = sheet[1:-1].replace("''", "'") if sheet.startswith("'") else sheet
+            if name != self.sheet_name:
+                return reference.group(0)
+            return f"{sheet}!{self.map_reference(reference.group(2), mapper)}"
+
+        parts = formula.split('"')
+        for index in range(0, len(parts), 2):
+            parts[index] = QUALIFIED_REF.sub(replace, parts[index])
+        return '"'.join(parts)
+
+    def shift_formula(self, formula: str, mapper: RowMapper) -> str:
+        """Desplaza las referencias de la fórmula fuera de los literales de texto"""
+        parts = self.shift_qualified(formula, mapper).split('"')
+        for index in range(0, len(parts), 2):
+            parts[index] = FORMULA_REF.sub(lambda match: self.map_reference(match.group(0), mapper), parts[index])
+        return '"'.join(parts)
+
+    def offset_formula(self, formula: str, row_offset: int, column_offset: int) -> str:
+        """
+        Fórmula de un dependiente de una fórmula compartida: las referencias
+        relativas de la maestra se mueven lo que el dependiente está corrido
+        """
+        def move(reference: str) -> str:
+            parts = []
+            for part in reference.split(":"):
+                match = CELL_REF.match(part)
+                if match is None:
+                    return reference
+                column_fixed, letters, row_fixed, row = match.groups()
+                column = self._column_number(letters) + (0 if column_fixed else column_offset)
+                row = int(row) + (0 if row_fixed else row_offset)
+                if column < 1 or row < 1:
+                    return "#REF!"
+                parts.append(f"{column_fixed}{get_column_letter(column)}{row_fixed}{row}")
+            return ":".join(parts)
+
+        parts = formula.split('"')
+        for index in range(0, len(parts), 2):
+            text = QUALIFIED_REF.sub(lambda match: f"{match.group(1)}!{move(match.group(2))}", parts[index])
+            parts[index] = FORMULA_REF.sub(lambda match: move(match.group(0)), text)
+        return '"'.join(parts)
+
+    def _mentions_sheet(self, xml: str) -> bool:
+        name = escape(self.sheet_name)
+        return f"{name}!" in xml or f"'{name.replace(chr(39), chr(39) * 2)}'!" in xml
+
+    def _linked_part(self, xml: str) -> Optional[str]:
+        """
+        Otra hoja o un gráfico con fórmulas que apuntan a la hoja rellenada:
+        se reescriben esas referencias (None si no hay ninguna y la parte se
+        copia tal cual)
+        """
+        if not self._mentions_sheet(xml):
+            return None
+
+        def replace(match):
+            prefix, attributes, text = match.group(1), match.group(2), match.group(3)
+            if not text or not self._mentions_sheet(text):
+                return match.group(0)
+            return f"<{prefix}f{attributes}>{escape(self.shift_qualified(html.unescape(text)))}</{prefix}f>"
+        return LINKED_FORMULA.sub(replace, xml)
+
+    def _map_tag_references(self, xml: str) -> str:
+        """ref/sqref/activeCell/topLeftCell de los tags (salvo mergeCell)"""
+        def replace(match):
+            name, attributes = match.group(1), match.group(2) or ""
+            if name == "mergeCell" or not any(f'{attr}="' in attributes for attr in REF_ATTRIBUTES):
+                return match.group(0)
+            for attr in REF_ATTRIBUTES:
+                value = get_attribute(attributes, attr)
+                if value:
+                    attributes = set_attribute(
+                        attributes, attr, " ".join(self.map_reference(item) for item in value.split())
+                    )
+            return f"<{name}{attributes}{match.group(3)}>"
+        return TAG.sub(replace, xml)
+
+    def _map_merge_cells(self, xml: str) -> str:
+        """Celdas combinadas: las de una fila repetida se repiten en cada copia"""
+        def replace_block(match):
+            merged = []
+            for cell in re.finditer(r"<mergeCell\b([^>]*?)/>", match.group(1)):
+                reference = get_attribute(cell.group(1), "ref") or ""
+                rows = {int(part.group(4)) for part in map(CELL_REF.match, reference.split(":")) if part}
+                row = next(iter(rows)) if len(rows) == 1 else None
+                if row in self.blocks:
+                    first = self.map_row(row)
+                    for offset in range(len(self.blocks[row][1])):
+                        merged.append(self.map_reference(reference, lambda _, __: first + offset))
+                else:
+                    merged.append(self.map_reference(reference))
+            if not merged:
+                return ""
+            items = "".join(f'<mergeCell ref="{reference}"/>' for reference in merged)
+            return f'<mergeCells count="{len(merged)}">{items}</mergeCells>'
+        return MERGE_CELLS.sub(replace_block, xml)
+
+    # --- Escritura de la hoja ---
+
+    def _resolve(self, path: str, root: Optional[str], item: Any) -> Any:
+        parts = path.split(".")
+        value: Any = self.data
+        if root is not None and parts[0] == root:
+            value, parts = item, parts[1:]
+        for part in parts:
+            value = value.get(part) if isinstance(value, dict) else None
+        return value
+
+    def _filled_cell(self, attributes: str, template: str, root: Optional[str], item: Any) -> str:
+        attributes = set_attribute(attributes, "t", None)
+        single = PLACEHOLDER.fullmatch(template.strip())
+        if single is None:
+            text = PLACEHOLDER.sub(lambda match: _display(self._resolve(match.group(1), root, item)), template)
+            return _inline_cell(attributes, text)
+
+        path = single.group(1)
+        if root is not None and path == f"{root}.{IMAGE_FIELD}":
+            return f"<c{attributes}/>"
+        value = self._resolve(path, root, item)
+        if value is None or value == "" or (isinstance(value, float) and not math.isfinite(value)):
+            return f"<c{attributes}/>"
+        if isinstance(value, bool):
+            return f'<c{set_attribute(attributes, "t", "b")}><v>{int(value)}</v></c>'
+        if isinstance(value, (int, float)):
+            return f"<c{attributes}><v>{value!r}</v></c>"
+        return _inline_cell(attributes, _display(value))
+
+    def _formula(self, match, mapper: RowMapper, reference: Optional[str]) -> str:
+        """<f> de la celda reference de la plantilla, con sus referencias desplazadas"""
+        attributes, text = match.group(1), match.group(2)
+        index = get_attribute(attributes, "si")
+        if get_attribute(attributes, "t") == "shared" and index in self.expanded_shared:
+            if not text:
+                # Dependiente: la fórmula de la maestra movida hasta su celda
+                position = CELL_REF.match(reference or "")
+                if position is None:
+                    return ""
+                master_column, master_row, master_text = self.shared_masters[index]
+                text = self.offset_formula(
+                    master_text, int(position.group(4)) - master_row,
+                    self._column_number(position.group(2)) - master_column
+                )
+            for name in ("t", "ref", "si"):
+                attributes = set_attribute(attributes, name, None)
+        elif get_attribute(attributes, "ref"):
+            attributes = set_attribute(attributes, "ref", self.map_reference(get_attribute(attributes, "ref")))
+        if text is None:
+            return f"<f{attributes}/>"
+        return f"<f{attributes}>{escape(self.shift_formula(html.unescape(text), mapper))}</f>"
+
+    def _row_xml(self, attributes: str, content: Optional[str], new_row: int, mapper: RowMapper,
+                 root: Optional[str] = None, item: Any = None) -> str:
+        attributes = set_attribute(attributes, "r", str(new_row))
+        if content is None:
+            return f"<row{attributes}/>"
+
+        def replace(cell):
+            cell_attributes, inner = cell.group(1), cell.group(2)
+            reference = get_attribute(cell_attributes, "r")
+            if reference:
+                cell_attributes = set_attribute(cell_attributes, "r", f"{reference.rstrip('0123456789')}{new_row}")
+            template = self._template_text(cell_attributes, inner)
+            if template is not None:
+                return self._filled_cell(cell_attributes, template, root, item)
+            if inner and "<f" in inner:
+                inner = FORMULA.sub(lambda match: self._formula(match, mapper, reference), inner)
+            return f"<c{cell_attributes}/>" if inner is None else f"<c{cell_attributes}>{inner}</c>"
+
+        return f"<row{attributes}>{CELL.sub(replace, content)}</row>"
+
+    def _sheet_head(self) -> str:
+        head = self._map_tag_references(self.head)
+        if self.new_drawing_part and "xmlns:r=" not in head:
+            head = re.sub(r"<worksheet\b", f'<worksheet xmlns:r="{NS_REL}"', head, count=1)
+        return head
+
+    def _sheet_tail(self) -> str:
+        tail = self._map_merge_cells(self._map_tag_references(self.tail))
+        if self.new_drawing_part:
+            drawing = f'<drawing r:id="{self.new_drawing_rel_id}"/>'
+            following = re.search(r"<(?:\w+:)?(?:%s)\b" % "|".join(AFTER_DRAWING), tail)
+            position = following.start() if following else tail.rindex("</worksheet>")
+            tail = tail[:position] + drawing + tail[position:]
+        return tail
+
+    def iter_sheet_rows(self) -> Iterator[str]:
+        for row_number, attributes, content in self.rows:
+            if row_number not in self.blocks:
+                yield self._row_xml(attributes, content, self.map_row(row_number), self.map_row)
+                continue
+            root, items = self.blocks[row_number]
+            first = self.map_row(row_number)
+            for offset, item in enumerate(items):
+                new_row = first + offset
+
+                def mapper(row: int, last: bool, template_row=row_number, copy_row=new_row) -> int:
+                    return copy_row if row == template_row else self.map_row(row, last)
+
+                yield self._row_xml(attributes, content, new_row, mapper, root, item)
+
+    # --- Partes reescritas ---
+
+    @property
+    def new_drawing_rel_id(self) -> str:
+        return "rIdTplDrawing"
+
+    def _drawing_xml(self, xml: str, with_anchors: bool) -> str:
+        xml = ANCHOR_ROW.sub(
+            lambda match: f"<{match.group(1)}row>{self.map_row(int(match.group(2)) + 1) - 1}</{match.group(1)}row>", xml
+        )
+        if not with_anchors:
+            return xml
+        root = re.search(r"<((?:\w+:)?)wsDr\b[^>]*>", xml)
+        declarations = "".join(
+            f' xmlns:{prefix}="{namespace}"'
+            for prefix, namespace in (("xdr", NS_XDR), ("a", NS_A), ("r", NS_REL))
+            if f"xmlns:{prefix}=" not in root.group(0)
+        )
+        xml = xml[:root.end() - 1] + declarations + xml[root.end() - 1:]
+        first_id = max((int(value) for value in CNVPR_ID.findall(xml)), default=1) + 1
+        anchors = "".join(
+            anchor_xml(first_id + index, column, row, self.media[key][1], width_px, height_px)
+            for index, (column, row, key, width_px, height_px) in enumerate(self.anchors)
+        )
+        end = DRAWING_ROOT_END.search(xml)
+        return xml[:end.start()] + anchors + xml[end.start():]
+
+    def _image_relationships(self, drawing_part: str) -> List[Tuple[str, str, str]]:
+        base = posixpath.dirname(drawing_part)
+        return [(rel_id, REL_TYPE_IMAGE, posixpath.relpath(part, base)) for part, rel_id, _ in self.media.values()]
+
+    def _add_relationships(self, xml: Optional[str], relations: List[Tuple[str, str, str]]) -> str:
+        if xml is None:
+            return relationships_xml(relations)
+        items = "".join(f'<Relationship Id="{rel_id}" Type="{rel_type}" Target="{target}"/>'
+                        for rel_id, rel_type, target in relations)
+        position = xml.rindex("</Relationships>")
+        return xml[:position] + items + xml[position:]
+
+    def _content_types(self, xml: str) -> str:
+        present = {value.lower() for value in re.findall(r'Extension="([^"]+)"', xml)}
+        additions = ""
+        for part, _, data in self.media.values():
+            extension, content_type = image_format(data)
+            if extension not in present:
+                present.add(extension)
+                additions += f'<Default Extension="{extension}" ContentType="{content_type}"/>'
+        if self.new_drawing_part:
+            additions += f'<Override PartName="/{self.new_drawing_part}" ContentType="{CT_DRAWING}"/>'
+        if self.drop_calc_chain:
+            xml = re.sub(r'<Override\b[^>]*PartName="/xl/calcChain\.xml"[^>]*/>', "", xml)
+        position = xml.rindex("</Types>")
+        return xml[:position] + additions + xml[position:]
+
+    def _workbook(self, xml: str) -> str:
+        """Rangos con nombre de la hoja (área de impresión...) y recálculo al abrir"""
+        def shift_names(match):
+            return match.group(1) + escape(self.shift_qualified(html.unescape(match.group(2)))) + match.group(3)
+
+        xml = DEFINED_NAME.sub(shift_names, xml)
+        if self.drop_calc_chain:
+            xml = re.sub(r"<calcPr\b(?![^>]*fullCalcOnLoad)", '<calcPr fullCalcOnLoad="1"', xml, count=1)
+        return xml
+
+    def _rewritten_parts(self) -> Dict[str, str]:
+        """Partes pequeñas que cambian (la hoja se escribe aparte, fila por fila)"""
+        def read(name):
+            return self.zip_file.read(name).decode("utf-8") if name in self.names else None
+
+        parts: Dict[str, str] = {}
+        for index, drawing_part in enumerate(self.drawing_parts):
+            with_anchors = bool(self.anchors) and index == 0
+            if self.blocks or with_anchors:
+                parts[drawing_part] = self._drawing_xml(read(drawing_part), with_anchors)
+            if with_anchors:
+                rels = rels_part_for(drawing_part)
+                parts[rels] = self._add_relationships(read(rels), self._image_relationships(drawing_part))
+        if self.new_drawing_part:
+            sheet_rels = rels_part_for(self.sheet_part)
+            target = posixpath.relpath(self.new_drawing_part, posixpath.dirname(self.sheet_part))
+            parts[sheet_rels] = self._add_relationships(
+                read(sheet_rels), [(self.new_drawing_rel_id, REL_TYPE_DRAWING, target)]
+            )
+        if self.media or self.new_drawing_part or self.drop_calc_chain:
+            parts[CONTENT_TYPES_PART] = self._content_types(read(CONTENT_TYPES_PART))
+        if self.blocks and WORKBOOK_PART in self.names:
+            parts[WORKBOOK_PART] = self._workbook(read(WORKBOOK_PART))
+        if self.drop_calc_chain:
+            workbook_rels = rels_part_for(WORKBOOK_PART)
+            parts[workbook_rels] = re.sub(r'<Relationship\b[^>]*/calcChain"[^>]*/>', "", read(workbook_rels))
+        return parts
+
+    def _new_parts(self) -> Dict[str, str]:
+        if not self.new_drawing_part:
+            return {}
+        drawing = (
+            f'{XML_HEADER}<xdr:wsDr xmlns:xdr="{NS_XDR}" xmlns:a="{NS_A}" xmlns:r="{NS_REL}"></xdr:wsDr>'
+        )
+        return {
+            self.new_drawing_part: self._drawing_xml(drawing, True),
+            rels_part_for(self.new_drawing_part): relationships_xml(self._image_relationships(self.new_drawing_part)),
+        }
+
+    def iter_bytes(self) -> Iterator[bytes]:
+        """
+        El libro relleno por partes, en el orden de la plantilla: partes sin
+        cambios copiadas comprimidas, las reescritas y al final las nuevas
+        (dibujo e imágenes)
+        """
+        sink = ChunkSink()
+        rewritten = self._rewritten_parts()
+        with zipfile.ZipFile(sink, "w", zipfile.ZIP_DEFLATED) as package:
+            for info in self.zip_file.infolist():
+                name = info.filename
+                if name == CALC_CHAIN_PART and self.drop_calc_chain:
+                    continue
+                if name == self.sheet_part:
+                    with package.open(name, "w") as sheet:
+                        sheet.write(f"{self._sheet_head()}<sheetData>".encode())
+                        for row in self.iter_sheet_rows():
+                            sheet.write(row.encode())
+                            self.rows_written += 1
+                            if self.rows_written % FLUSH_ROWS == 0:
+                                yield sink.drain()
+                        sheet.write(f"</sheetData>{self._sheet_tail()}".encode())
+                elif name in rewritten:
+                    package.writestr(name, rewritten.pop(name))
+                elif self.blocks and name in self.linked_candidates:
+                    linked = self._linked_part(self.zip_file.read(name).decode("utf-8"))
+                    if linked is None:
+                        copy_compressed_entry(self.zip_file, info, package)
+                    else:
+                        package.writestr(name, linked)
+                else:
+                    copy_compressed_entry(self.zip_file, info, package)
+                yield sink.drain()
+
+            # Partes que la plantilla no tenía (p. ej. el _rels de una hoja sin dibujo)
+            for name, xml in {**rewritten, **self._new_parts()}.items():
+                package.writestr(name, xml)
+            for part, _, data in self.media.values():
+                package.writestr(part, data, compress_type=zipfile.ZIP_STORED)
+                yield sink.drain()
+        yield sink.drain()
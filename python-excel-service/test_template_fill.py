@@ -0,0 +1,185 @@
+#!/usr/bin/env python3
+"""
+Relleno de plantillas sobre el ZIP: desplazamiento de filas, celdas
+combinadas, rangos con nombre, anclas del dibujo y fórmulas compartidas
+
+Uso: python -m pytest test_template_fill.py (o python -m unittest)
+"""
+
+import io
+import re
+import unittest
+import zipfile
+
+import openpyxl
+from openpyxl.drawing.image import Image as XLImage
+from openpyxl.workbook.defined_name import DefinedName
+from PIL import Image
+
+from template_fill import TemplateFill
+
+SHEET_PART = "xl/worksheets/sheet1.xml"
+PRODUCTS = [{"codigo": f"P{index}", "ancho": 1.5 + index, "alto": 2} for index in range(3)]
+
+
+def png_bytes(size=(40, 20)) -> bytes:
+    buffer = io.BytesIO()
+    Image.new("RGB", size, (200, 0, 0)).save(buffer, "PNG")
+    return buffer.getvalue()
+
+
+def build_template() -> bytes:
+    """DETALLE con la fila 6 repetida por producto, un total debajo y un logo en A12"""
+    workbook = openpyxl.Workbook()
+    sheet = workbook.active
+    sheet.title = "DETALLE"
+    sheet["A1"] = "{{cliente.nombre}}"
+    sheet.merge_cells("A1:C1")
+    for column, header in enumerate(["Codigo", "Ancho", "Alto", "M2", "Imagen"], 1):
+        sheet.cell(5, column, header)
+    sheet["A6"] = "{{productos.codigo}}"
+    sheet["B6"] = "{{productos.ancho}}"
+    sheet["C6"] = "{{productos.alto}}"
+    sheet["D6"] = "=B6*C6"
+    sheet["E6"] = "{{productos.imagen}}"
+    sheet.merge_cells("F6:G6")
+    sheet["C7"] = "Total"
+    sheet["D7"] = "=SUM(D6:D6)"
+    sheet.merge_cells("A10:B10")
+    sheet.add_image(XLImage(io.BytesIO(png_bytes())), "A12")
+    workbook.defined_names["_xlnm.Print_Area"] = DefinedName("_xlnm.Print_Area", attr_text="DETALLE!$A$1:$G$12")
+    resumen = workbook.create_sheet("RESUMEN")
+    resumen["A1"] = "=DETALLE!D7"
+    output = io.BytesIO()
+    workbook.save(output)
+    return output.getvalue()
+
+
+def replace_part(data: bytes, part: str, transform) -> bytes:
+    """Copia del ZIP con una parte reescrita"""
+    output = io.BytesIO()
+    with zipfile.ZipFile(io.BytesIO(data)) as source, zipfile.ZipFile(output, "w", zipfile.ZIP_DEFLATED) as target:
+        for info in source.infolist():
+            content = source.read(info.filename)
+            if info.filename == part:
+                content = transform(content.decode("utf-8")).encode("utf-8")
+            target.writestr(info, content)
+    return output.getvalue()
+
+
+def fill(template: bytes, data, image_source=None) -> bytes:
+    with zipfile.ZipFile(io.BytesIO(template)) as zip_file:
+        return b"".join(TemplateFill(zip_file, data, image_source=image_source).iter_bytes())
+
+
+def read_part(filled: bytes, part: str) -> str:
+    with zipfile.ZipFile(io.BytesIO(filled)) as result:
+        return result.read(part).decode("utf-8")
+
+
+def add_cell(sheet_xml: str, row: int, cell: str) -> str:
+    """Agrega la celda al final de la fila, creando la fila en su lugar si no existe"""
+    if not re.search(rf'<row r="{row}"', sheet_xml):
+        following = [match for match in re.finditer(r'<row r="(\d+)"', sheet_xml) if int(match.group(1)) > row]
+        position = following[0].start() if following else sheet_xml.index("</sheetData>")
+        sheet_xml = f'{sheet_xml[:position]}<row r="{row}"></row>{sheet_xml[position:]}'
+    return re.sub(rf'(<row r="{row}"[^>]*>)(.*?)</row>', lambda match: f"{match.group(1)}{match.group(2)}{cell}</row>",
+                  sheet_xml, count=1, flags=re.S)
+
+
+def cell_formula(sheet_xml: str, reference: str):
+    cell = re.search(rf'<c r="{reference}"[^>]*>(.*?)</c>', sheet_xml, re.S)
+    if cell is None:
+        return None
+    formula = re.search(r"<f\b([^>]*)>(.*?)</f>", cell.group(1), re.S)
+    return (formula.group(1), formula.group(2)) if formula else None
+
+
+class TemplateFillTests(unittest.TestCase):
+
+    def setUp(self):
+        self.template = build_template()
+        self.data = {"cliente": {"nombre": "ACME"}, "productos": PRODUCTS}
+
+    def test_block_rows_repeat_and_rows_below_shift(self):
+        filled = fill(self.template, self.data)
+        with zipfile.ZipFile(io.BytesIO(filled)) as result:
+            self.assertIsNone(result.testzip())
+        workbook = openpyxl.load_workbook(io.BytesIO(filled))
+        sheet = workbook["DETALLE"]
+        self.assertEqual(sheet["A1"].value, "ACME")
+        self.assertEqual([sheet.cell(row, 1).value for row in (6, 7, 8)], ["P0", "P1", "P2"])
+        self.assertEqual([sheet.cell(row, 2).value for row in (6, 7, 8)], [1.5, 2.5, 3.5])
+        self.assertEqual(sheet["D7"].value, "=B7*C7")
+        self.assertEqual(sheet["C9"].value, "Total")
+        self.assertEqual(sheet["D9"].value, "=SUM(D6:D8)")
+        self.assertEqual(workbook["RESUMEN"]["A1"].value, "=DETALLE!D9")
+
+    def test_merge_cells_repeat_per_copy_and_shift(self):
+        sheet_xml = read_part(fill(self.template, self.data), SHEET_PART)
+        merged = set(re.findall(r'<mergeCell ref="([^"]+)"/>', sheet_xml))
+        self.assertEqual(merged, {"A1:C1", "F6:G6", "F7:G7", "F8:G8", "A12:B12"})
+        self.assertIn('<mergeCells count="5">', sheet_xml)
+
+    def test_defined_names_shift(self):
+        workbook_xml = read_part(fill(self.template, self.data), "xl/workbook.xml")
+        self.assertIn("DETALLE!$A$1:$G$14", workbook_xml)
+
+    def test_drawing_anchors_shift_and_images_anchor_per_item(self):
+        image = png_bytes((30, 30))
+        filled = fill(self.template, self.data, lambda item: (item["codigo"], image))
+        drawing = read_part(filled, "xl/drawings/drawing1.xml")
+        with zipfile.ZipFile(io.BytesIO(filled)) as result:
+            media = [name for name in result.namelist() if name.startswith("xl/media/")]
+        rows = [int(row) for row in re.findall(r"<(?:\w+:)?from>.*?<(?:\w+:)?row>(\d+)<", drawing, re.S)]
+        # El logo de A12 baja dos filas; una imagen por producto en E6:E8
+        self.assertEqual(sorted(rows), [5, 6, 7, 13])
+        self.assertEqual(len(media), 4)
+
+    def test_empty_list_keeps_block_row_blank(self):
+        data = dict(self.data, productos=[])
+        sheet_xml = read_part(fill(self.template, data), SHEET_PART)
+        self.assertNotIn("{{", sheet_xml)
+        self.assertEqual(cell_formula(sheet_xml, "D7")[1], "SUM(D6:D6)")
+
+    def test_shared_formulas_crossing_block_rows_are_expanded(self):
+        def add_shared(xml):
+            # E6:G6 comparte la fórmula de E6 en la fila repetida; H5:H8 cruza la fila repetida
+            xml = re.sub(r'<c r="E6"[^>]*>.*?</c>', (
+                '<c r="E6"><f t="shared" ref="E6:G6" si="0">B6*2</f></c>'
+                '<c r="F6"><f t="shared" si="0"/></c><c r="G6"><f t="shared" si="0"/></c>'
+            ), xml)
+            for row in range(5, 9):
+                formula = '<f t="shared" ref="H5:H8" si="1">A5+$B$1</f>' if row == 5 else '<f t="shared" si="1"/>'
+                xml = add_cell(xml, row, f'<c r="H{row}">{formula}</c>')
+            return xml
+
+        template = replace_part(self.template, SHEET_PART, add_shared)
+        sheet_xml = read_part(fill(template, self.data), SHEET_PART)
+
+        self.assertNotIn('t="shared"', sheet_xml)
+        for row in (6, 7, 8):
+            self.assertEqual(cell_formula(sheet_xml, f"E{row}")[1], f"B{row}*2")
+            self.assertEqual(cell_formula(sheet_xml, f"F{row}")[1], f"C{row}*2")
+            self.assertEqual(cell_formula(sheet_xml, f"G{row}")[1], f"D{row}*2")
+            self.assertEqual(cell_formula(sheet_xml, f"H{row}")[1], f"A{row}+$B$1")
+        self.assertEqual(cell_formula(sheet_xml, "H5")[1], "A5+$B$1")
+        # H7 y H8 de la plantilla quedan en las filas 9 y 10
+        self.assertEqual(cell_formula(sheet_xml, "H9")[1], "A9+$B$1")
+        self.assertEqual(cell_formula(sheet_xml, "H10")[1], "A10+$B$1")
+
+    def test_shared_formulas_outside_block_rows_stay_shared(self):
+        def add_shared(xml):
+            for row in (1, 2):
+                formula = '<f t="shared" ref="H1:H2" si="0">A1*2</f>' if row == 1 else '<f t="shared" si="0"/>'
+                xml = add_cell(xml, row, f'<c r="H{row}">{formula}</c>')
+            return xml
+
+        template = replace_part(self.template, SHEET_PART, add_shared)
+        sheet_xml = read_part(fill(template, self.data), SHEET_PART)
+        self.assertEqual(cell_formula(sheet_xml, "H1"), (' t="shared" ref="H1:H2" si="0"', "A1*2"))
+        self.assertIn('<c r="H2"><f t="shared" si="0"/></c>', sheet_xml)
+
+
+if __name__ == "__main__":
+    unittest.main()
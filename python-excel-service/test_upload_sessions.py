@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+"""
+Regresión: los ids de sesión de subida no pueden salir de root_dir
+
+Uso: python -m pytest test_upload_sessions.py (o python -m unittest)
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from upload_sessions import UploadSessionStore
+
+
+class UploadSessionPathTests(unittest.TestCase):
+
+    def setUp(self):
+        self.parent = tempfile.mkdtemp()
+        self.root = os.path.join(self.parent, "sessions")
+        # Algo que no debe borrarse junto a root_dir
+        self.bystander = os.path.join(self.parent, "otro")
+        os.makedirs(self.bystander)
+        self.store = UploadSessionStore(self.root, ttl_seconds=60, max_bytes=1024)
+
+    def tearDown(self):
+        shutil.rmtree(self.parent, ignore_errors=True)
+
+    def test_delete_rejects_traversal(self):
+        for session_id in ("..", ".", "../otro", "..%2F", "/", ""):
+            self.assertFalse(self.store.delete(session_id))
+        self.assertTrue(os.path.isdir(self.bystander))
+        self.assertTrue(os.path.isdir(self.root))
+
+    def test_get_rejects_traversal(self):
+        self.assertIsNone(self.store.get(".."))
+        self.assertIsNone(self.store.get("../otro"))
+
+    def test_delete_does_not_follow_symlink_out_of_root(self):
+        os.symlink(self.bystander, os.path.join(self.root, "abc123"))
+        self.assertFalse(self.store.delete("abc123"))
+        self.assertTrue(os.path.isdir(self.bystander))
+
+    def test_delete_removes_real_session(self):
+        session = self.store.create("libro.xlsx")
+        self.assertTrue(self.store.delete(session["id"]))
+        self.assertFalse(os.path.exists(os.path.join(self.root, session["id"])))
+
+    def test_delete_endpoint_rejects_encoded_dot_dot(self):
+        from fastapi.testclient import TestClient
+        import main
+
+        original = main.upload_sessions
+        main.upload_sessions = self.store
+        try:
+            with TestClient(main.app) as client:
+                response = client.delete("/uploads/%2E%2E")
+        finally:
+            main.upload_sessions = original
+        self.assertEqual(response.status_code, 404)
+        self.assertTrue(os.path.isdir(self.bystander))
+        self.assertTrue(os.path.isdir(self.root))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+"""
+Copia de entradas comprimidas entre ZIPs sin recomprimir
+
+Uso: python -m pytest test_zip_utils.py (o python -m unittest)
+"""
+
+import io
+import unittest
+import zipfile
+import zlib
+
+from zip_utils import ChunkSink, copy_compressed_entry, read_compressed_bytes
+
+ENTRIES = {
+    "xl/worksheets/sheet1.xml": b"<worksheet>" + b"<row/>" * 5000 + b"</worksheet>",
+    "xl/media/image1.png": bytes(range(256)) * 40,
+    "vacio.txt": b"",
+}
+
+
+def build_source() -> bytes:
+    output = io.BytesIO()
+    with zipfile.ZipFile(output, "w") as archive:
+        for index, (name, data) in enumerate(ENTRIES.items()):
+            compression = zipfile.ZIP_STORED if index == 1 else zipfile.ZIP_DEFLATED
+            archive.writestr(name, data, compress_type=compression)
+    return output.getvalue()
+
+
+class CopyCompressedEntryTests(unittest.TestCase):
+
+    def setUp(self):
+        self.source = zipfile.ZipFile(io.BytesIO(build_source()))
+
+    def tearDown(self):
+        self.source.close()
+
+    def assert_round_trip(self, data: bytes):
+        with zipfile.ZipFile(io.BytesIO(data)) as copy:
+            self.assertIsNone(copy.testzip())
+            self.assertEqual({name: copy.read(name) for name in copy.namelist()}, ENTRIES)
+            for info in copy.infolist():
+                self.assertEqual(info.compress_type, self.source.getinfo(info.filename).compress_type)
+
+    def test_copy_to_seekable_target(self):
+        output = io.BytesIO()
+        with zipfile.ZipFile(output, "w", zipfile.ZIP_DEFLATED) as target:
+            for info in self.source.infolist():
+                copy_compressed_entry(self.source, info, target)
+        self.assert_round_trip(output.getvalue())
+
+    def test_copy_to_stream_mixed_with_new_entries(self):
+        sink = ChunkSink()
+        chunks = []
+        with zipfile.ZipFile(sink, "w", zipfile.ZIP_DEFLATED) as target:
+            target.writestr("nuevo.xml", b"<nuevo/>")
+            for info in self.source.infolist():
+                copy_compressed_entry(self.source, info, target)
+                chunks.append(sink.drain())
+            with target.open("escrito.xml", "w") as entry:
+                entry.write(b"<escrito/>" * 100)
+        chunks.append(sink.drain())
+        with zipfile.ZipFile(io.BytesIO(b"".join(chunks))) as copy:
+            self.assertIsNone(copy.testzip())
+            self.assertEqual(copy.read("nuevo.xml"), b"<nuevo/>")
+            self.assertEqual(copy.read("escrito.xml"), b"<escrito/>" * 100)
+            for name, data in ENTRIES.items():
+                self.assertEqual(copy.read(name), data)
+
+    def test_copy_rejected_while_writing_handle_is_open(self):
+        with zipfile.ZipFile(io.BytesIO(), "w") as target:
+            with target.open("abierto.xml", "w") as entry:
+                entry.write(b"<a/>")
+                with self.assertRaises(ValueError):
+                    copy_compressed_entry(self.source, self.source.infolist()[0], target)
+
+    def test_read_compressed_bytes_is_raw_deflate(self):
+        info = self.source.getinfo("xl/worksheets/sheet1.xml")
+        raw = read_compressed_bytes(self.source, info)
+        self.assertEqual(len(raw), info.compress_size)
+        self.assertEqual(zlib.decompress(raw, -15), ENTRIES[info.filename])
+
+    def test_read_while_entry_is_open(self):
+        # Lectura intercalada con un ZipExtFile abierto sobre el mismo archivo
+        with self.source.open("xl/worksheets/sheet1.xml") as stream:
+            head = stream.read(100)
+            raw = read_compressed_bytes(self.source, self.source.getinfo("xl/media/image1.png"))
+            rest = stream.read()
+        self.assertEqual(head + rest, ENTRIES["xl/worksheets/sheet1.xml"])
+        self.assertEqual(raw, ENTRIES["xl/media/image1.png"])
+
+
+if __name__ == "__main__":
+    unittest.main()
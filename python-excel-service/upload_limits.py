@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+"""
+Lectura de subidas por bloques con límites de tamaño
+
+Las subidas nunca se leen completas con await file.read(): se recorren por
+bloques de tamaño fijo, se corta apenas superan el máximo configurado (413) y
+se informa cuántos bytes de la copia propia quedaron en memoria. Esa cifra no
+incluye el spool previo que Starlette hace al leer el multipart (hasta 1 MB
+por archivo en memoria y el resto en disco), donde el límite que rige es el
+del middleware sobre el cuerpo completo. El
+middleware rechaza antes de leer el cuerpo las peticiones cuyo Content-Length
+ya supera el límite, y corta las que lo superan en medio del envío.
+"""
+
+import hashlib
+import json
+import tempfile
+from typing import Any, AsyncIterator, Dict, Optional
+
+from fastapi import HTTPException
+
+DEFAULT_CHUNK_SIZE = 1024 * 1024
+
+
+class UploadTooLarge(HTTPException):
+    """
+    La subida superó el tamaño máximo permitido. Es una HTTPException para que
+    FastAPI no la convierta en un 400 genérico si ocurre al leer el formulario.
+    """
+
+    def __init__(self, limit: int, received: Optional[int] = None):
+        self.limit = limit
+        self.received = received
+        super().__init__(
+            status_code=413,
+            detail=f"El archivo supera el tamaño máximo permitido ({limit} bytes)"
+        )
+
+
+async def iter_upload_chunks(file, max_bytes: int, chunk_size: int = DEFAULT_CHUNK_SIZE) -> AsyncIterator[bytes]:
+    """Bloques de la subida; lanza UploadTooLarge en cuanto se pasa de max_bytes"""
+    received = 0
+    while True:
+        chunk = await file.read(chunk_size)
+        if not chunk:
+            break
+        received += len(chunk)
+        if max_bytes and received > max_bytes:
+            raise UploadTooLarge(max_bytes, received)
+        yield chunk
+
+
+async def spool_upload_chunks(file, max_bytes: int, spool_max_bytes: int,
+                              chunk_size: int = DEFAULT_CHUNK_SIZE) -> Dict[str, Any]:
+    """
+    Copia la subida a un SpooledTemporaryFile calculando el SHA-256 al vuelo.
+    Devuelve {'file', 'size', 'sha256', 'spooled_bytes', 'on_disk'} donde
+    spooled_bytes es el máximo de bytes de esta copia retenidos en memoria a
+    la vez (parte en memoria del spool + bloque en curso); no cuenta el spool
+    de Starlette del que se lee.
+    """
+    if spool_max_bytes > 0:
+        spool = tempfile.SpooledTemporaryFile(max_size=spool_max_bytes)
+    else:
+        # Con max_size=0 SpooledTemporaryFile nunca pasaría a disco
+        spool = tempfile.TemporaryFile()
+    upload_hash = hashlib.sha256()
+    size = 0
+    spooled_bytes = 0
+    try:
+        async for chunk in iter_upload_chunks(file, max_bytes, chunk_size):
+            in_memory = size if size <= spool_max_bytes else 0
+            spooled_bytes = max(spooled_bytes, in_memory + len(chunk))
+            spool.write(chunk)
+            upload_hash.update(chunk)
+            size += len(chunk)
+    except BaseException:
+        spool.close()
+        raise
+    spool.seek(0)
+
+    return {
+        "file": spool,
+        "size": size,
+        "sha256": upload_hash.hexdigest(),
+        "spooled_bytes": max(spooled_bytes, size if size <= spool_max_bytes else 0),
+        "on_disk": size > spool_max_bytes,
+    }
+
+
+class RequestSizeLimitMiddleware:
+    """
+    Middleware ASGI que limita el tamaño del cuerpo de cada petición.
+    path_limits permite límites distintos por ruta (p. ej. lotes).
+    """
+
+    def __init__(self, app, max_bytes: int, path_limits: Optional[Dict[str, int]] = None):
+        self.app = app
+        self.max_bytes = max_bytes
+        self.path_limits = path_limits or {}
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] not in ("POST", "PUT", "PATCH"):
+            await self.app(scope, receive, send)
+            return
+
+        limit = self.path_limits.get(scope["path"], self.max_bytes)
+        if not limit:
+            await self.app(scope, receive, send)
+            return
+
+        headers = dict(scope["headers"])
+        content_length = headers.get(b"content-length")
+        if content_length is not None and content_length.isdigit() and int(content_length) > limit:
+            # Rechazo temprano: no se lee ni un byte del cuerpo
+            await self._reject(send, UploadTooLarge(limit, int(content_length)))
+            return
+
+        received = 0
+        response_started = False
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > limit:
+                    raise UploadTooLarge(limit, received)
+            return message
+
+        async def tracked_send(message):
+            nonlocal response_started
+            if message["type"] == "http.response.start":
+                response_started = True
+            await send(message)
+
+        try:
+            await self.app(scope, limited_receive, tracked_send)
+        except UploadTooLarge as e:
+            if response_started:
+                raise
+            await self._reject(send, e)
+
+    @staticmethod
+    async def _reject(send, error: UploadTooLarge):
+        body = json.dumps({"detail": error.detail}, ensure_ascii=False).encode("utf-8")
+        await send({
+            "type": "http.response.start",
+            "status": 413,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(body)).encode("ascii")),
+                (b"connection", b"close"),
+            ],
+        })
+        await send({"type": "http.response.body", "body": body})
@@ -0,0 +1,224 @@
+#!/usr/bin/env python3
+"""
+Sesiones de subida reanudable en disco local
+
+Los ingenieros de obra suben desde conexiones inestables: si se corta una
+subida de 150 MB a /extract-images hay que empezar de cero. Con una sesión el
+cliente envía el archivo por partes indicando el offset de cada una; si se
+corta, consulta el offset confirmado y continúa desde ahí. Cada sesión es un
+directorio con el archivo parcial y sus metadatos, y expira tras un TTL.
+"""
+
+import asyncio
+import hashlib
+import json
+import os
+import shutil
+import time
+import uuid
+from typing import Any, AsyncIterator, Dict, Optional
+
+DATA_FILE = "data.part"
+META_FILE = "session.json"
+
+
+def _write_chunk(data_file, upload_hash, chunk: bytes):
+    data_file.write(chunk)
+    upload_hash.update(chunk)
+
+
+class UploadSessionError(Exception):
+    """Operación no válida sobre una sesión; status_code es el código HTTP sugerido"""
+
+    def __init__(self, message: str, status_code: int = 409):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class UploadSessionStore:
+    """Sesiones de subida por partes guardadas en root_dir"""
+
+    def __init__(self, root_dir: str, ttl_seconds: int, max_bytes: int):
+        self.root_dir = root_dir
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = max_bytes
+        # Estado incremental del SHA-256 de cada sesión; si el proceso se
+        # reinicia se recalcula desde el archivo parcial
+        self._hashes: Dict[str, Any] = {}
+        self._locks: Dict[str, asyncio.Lock] = {}
+        self.expired = 0
+        os.makedirs(self.root_dir, exist_ok=True)
+
+    @staticmethod
+    def is_session_id(session_id: str) -> bool:
+        """Los ids son uuid4().hex: sin '.', '/' ni nada que salga de root_dir"""
+        return session_id.isascii() and session_id.isalnum()
+
+    def _session_dir(self, session_id: str) -> str:
+        """Directorio de la sesión; lanza KeyError si el id no es válido"""
+        if not self.is_session_id(session_id):
+            raise KeyError(session_id)
+        return os.path.join(self.root_dir, session_id)
+
+    def data_path(self, session_id: str) -> str:
+        return os.path.join(self._session_dir(session_id), DATA_FILE)
+
+    def _lock_for(self, session_id: str) -> asyncio.Lock:
+        return self._locks.setdefault(session_id, asyncio.Lock())
+
+    def _write_meta(self, session: Dict[str, Any]):
+        path = os.path.join(self._session_dir(session["id"]), META_FILE)
+        temp_path = f"{path}.tmp"
+        with open(temp_path, "w", encoding="utf-8") as meta_file:
+            json.dump(session, meta_file)
+        os.replace(temp_path, path)
+
+    def create(self, filename: str, size: Optional[int] = None, sha256: Optional[str] = None) -> Dict[str, Any]:
+        """Abre una sesión vacía; size y sha256 (opcionales) se validan al finalizar"""
+        if size is not None and self.max_bytes and size > self.max_bytes:
+            raise UploadSessionError(f"El archivo supera el tamaño máximo permitido ({self.max_bytes} bytes)", 413)
+
+        now = time.time()
+        session = {
+            "id": uuid.uuid4().hex,
+            "filename": filename,
+            "size": size,
+            "sha256": sha256.lower() if sha256 else None,
+            "offset": 0,
+            "created_at": now,
+            "expires_at": now + self.ttl_seconds,
+        }
+        os.makedirs(self._session_dir(session["id"]))
+        open(self.data_path(session["id"]), "wb").close()
+        self._write_meta(session)
+        self._hashes[session["id"]] = hashlib.sha256()
+        return session
+
+    def get(self, session_id: str) -> Optional[Dict[str, Any]]:
+        """Metadatos de la sesión o None si no existe o expiró"""
+        try:
+            path = os.path.join(self._session_dir(session_id), META_FILE)
+            with open(path, "r", encoding="utf-8") as meta_file:
+                session = json.load(meta_file)
+        except (KeyError, FileNotFoundError, ValueError):
+            return None
+        if session["expires_at"] <= time.time():
+            self.delete(session_id)
+            self.expired += 1
+            return None
+        return session
+
+    async def append(self, session_id: str, offset: int, chunks: AsyncIterator[bytes]) -> Dict[str, Any]:
+        """
+        Agrega una parte en el offset indicado, que debe coincidir con lo ya
+        recibido. chunks es el cuerpo de la petición por bloques. Renueva la
+        expiración. Dos partes de la misma sesión nunca se escriben a la vez.
+        La escritura a disco y el hash van en hilos para no bloquear el loop.
+        """
+        async with self._lock_for(session_id):
+            session = await asyncio.to_thread(self.get, session_id)
+            if session is None:
+                raise KeyError(session_id)
+            if offset != session["offset"]:
+                raise UploadSessionError(
+                    f"Offset {offset} no coincide con los {session['offset']} bytes ya recibidos"
+                )
+
+            upload_hash = await asyncio.to_thread(self._session_hash, session)
+            received = session["offset"]
+            limit = session["size"] or self.max_bytes
+            data_file = await asyncio.to_thread(open, self.data_path(session_id), "r+b")
+            try:
+                data_file.seek(received)
+                async for chunk in chunks:
+                    if limit and received + len(chunk) > limit:
+                        raise UploadSessionError(f"La parte supera el tamaño declarado ({limit} bytes)", 413)
+                    await asyncio.to_thread(_write_chunk, data_file, upload_hash, chunk)
+                    received += len(chunk)
+            except BaseException:
+                # Parte incompleta: se descarta para que el offset siga siendo confiable
+                data_file.truncate(session["offset"])
+                self._hashes.pop(session_id, None)
+                raise
+            finally:
+                data_file.close()
+
+            session["offset"] = received
+            session["expires_at"] = time.time() + self.ttl_seconds
+            await asyncio.to_thread(self._write_meta, session)
+            return session
+
+    def _session_hash(self, session: Dict[str, Any]):
+        upload_hash = self._hashes.get(session["id"])
+        if upload_hash is None:
+            upload_hash = hashlib.sha256()
+            with open(self.data_path(session["id"]), "rb") as data_file:
+                remaining = session["offset"]
+                while remaining > 0:
+                    chunk = data_file.read(min(1024 * 1024, remaining))
+                    if not chunk:
+                        break
+                    upload_hash.update(chunk)
+                    remaining -= len(chunk)
+            self._hashes[session["id"]] = upload_hash
+        return upload_hash
+
+    async def finalize(self, session_id: str) -> Dict[str, Any]:
+        """
+        Verifica tamaño y hash del archivo ensamblado y devuelve la sesión con
+        'sha256' y 'path' (el archivo parcial, sin copiarlo)
+        """
+        async with self._lock_for(session_id):
+            session = await asyncio.to_thread(self.get, session_id)
+            if session is None:
+                raise KeyError(session_id)
+            if session["size"] is not None and session["offset"] != session["size"]:
+                raise UploadSessionError(
+                    f"Subida incompleta: {session['offset']} de {session['size']} bytes"
+                )
+            if session["offset"] == 0:
+                raise UploadSessionError("La sesión no recibió datos")
+
+            # Tras un reinicio el hash se recalcula leyendo todo el archivo parcial
+            digest = (await asyncio.to_thread(self._session_hash, session)).hexdigest()
+            if session["sha256"] and session["sha256"] != digest:
+                raise UploadSessionError("El SHA-256 del archivo ensamblado no coincide con el declarado", 422)
+
+            session["sha256"] = digest
+            session["path"] = self.data_path(session_id)
+            return session
+
+    def delete(self, session_id: str) -> bool:
+        try:
+            session_dir = self._session_dir(session_id)
+        except KeyError:
+            return False
+        self._hashes.pop(session_id, None)
+        self._locks.pop(session_id, None)
+        # Nunca borrar fuera de root_dir (p. ej. un enlace simbólico con nombre de sesión)
+        resolved = os.path.realpath(session_dir)
+        if os.path.dirname(resolved) != os.path.realpath(self.root_dir) or not os.path.isdir(resolved):
+            return False
+        shutil.rmtree(resolved, ignore_errors=True)
+        return True
+
+    def purge_expired(self) -> int:
+        """Borra las sesiones vencidas (también las que quedaron de un reinicio)"""
+        before = self.expired
+        for session_id in os.listdir(self.root_dir):
+            if self.is_session_id(session_id) and os.path.isdir(self._session_dir(session_id)):
+                self.get(session_id)
+        return self.expired - before
+
+    def stats(self) -> Dict[str, Any]:
+        sessions = [
+            name for name in os.listdir(self.root_dir)
+            if self.is_session_id(name) and os.path.isdir(self._session_dir(name))
+        ]
+        return {
+            "root_dir": self.root_dir,
+            "sessions": len(sessions),
+            "ttl_seconds": self.ttl_seconds,
+            "max_bytes": self.max_bytes,
+            "expired": self.expired,
+        }
@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+"""
+Libros ingeridos para la API en dos fases (manifiesto + imágenes bajo demanda)
+
+POST /workbooks procesa el archivo una sola vez y guarda aquí el manifiesto y
+los blobs; GET /workbooks/{id}/images/{image_id} sirve los bytes de cada imagen
+solo cuando el modal los necesita. Cada libro expira tras un TTL sin uso.
+"""
+
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+from result_cache import result_size
+
+
+class WorkbookTooLarge(ValueError):
+    """El libro supera por sí solo el presupuesto en bytes del almacén"""
+
+
+class WorkbookStore:
+    """Almacén en memoria con expiración por inactividad y presupuesto en bytes"""
+
+    def __init__(self, ttl_seconds: int, max_bytes: int):
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = max_bytes
+        self._workbooks: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.expired = 0
+        self.evicted = 0
+
+    def add(self, manifest: Dict[str, Any], blobs: Dict[str, Dict[str, Any]], **metadata) -> Dict[str, Any]:
+        """Guarda un libro y devuelve su registro (id, expiración y metadatos)"""
+        size = result_size((manifest, blobs))
+        if size > self.max_bytes:
+            raise WorkbookTooLarge(f"El libro ocupa {size} bytes y supera el máximo del almacén ({self.max_bytes})")
+
+        now = time.time()
+        record = {
+            "id": uuid.uuid4().hex,
+            "manifest": manifest,
+            "blobs": blobs,
+            "bytes": size,
+            "created_at": now,
+            "expires_at": now + self.ttl_seconds,
+        }
+        record.update(metadata)
+
+        with self._lock:
+            self._purge_expired(now)
+            self._workbooks[record["id"]] = record
+            self._bytes += size
+            # Si no hay espacio se descartan los libros usados hace más tiempo
+            while self._bytes > self.max_bytes and len(self._workbooks) > 1:
+                _, old = self._workbooks.popitem(last=False)
+                self._bytes -= old["bytes"]
+                self.evicted += 1
+        return record
+
+    def get(self, workbook_id: str) -> Optional[Dict[str, Any]]:
+        """Devuelve el libro y renueva su expiración, o None si no existe o expiró"""
+        now = time.time()
+        with self._lock:
+            self._purge_expired(now)
+            record = self._workbooks.get(workbook_id)
+            if record is None:
+                return None
+            record["expires_at"] = now + self.ttl_seconds
+            self._workbooks.move_to_end(workbook_id)
+            return record
+
+    def get_blob(self, workbook_id: str, blob_id: str) -> Tuple[Optional[Dict[str, Any]], Optional[Dict[str, Any]]]:
+        """(libro, blob) para servir los bytes de una imagen"""
+        record = self.get(workbook_id)
+        if record is None:
+            return None, None
+        return record, record["blobs"].get(blob_id)
+
+    def delete(self, workbook_id: str) -> bool:
+        with self._lock:
+            record = self._workbooks.pop(workbook_id, None)
+            if record is None:
+                return False
+            self._bytes -= record["bytes"]
+            return True
+
+    def purge_expired(self) -> int:
+        with self._lock:
+            return self._purge_expired(time.time())
+
+    def _purge_expired(self, now: float) -> int:
+        expired_ids = [wid for wid, record in self._workbooks.items() if record["expires_at"] <= now]
+        for workbook_id in expired_ids:
+            record = self._workbooks.pop(workbook_id)
+            self._bytes -= record["bytes"]
+        self.expired += len(expired_ids)
+        return len(expired_ids)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "workbooks": len(self._workbooks),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "ttl_seconds": self.ttl_seconds,
+                "expired": self.expired,
+                "evicted": self.evicted,
+            }
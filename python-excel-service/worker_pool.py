@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+"""
+Pool de trabajadores para el trabajo pesado (ZIP, XML, base64) fuera del
+event loop de asyncio, con métricas de saturación
+"""
+
+import asyncio
+import os
+import threading
+import time
+from concurrent.futures import Executor, Future, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional
+
+POOL_KIND_THREAD = "thread"
+POOL_KIND_PROCESS = "process"
+POOL_KINDS = (POOL_KIND_THREAD, POOL_KIND_PROCESS)
+
+
+def _timed_call(fn: Callable, args: tuple, kwargs: dict):
+    """Ejecuta fn en el trabajador y devuelve también cuándo empezó y terminó"""
+    started_at = time.time()
+    result = fn(*args, **kwargs)
+    return result, started_at, time.time()
+
+
+class WorkerPool:
+    """Envuelve un ThreadPoolExecutor o ProcessPoolExecutor con contadores"""
+
+    def __init__(self, kind: str = POOL_KIND_PROCESS, max_workers: Optional[int] = None):
+        if kind not in POOL_KINDS:
+            raise ValueError(f"Tipo de pool no válido: {kind}. Use uno de {', '.join(POOL_KINDS)}")
+        self.kind = kind
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self._executor: Optional[Executor] = None
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._peak_in_flight = 0
+        self._submitted = 0
+        self._completed = 0
+        self._failed = 0
+        self._total_wait = 0.0
+        self._total_run = 0.0
+
+    @property
+    def started(self) -> bool:
+        return self._executor is not None
+
+    def start(self):
+        """Crea el executor (se llama desde el lifespan de la app)"""
+        if self._executor is not None:
+            return
+        if self.kind == POOL_KIND_PROCESS:
+            self._executor = ProcessPoolExecutor(max_workers=self.max_workers)
+        else:
+            self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="excel-worker")
+        print(f"Pool de trabajadores iniciado: {self.kind} x {self.max_workers}")
+
+    def shutdown(self, wait: bool = True):
+        if self._executor is None:
+            return
+        self._executor.shutdown(wait=wait, cancel_futures=True)
+        self._executor = None
+        print("Pool de trabajadores detenido")
+
+    async def run(self, fn: Callable, *args, **kwargs) -> Any:
+        """
+        Ejecuta fn(*args, **kwargs) en el pool sin bloquear el event loop.
+        Con pool de procesos fn y sus argumentos deben poder serializarse (pickle).
+        """
+        if self._executor is None:
+            # Uso fuera del lifespan (scripts, TestClient sin contexto)
+            self.start()
+
+        loop = asyncio.get_running_loop()
+        submitted_at = self._count_submitted()
+        try:
+            result, started_at, finished_at = await loop.run_in_executor(
+                self._executor, _timed_call, fn, args, kwargs
+            )
+        except BaseException:
+            self._count_failed()
+            raise
+
+        self._count_completed(submitted_at, started_at, finished_at)
+        return result
+
+    def submit(self, fn: Callable, *args, **kwargs) -> Future:
+        """
+        Como run pero desde código síncrono (p. ej. un generador que Starlette
+        recorre en un hilo): devuelve un Future con el resultado de fn.
+        """
+        if self._executor is None:
+            self.start()
+
+        submitted_at = self._count_submitted()
+        result_future: Future = Future()
+
+        def on_done(timed: Future):
+            if timed.cancelled():
+                self._count_failed()
+                result_future.cancel()
+                return
+            error = timed.exception()
+            if error is not None:
+                self._count_failed()
+                result_future.set_exception(error)
+                return
+            result, started_at, finished_at = timed.result()
+            self._count_completed(submitted_at, started_at, finished_at)
+            result_future.set_result(result)
+
+        self._executor.submit(_timed_call, fn, args, kwargs).add_done_callback(on_done)
+        return result_future
+
+    def _count_submitted(self) -> float:
+        with self._lock:
+            self._submitted += 1
+            self._in_flight += 1
+            self._peak_in_flight = max(self._peak_in_flight, self._in_flight)
+        return time.time()
+
+    def _count_failed(self):
+        with self._lock:
+            self._in_flight -= 1
+            self._failed += 1
+
+    def _count_completed(self, submitted_at: float, started_at: float, finished_at: float):
+        with self._lock:
+            self._in_flight -= 1
+            self._completed += 1
+            self._total_wait += max(0.0, started_at - submitted_at)
+            self._total_run += finished_at - started_at
+
+    def metrics(self) -> Dict[str, Any]:
+        """Estado del pool: trabajos activos, en cola y tiempos medios"""
+        with self._lock:
+            in_flight = self._in_flight
+            finished = self._completed
+            return {
+                "kind": self.kind,
+                "started": self.started,
+                "max_workers": self.max_workers,
+                "active": min(in_flight, self.max_workers),
+                "queued": max(0, in_flight - self.max_workers),
+                "saturation": round(in_flight / self.max_workers, 3),
+                "peak_in_flight": self._peak_in_flight,
+                "submitted": self._submitted,
+                "completed": self._completed,
+                "failed": self._failed,
+                "avg_wait_ms": round(self._total_wait / finished * 1000, 2) if finished else 0.0,
+                "avg_run_ms": round(self._total_run / finished * 1000, 2) if finished else 0.0,
+            }
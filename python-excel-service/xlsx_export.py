@@ -0,0 +1,320 @@
+#!/usr/bin/env python3
+"""
+Exportación de productos a .xlsx en streaming con imágenes de diseño
+
+Los scripts create_* armaban el libro con openpyxl.Workbook() y ws.add_image
+completamente en memoria. Aquí el paquete se escribe con zipfile sobre un
+destino sin seek: la hoja se emite fila por fila (texto en línea, sin tabla de
+cadenas compartidas) y lo ya comprimido se entrega al cliente en cada
+drain(). Cada imagen distinta va una sola vez a xl/media y todas las filas que
+la usan la referencian desde su propio ancla en el dibujo. El formato es el
+de la hoja DETALLE (encabezados en la fila 5), así que el archivo se puede
+volver a importar.
+"""
+
+import math
+import re
+import zipfile
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+from xml.sax.saxutils import escape
+
+from openpyxl.utils import get_column_letter
+
+from drawing_anchors import NS_A, NS_MAIN, NS_PKG_REL, NS_REL, NS_XDR, REL_TYPE_DRAWING, REL_TYPE_IMAGE
+from media_store import image_dimensions
+from sheet_rows import HEADER_ROW
+from zip_utils import ChunkSink
+
+EXPORT_SHEET = "DETALLE"
+DESIGN_FIELD = "diseno_1"
+# Columnas por defecto: encabezados del mapeo automático de la importación
+DEFAULT_EXPORT_COLUMNS: List[Dict[str, Any]] = [
+    {"field": "ubicacion", "header": "Location", "width": 12},
+    {"field": "codigo", "header": "WINDOW CODE", "width": 16},
+    {"field": "ancho_m", "header": "Width (m)", "width": 11},
+    {"field": "alto_m", "header": "Height (m)", "width": 11},
+    {"field": DESIGN_FIELD, "header": "Design 1", "width": 22},
+    {"field": "cantidad_por_unidad", "header": "Quantity", "width": 10},
+    {"field": "superficie", "header": "Surface (m²)", "width": 12},
+    {"field": "superficie_total", "header": "Total Surface (m²)", "width": 16},
+    {"field": "material", "header": "Material", "width": 14},
+    {"field": "tipo_vidrio", "header": "Glass Type", "width": 14},
+    {"field": "perfil_mm", "header": "Profile (mm)", "width": 12},
+    {"field": "precio_unitario_usd", "header": "Unit Price USD", "width": 14},
+    {"field": "precio_total_pieza_usd", "header": "Piece Total USD", "width": 15},
+]
+DEFAULT_COLUMN_WIDTH = 12
+MAX_EXPORT_ROWS = 200000
+MAX_EXPORT_COLUMNS = 200
+
+# Filas de la hoja: título arriba, encabezados en HEADER_ROW y datos debajo
+TITLE_ROW = 1
+FIRST_DATA_ROW = HEADER_ROW + 1
+IMAGE_ROW_HEIGHT = 75  # puntos
+IMAGE_MARGIN_PX = 4
+EMU_PER_PIXEL = 9525
+# Filas escritas entre cada entrega de bytes al cliente
+FLUSH_ROWS = 500
+
+STYLE_HEADER = 1
+STYLE_TITLE = 2
+
+# Firma -> (extensión, tipo de contenido) de los formatos que Excel muestra
+IMAGE_FORMATS = [
+    (b"\x89PNG\r\n\x1a\n", "png", "image/png"),
+    (b"\xff\xd8", "jpeg", "image/jpeg"),
+    (b"GIF8", "gif", "image/gif"),
+    (b"BM", "bmp", "image/bmp"),
+]
+
+CT_WORKBOOK = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"
+CT_WORKSHEET = "application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"
+CT_STYLES = "application/vnd.openxmlformats-officedocument.spreadsheetml.styles+xml"
+CT_DRAWING = "application/vnd.openxmlformats-officedocument.drawing+xml"
+REL_TYPE_OFFICE_DOCUMENT = NS_REL + "/officeDocument"
+REL_TYPE_STYLES = NS_REL + "/styles"
+
+XML_HEADER = '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+
+STYLES_XML = (
+    f'{XML_HEADER}<styleSheet xmlns="{NS_MAIN}">'
+    '<fonts count="3"><font><sz val="11"/><name val="Calibri"/></font>'
+    '<font><b/><sz val="11"/><name val="Calibri"/></font>'
+    '<font><b/><sz val="14"/><name val="Calibri"/></font></fonts>'
+    '<fills count="3"><fill><patternFill patternType="none"/></fill>'
+    '<fill><patternFill patternType="gray125"/></fill>'
+    '<fill><patternFill patternType="solid"><fgColor rgb="FFDDDDDD"/><bgColor indexed="64"/></patternFill></fill>'
+    '</fills>'
+    '<borders count="1"><border><left/><right/><top/><bottom/><diagonal/></border></borders>'
+    '<cellStyleXfs count="1"><xf numFmtId="0" fontId="0" fillId="0" borderId="0"/></cellStyleXfs>'
+    '<cellXfs count="3"><xf numFmtId="0" fontId="0" fillId="0" borderId="0" xfId="0"/>'
+    '<xf numFmtId="0" fontId="1" fillId="2" borderId="0" xfId="0" applyFont="1" applyFill="1"/>'
+    '<xf numFmtId="0" fontId="2" fillId="0" borderId="0" xfId="0" applyFont="1"/></cellXfs>'
+    '<cellStyles count="1"><cellStyle name="Normal" xfId="0" builtinId="0"/></cellStyles>'
+    '</styleSheet>'
+)
+
+# Caracteres de control que XML 1.0 no admite y límite de texto por celda de Excel
+_INVALID_XML_CHARS = re.compile("[\x00-\x08\x0b\x0c\x0e-\x1f]")
+MAX_CELL_TEXT = 32767
+
+ImageSource = Callable[[Dict[str, Any]], Optional[Tuple[str, bytes]]]
+
+
+def image_format(data: bytes) -> Optional[Tuple[str, str]]:
+    for signature, extension, content_type in IMAGE_FORMATS:
+        if data.startswith(signature):
+            return extension, content_type
+    return None
+
+
+def parse_export(export: Any) -> List[Dict[str, Any]]:
+    """Valida el cuerpo de la exportación y devuelve las columnas; lanza ValueError"""
+    if not isinstance(export, dict):
+        raise ValueError("La exportación debe ser un objeto JSON")
+    products = export.get("productos")
+    if not isinstance(products, list) or not all(isinstance(product, dict) for product in products):
+        raise ValueError("La exportación requiere una lista 'productos' de objetos")
+    if len(products) > MAX_EXPORT_ROWS:
+        raise ValueError(f"La exportación supera el máximo de {MAX_EXPORT_ROWS} productos")
+
+    columns = export.get("columns")
+    if columns is None:
+        return DEFAULT_EXPORT_COLUMNS
+    if not isinstance(columns, list) or not columns or len(columns) > MAX_EXPORT_COLUMNS:
+        raise ValueError(f"'columns' debe ser una lista de 1 a {MAX_EXPORT_COLUMNS} columnas")
+    parsed = []
+    for index, column in enumerate(columns):
+        if not isinstance(column, dict) or not isinstance(column.get("field"), str):
+            raise ValueError(f"Columna {index}: se requiere un objeto con 'field'")
+        width = column.get("width", DEFAULT_COLUMN_WIDTH)
+        if isinstance(width, bool) or not isinstance(width, (int, float)) or not 1 <= width <= 255:
+            raise ValueError(f"Columna {index}: 'width' debe ser un número entre 1 y 255")
+        parsed.append({
+            "field": column["field"],
+            "header": str(column.get("header") or column["field"]),
+            "width": width
+        })
+    return parsed
+
+
+def _cell(reference: str, value: Any, style: int = 0) -> str:
+    style_attr = f' s="{style}"' if style else ""
+    if isinstance(value, bool):
+        return f'<c r="{reference}" t="b"{style_attr}><v>{int(value)}</v></c>'
+    if isinstance(value, (int, float)):
+        return f'<c r="{reference}"{style_attr}><v>{value!r}</v></c>'
+    text = escape(_INVALID_XML_CHARS.sub("", str(value))[:MAX_CELL_TEXT])
+    return f'<c r="{reference}" t="inlineStr"{style_attr}><is><t xml:space="preserve">{text}</t></is></c>'
+
+
+def _row(row_number: int, cells: List[str], height: Optional[float] = None) -> str:
+    height_attr = f' ht="{height}" customHeight="1"' if height else ""
+    return f'<row r="{row_number}"{height_attr}>{"".join(cells)}</row>'
+
+
+def column_pixels(width: float) -> int:
+    """Ancho de columna de Excel (en caracteres) a píxeles en pantalla"""
+    return int(width * 7 + 5)
+
+
+def anchor_xml(index: int, column: int, row_number: int, rel_id: str,
+               width_px: int, height_px: int) -> str:
+    """Ancla de una celda con la imagen ya ajustada al tamaño de la celda"""
+    cx, cy = width_px * EMU_PER_PIXEL, height_px * EMU_PER_PIXEL
+    offset = IMAGE_MARGIN_PX * EMU_PER_PIXEL
+    return (
+        f'<xdr:oneCellAnchor><xdr:from><xdr:col>{column - 1}</xdr:col><xdr:colOff>{offset}</xdr:colOff>'
+        f'<xdr:row>{row_number - 1}</xdr:row><xdr:rowOff>{offset}</xdr:rowOff></xdr:from>'
+        f'<xdr:ext cx="{cx}" cy="{cy}"/>'
+        f'<xdr:pic><xdr:nvPicPr><xdr:cNvPr id="{index + 1}" name="Imagen {index}"/>'
+        f'<xdr:cNvPicPr><a:picLocks noChangeAspect="1"/></xdr:cNvPicPr></xdr:nvPicPr>'
+        f'<xdr:blipFill><a:blip r:embed="{rel_id}"/><a:stretch><a:fillRect/></a:stretch></xdr:blipFill>'
+        f'<xdr:spPr><a:xfrm><a:off x="0" y="0"/><a:ext cx="{cx}" cy="{cy}"/></a:xfrm>'
+        f'<a:prstGeom prst="rect"><a:avLst/></a:prstGeom></xdr:spPr></xdr:pic>'
+        f'<xdr:clientData/></xdr:oneCellAnchor>'
+    )
+
+
+def fit_image(pixel_width: Optional[int], pixel_height: Optional[int], box_width: int, box_height: int) -> Tuple[int, int]:
+    if not pixel_width or not pixel_height:
+        return box_width, box_height
+    scale = min(box_width / pixel_width, box_height / pixel_height)
+    return max(1, int(pixel_width * scale)), max(1, int(pixel_height * scale))
+
+
+def relationships_xml(relations: List[Tuple[str, str, str]]) -> str:
+    items = "".join(f'<Relationship Id="{rel_id}" Type="{rel_type}" Target="{target}"/>'
+                    for rel_id, rel_type, target in relations)
+    return f'{XML_HEADER}<Relationships xmlns="{NS_PKG_REL}">{items}</Relationships>'
+
+
+def iter_xlsx_export(products: List[Dict[str, Any]], columns: List[Dict[str, Any]],
+                     image_source: Optional[ImageSource] = None, title: str = "",
+                     stats: Optional[Dict[str, int]] = None) -> Iterator[bytes]:
+    """
+    Bytes del .xlsx por partes. image_source(producto) devuelve (clave de
+    contenido, bytes) o None; las imágenes con la misma clave se escriben una
+    vez. stats, si se pasa, recibe filas, imágenes distintas y anclas.
+    """
+    sink = ChunkSink()
+    design_column = next(
+        (index for index, column in enumerate(columns, 1) if column["field"] == DESIGN_FIELD), None
+    )
+    image_box = (
+        max(1, column_pixels(columns[design_column - 1]["width"]) - 2 * IMAGE_MARGIN_PX) if design_column else 0,
+        int(IMAGE_ROW_HEIGHT * 4 / 3) - 2 * IMAGE_MARGIN_PX
+    )
+    letters = [get_column_letter(index) for index in range(1, len(columns) + 1)]
+
+    # Clave de contenido -> (parte xl/media, rel id, datos, ancho px, alto px)
+    media: Dict[str, Tuple[str, str, bytes, Optional[int], Optional[int]]] = {}
+    extensions: Dict[str, str] = {}
+    anchors: List[Tuple[int, str, Tuple[int, int]]] = []
+
+    with zipfile.ZipFile(sink, "w", zipfile.ZIP_DEFLATED) as package:
+        package.writestr("_rels/.rels", relationships_xml([("rId1", REL_TYPE_OFFICE_DOCUMENT, "xl/workbook.xml")]))
+        package.writestr("xl/workbook.xml", (
+            f'{XML_HEADER}<workbook xmlns="{NS_MAIN}" xmlns:r="{NS_REL}">'
+            f'<sheets><sheet name="{EXPORT_SHEET}" sheetId="1" r:id="rId1"/></sheets></workbook>'
+        ))
+        package.writestr("xl/_rels/workbook.xml.rels", relationships_xml([
+            ("rId1", NS_REL + "/worksheet", "worksheets/sheet1.xml"),
+            ("rId2", REL_TYPE_STYLES, "styles.xml"),
+        ]))
+        package.writestr("xl/styles.xml", STYLES_XML)
+
+        with package.open("xl/worksheets/sheet1.xml", "w") as sheet:
+            cols = "".join(
+                f'<col min="{index}" max="{index}" width="{column["width"]}" customWidth="1"/>'
+                for index, column in enumerate(columns, 1)
+            )
+            sheet.write((
+                f'{XML_HEADER}<worksheet xmlns="{NS_MAIN}" xmlns:r="{NS_REL}">'
+                f'<cols>{cols}</cols><sheetData>'
+            ).encode())
+            if title:
+                sheet.write(_row(TITLE_ROW, [_cell(f"A{TITLE_ROW}", title, STYLE_TITLE)]).encode())
+            sheet.write(_row(HEADER_ROW, [
+                _cell(f"{letter}{HEADER_ROW}", column["header"], STYLE_HEADER)
+                for letter, column in zip(letters, columns)
+            ]).encode())
+            yield sink.drain()
+
+            for index, product in enumerate(products):
+                row_number = FIRST_DATA_ROW + index
+                cells = []
+                for letter, column in zip(letters, columns):
+                    value = product.get(column["field"])
+                    # La celda de diseño lleva la imagen, no el valor
+                    if value is None or value == "" or column["field"] == DESIGN_FIELD:
+                        continue
+                    if isinstance(value, float) and not math.isfinite(value):
+                        continue
+                    cells.append(_cell(f"{letter}{row_number}", value))
+
+                image = image_source(product) if image_source and design_column else None
+                if image is not None:
+                    key, data = image
+                    if key not in media:
+                        detected = image_format(data)
+                        if detected is not None:
+                            extension, content_type = detected
+                            extensions[extension] = content_type
+                            media[key] = (f"image{len(media) + 1}.{extension}", f"rId{len(media) + 1}",
+                                          data, *image_dimensions(data))
+                    if key in media:
+                        _, _, _, pixel_width, pixel_height = media[key]
+                        anchors.append((row_number, key, fit_image(pixel_width, pixel_height, *image_box)))
+
+                has_image = bool(anchors) and anchors[-1][0] == row_number
+                sheet.write(_row(row_number, cells, IMAGE_ROW_HEIGHT if has_image else None).encode())
+                if (index + 1) % FLUSH_ROWS == 0:
+                    yield sink.drain()
+
+            sheet.write(b"</sheetData>" + (b'<drawing r:id="rId1"/>' if anchors else b"") + b"</worksheet>")
+        yield sink.drain()
+
+        if anchors:
+            with package.open("xl/drawings/drawing1.xml", "w") as drawing:
+                drawing.write(
+                    f'{XML_HEADER}<xdr:wsDr xmlns:xdr="{NS_XDR}" xmlns:a="{NS_A}" xmlns:r="{NS_REL}">'.encode()
+                )
+                for index, (row_number, key, (width_px, height_px)) in enumerate(anchors, 1):
+                    drawing.write(anchor_xml(
+                        index, design_column, row_number, media[key][1], width_px, height_px
+                    ).encode())
+                    if index % FLUSH_ROWS == 0:
+                        yield sink.drain()
+                drawing.write(b"</xdr:wsDr>")
+            package.writestr("xl/drawings/_rels/drawing1.xml.rels", relationships_xml([
+                (rel_id, REL_TYPE_IMAGE, f"../media/{name}") for name, rel_id, _, _, _ in media.values()
+            ]))
+            package.writestr("xl/worksheets/_rels/sheet1.xml.rels", relationships_xml([
+                ("rId1", REL_TYPE_DRAWING, "../drawings/drawing1.xml")
+            ]))
+            # Las imágenes ya vienen comprimidas: se guardan sin deflate
+            for name, _, data, _, _ in media.values():
+                package.writestr(f"xl/media/{name}", data, compress_type=zipfile.ZIP_STORED)
+                yield sink.drain()
+
+        defaults = "".join(
+            f'<Default Extension="{extension}" ContentType="{content_type}"/>'
+            for extension, content_type in sorted(extensions.items())
+        )
+        drawing_override = (
+            f'<Override PartName="/xl/drawings/drawing1.xml" ContentType="{CT_DRAWING}"/>' if anchors else ""
+        )
+        package.writestr("[Content_Types].xml", (
+            f'{XML_HEADER}<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+            '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+            f'<Default Extension="xml" ContentType="application/xml"/>{defaults}'
+            f'<Override PartName="/xl/workbook.xml" ContentType="{CT_WORKBOOK}"/>'
+            f'<Override PartName="/xl/worksheets/sheet1.xml" ContentType="{CT_WORKSHEET}"/>'
+            f'<Override PartName="/xl/styles.xml" ContentType="{CT_STYLES}"/>{drawing_override}'
+            '</Types>'
+        ))
+    yield sink.drain()
+
+    if stats is not None:
+        stats.update(rows=len(products), images=len(media), anchors=len(anchors))
@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+"""
+Utilidades de bajo nivel sobre el paquete ZIP de un .xlsx
+"""
+
+import struct
+import zipfile
+
+LOCAL_HEADER_SIGNATURE = b"PK\x03\x04"
+LOCAL_HEADER_SIZE = 30
+ENCRYPTED_FLAG = 0x01
+DATA_DESCRIPTOR_FLAG = 0x08
+
+
+class ChunkSink:
+    """
+    Destino de ZipFile sin tell/seek: zipfile escribe entonces cada entrada
+    con descriptor de datos y no vuelve atrás. Acumula lo escrito hasta
+    drain(), para entregar el ZIP por partes mientras se genera.
+    """
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data) -> int:
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def read_compressed_bytes(zip_file: zipfile.ZipFile, info: zipfile.ZipInfo) -> bytes:
+    """
+    Lee los bytes comprimidos de una entrada tal como están en el ZIP, sin
+    descomprimirlos. Sirve para comparar entradas o copiarlas sin recomprimir.
+    Toma el lock del ZipFile, el mismo con el que zipfile reposiciona el
+    archivo compartido antes de cada lectura de un ZipExtFile abierto.
+    """
+    with zip_file._lock:
+        fp = zip_file.fp
+        fp.seek(info.header_offset)
+        header = fp.read(LOCAL_HEADER_SIZE)
+        if header[:4] != LOCAL_HEADER_SIGNATURE:
+            raise zipfile.BadZipFile(f"Cabecera local inválida para {info.filename}")
+
+        name_length, extra_length = struct.unpack("<HH", header[26:30])
+        fp.seek(info.header_offset + LOCAL_HEADER_SIZE + name_length + extra_length)
+        return fp.read(info.compress_size)
+
+
+def copy_compressed_entry(source: zipfile.ZipFile, info: zipfile.ZipInfo, target: zipfile.ZipFile):
+    """
+    Copia una entrada a un ZIP abierto en escritura sin descomprimirla ni
+    recomprimirla: cabecera local nueva y los bytes comprimidos originales.
+    zipfile no expone escritura de datos ya comprimidos, así que se replica
+    lo que hace ZipFile.writestr con su estado interno.
+    """
+    data = read_compressed_bytes(source, info)
+    copy = zipfile.ZipInfo(info.filename, info.date_time)
+    copy.compress_type = info.compress_type
+    copy.CRC = info.CRC
+    copy.compress_size = info.compress_size
+    copy.file_size = info.file_size
+    copy.external_attr = info.external_attr
+    copy.create_system = info.create_system
+    # Sin descriptor de datos: tamaños y CRC ya van en la cabecera local
+    copy.flag_bits = info.flag_bits & ~(DATA_DESCRIPTOR_FLAG | ENCRYPTED_FLAG)
+    zip64 = copy.file_size > zipfile.ZIP64_LIMIT or copy.compress_size > zipfile.ZIP64_LIMIT
+
+    # Las mismas comprobaciones y pasos que ZipFile.writestr, bajo el lock del ZIP de destino
+    if not target.fp:
+        raise ValueError("Attempt to write to ZIP archive that was already closed")
+    if target._writing:
+        raise ValueError("Can't write to ZIP archive while an open writing handle exists")
+    with target._lock:
+        if target._seekable:
+            target.fp.seek(target.start_dir)
+        copy.header_offset = target.fp.tell()
+        target._writecheck(copy)
+        target._didModify = True
+        target.fp.write(copy.FileHeader(zip64))
+        target.fp.write(data)
+        target.filelist.append(copy)
+        target.NameToInfo[copy.filename] = copy
+        target.start_dir = target.fp.tell()
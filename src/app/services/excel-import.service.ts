@@ -19,6 +19,28 @@ export interface ExtractedImage {
   column?: number;
   columnLetter?: string;
   anchorType?: string;
+  mediaPart?: string; // parte xl/media referenciada por el anclaje
+  blobId?: string; // hash SHA-256 del contenido (con dedupe=true los datos están en `blobs`)
+}
+
+// Contenido único de imagen, compartido por varios anclajes
+export interface ExtractedBlob {
+  id: string;
+  data: string; // base64
+  mimeType: string;
+  size: number;
+  extension: string;
+  width?: number | null;
+  height?: number | null;
+}
+
+// Imagen de xl/media que no está anclada en la columna de diseño
+export interface UnanchoredMedia {
+  filename: string;
+  mediaPart: string;
+  size: number;
+  extension: string;
+  blobId?: string;
 }
 
 export interface ImageExtractionResponse {
@@ -26,6 +48,150 @@ export interface ImageExtractionResponse {
   message: string;
   images: ExtractedImage[];
   count: number;
+  unanchoredMedia?: UnanchoredMedia[];
+  blobs?: ExtractedBlob[];
+}
+
+// Fila de datos devuelta por /parse-rows (valores alineados con headers)
+export interface ParsedRow {
+  row: number;
+  values: (string | number | boolean | null)[];
+  // Con colors=true: id en palette por cada celda
+  styles?: number[];
+}
+
+// Par de colores compartido por todas las celdas con el mismo estilo
+export interface CellColors {
+  backgroundColor: string;
+  fontColor: string;
+}
+
+export interface ParsedRowsResponse {
+  success: boolean;
+  sheet: string;
+  headerRow: number;
+  headers: string[];
+  palette?: CellColors[];
+  headerStyles?: number[];
+  offset: number;
+  limit: number;
+  count: number;
+  nextOffset: number | null;
+  rows: ParsedRow[];
+}
+
+// Imagen de diseño anclada en una fila de /parse-rows-with-images
+export interface RowImageRef {
+  blobId: string;
+  mediaPart: string;
+  cellAddress: string;
+  anchorType: string;
+}
+
+export interface ParsedRowWithImages extends ParsedRow {
+  images: RowImageRef[];
+}
+
+export interface RowImageBlob extends ExtractedBlob {
+  mediaPart: string;
+}
+
+export interface ParsedRowsWithImagesResponse extends Omit<ParsedRowsResponse, 'rows'> {
+  designColumn: number;
+  designColumnLetter: string;
+  linkedImages: number;
+  otherAnchors: { mediaPart: string; cellAddress: string | null; anchorType: string }[];
+  unanchoredMedia: UnanchoredMedia[];
+  rows: ParsedRowWithImages[];
+  blobs: RowImageBlob[];
+}
+
+// Columna importada por /import-columns: valores ya convertidos al tipo del campo
+export interface ImportedColumn {
+  header: string;
+  column: number;
+  columnLetter: string;
+  type: 'number' | 'integer' | 'text';
+  values: (number | string | null)[];
+  nullCount: number;
+  errorCount: number;
+  // Bitmap en base64: bit i (LSB primero) = celda de la posición i con error
+  errors: string;
+}
+
+// Columna recalculada (superficie, superficie total, precio base)
+export interface ComputedColumn {
+  inputs: string[];
+  values: (number | null)[];
+  computedCount: number;
+  filledCount: number;
+  mismatchCount: number;
+  // Bitmap en base64 de filas cuyo valor guardado difiere del calculado
+  mismatches: string;
+}
+
+// Regla de validación declarativa de /import-columns
+export interface ImportValidationRule {
+  id?: string;
+  type: 'required' | 'range' | 'unique' | 'allowed';
+  field: string;
+  min?: number;
+  max?: number;
+  values?: string[];
+  message?: string;
+}
+
+// Fallas de una regla agrupadas en tramos de filas de Excel [desde, hasta]
+export interface ImportRuleFailure {
+  id: string;
+  type: ImportValidationRule['type'] | 'type';
+  field: string;
+  message: string;
+  count: number;
+  rows: [number, number][];
+  truncated: boolean;
+  missingColumn?: boolean;
+}
+
+export interface ImportValidationSummary {
+  valid: boolean;
+  rulesEvaluated: number;
+  issueCount: number;
+  invalidRowCount: number;
+  rules: ImportRuleFailure[];
+}
+
+export interface ColumnarImportResponse {
+  success: boolean;
+  sheet: string;
+  headerRow: number;
+  rowCount: number;
+  rows: number[];
+  errorEncoding: string;
+  columns: { [field: string]: ImportedColumn };
+  missingFields: string[];
+  computed?: { [field: string]: ComputedColumn };
+  tolerance?: number;
+  mismatchRows?: number[];
+  validation?: ImportValidationSummary;
+}
+
+export interface OfferPdfRequest {
+  workbookId?: string;
+  fecha?: string;
+  cliente?: { nombre?: string; [key: string]: any };
+  cubicacion?: { codigo?: string; nombre?: string; proyecto?: string; [key: string]: any };
+  // Cada producto puede indicar su imagen con 'imageId' (blobId) o 'row' (fila de Excel)
+  productos: { imageId?: string; row?: number; [key: string]: any }[];
+}
+
+export interface ProductExportRequest {
+  workbookId?: string;
+  filename?: string;
+  title?: string;
+  // Sin columnas se usan las de la hoja DETALLE; el campo 'diseno_1' lleva la imagen
+  columns?: { field: string; header?: string; width?: number }[];
+  productos: { imageId?: string; row?: number; [key: string]: any }[];
 }
 
 @Injectable({
@@ -638,6 +804,129 @@ export class ExcelImportService {
     );
   }
 
+  /**
+   * Lee una página de filas tipadas de la hoja DETALLE en el servidor Python
+   * (sin parsear el libro en el navegador). Con colors los colores de celda
+   * llegan como ids de una paleta compartida
+   */
+  parseRows(file: File, offset = 0, limit = 500, colors = false): Observable<ParsedRowsResponse> {
+    const formData = new FormData();
+    formData.append('file', file, file.name);
+
+    return this.http.post<ParsedRowsResponse>(
+      `${this.PYTHON_API_URL}/parse-rows`,
+      formData,
+      { params: { header_row: this.START_ROW, offset, limit, colors } }
+    );
+  }
+
+  /**
+   * Filas de la hoja DETALLE con sus imágenes de diseño ya unidas por fila
+   * (una sola lectura del libro en el servidor)
+   */
+  parseRowsWithImages(file: File, offset = 0, limit = 500, colors = false): Observable<ParsedRowsWithImagesResponse> {
+    const formData = new FormData();
+    formData.append('file', file, file.name);
+
+    return this.http.post<ParsedRowsWithImagesResponse>(
+      `${this.PYTHON_API_URL}/parse-rows-with-images`,
+      formData,
+      { params: { header_row: this.START_ROW, offset, limit, colors } }
+    );
+  }
+
+  /**
+   * Importa las columnas del mapeo en el servidor Python: una lectura de la
+   * hoja y conversión por columna (coma decimal, unidades, blancos)
+   */
+  importColumns(
+    file: File,
+    columnMapping: { [key: string]: string },
+    types?: { [key: string]: 'number' | 'integer' | 'text' },
+    rules?: ImportValidationRule[]
+  ): Observable<ColumnarImportResponse> {
+    const formData = new FormData();
+    formData.append('file', file, file.name);
+    formData.append('mapping', JSON.stringify(columnMapping));
+    if (types) {
+      formData.append('types', JSON.stringify(types));
+    }
+    if (rules) {
+      formData.append('rules', JSON.stringify(rules));
+    }
+
+    return this.http.post<ColumnarImportResponse>(
+      `${this.PYTHON_API_URL}/import-columns`,
+      formData,
+      { params: { header_row: this.START_ROW } }
+    );
+  }
+
+  /**
+   * Posiciones (índices de 'rows') con error en una columna importada
+   */
+  importErrorPositions(column: ImportedColumn): number[] {
+    const positions: number[] = [];
+    if (!column.errorCount) {
+      return positions;
+    }
+    const bitmap = atob(column.errors);
+    for (let byteIndex = 0; byteIndex < bitmap.length; byteIndex++) {
+      const byte = bitmap.charCodeAt(byteIndex);
+      for (let bit = 0; byte && bit < 8; bit++) {
+        if ((byte >> bit) & 1) {
+          positions.push(byteIndex * 8 + bit);
+        }
+      }
+    }
+    return positions;
+  }
+
+  /**
+   * Convierte la hoja DETALLE en una tabla PDF paginada en el servidor Python
+   * (anchos, colores e imágenes de diseño del libro)
+   */
+  sheetToPdf(file: File): Observable<Blob> {
+    const formData = new FormData();
+    formData.append('file', file, file.name);
+
+    return this.http.post(`${this.PYTHON_API_URL}/sheet-to-pdf`, formData, {
+      params: { header_row: this.START_ROW },
+      responseType: 'blob'
+    });
+  }
+
+  /**
+   * Exporta productos a Excel en el servidor Python; el libro llega por
+   * partes y cada imagen de diseño distinta se guarda una sola vez
+   */
+  exportProducts(request: ProductExportRequest): Observable<Blob> {
+    return this.http.post(`${this.PYTHON_API_URL}/exports/products`, request, { responseType: 'blob' });
+  }
+
+  /**
+   * Rellena una plantilla de cubicación ({{marcadores}} y filas repetidas
+   * por lista) en el servidor Python sin recargar la plantilla completa
+   */
+  fillTemplate(template: File, data: Record<string, any>, sheet?: string): Observable<Blob> {
+    const formData = new FormData();
+    formData.append('file', template, template.name);
+    formData.append('data', JSON.stringify(data));
+
+    return this.http.post(`${this.PYTHON_API_URL}/templates/fill`, formData, {
+      params: sheet ? { sheet } : {},
+      responseType: 'blob'
+    });
+  }
+
+  /**
+   * Compone el PDF de la oferta en el servidor Python (texto real y cada
+   * imagen del libro ingerido incrustada una sola vez)
+   */
+  renderOfferPdf(offer: OfferPdfRequest): Observable<Blob> {
+    return this.http.post(`${this.PYTHON_API_URL}/offers/pdf`, offer, { responseType: 'blob' });
+  }
+
   /**
    * Verifica si el servidor Python está disponible
    */